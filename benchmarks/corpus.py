@@ -0,0 +1,138 @@
+# Offline HTML corpus used by the extraction benchmarks
+#
+# Usage:
+#   python -m benchmarks.corpus record overview https://www.kinobox.cz/film/123-movie-title
+#   python -m benchmarks.corpus record comments https://www.kinobox.cz/film/123-movie-title/komentare --render
+#   python -m benchmarks.corpus list
+import json
+import os
+import re
+import sys
+import urllib.request
+
+from scrapy.http import HtmlResponse
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+INDEX_PATH = os.path.join(CORPUS_DIR, "index.json")
+GOLDEN_DIR = os.path.join(CORPUS_DIR, "golden")
+
+PAGE_KINDS = ("overview", "ranking", "comments")
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+
+def load_index() -> list:
+    """
+    Load the corpus index.
+
+    Returns:
+        list: The corpus entries with name, kind, url and file, synthetic for pages written by hand instead of recorded.
+    """
+    if not os.path.exists(INDEX_PATH):
+        return []
+
+    with open(INDEX_PATH, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_index(index: list) -> None:
+    with open(INDEX_PATH, "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=4, ensure_ascii=False)
+        file.write("\n")
+
+
+def load_response(entry: dict) -> HtmlResponse:
+    """
+    Load the recorded page as a Scrapy response.
+
+    Args:
+        entry (dict): The corpus entry.
+
+    Returns:
+        HtmlResponse: The response with the recorded HTML.
+    """
+    with open(os.path.join(CORPUS_DIR, entry["file"]), "rb") as file:
+        body = file.read()
+
+    return HtmlResponse(url=entry["url"], body=body, encoding="utf-8")
+
+
+def fetch(url: str, render: bool) -> bytes:
+    """
+    Download the page, optionally rendered in a browser.
+
+    Args:
+        url (str): The page url.
+        render (bool): True to render the page with Playwright like the browser fallback does.
+
+    Returns:
+        bytes: The page HTML.
+    """
+    if not render:
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch()
+        page = browser.new_page(user_agent=USER_AGENT)
+        page.goto(url, wait_until="networkidle")
+        content = page.content()
+        browser.close()
+
+    return content.encode("utf-8")
+
+
+def record(kind: str, url: str, render: bool = False) -> dict:
+    """
+    Record the page into the corpus.
+
+    Args:
+        kind (str): The page kind, overview, ranking or comments.
+        url (str): The page url.
+        render (bool): True to render the page in a browser.
+
+    Returns:
+        dict: The corpus entry.
+    """
+    if kind not in PAGE_KINDS:
+        raise ValueError(f"Unknown page kind: {kind}, expected one of {', '.join(PAGE_KINDS)}")
+
+    slug = re.sub(r"[^a-z0-9]+", "-", url.split("://", 1)[-1].lower()).strip("-")
+    name = f"{kind}-{slug}" + ("-rendered" if render else "")
+    entry = {"name": name, "kind": kind, "url": url, "file": f"{name}.html", "rendered": render, "synthetic": False}
+
+    with open(os.path.join(CORPUS_DIR, entry["file"]), "wb") as file:
+        file.write(fetch(url, render))
+
+    index = [existing for existing in load_index() if existing["name"] != name]
+    index.append(entry)
+    save_index(index)
+
+    return entry
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("record", "list"):
+        print("Usage:")
+        print("  python -m benchmarks.corpus record <kind> <url> [--render]")
+        print("  python -m benchmarks.corpus list")
+        print("")
+        print("  kind: 'overview', 'ranking' or 'comments'")
+        print("  --render: Optional flag to record the browser rendered page")
+        return
+
+    if sys.argv[1] == "list":
+        for entry in load_index():
+            print(f"{entry['name']}: {entry['url']}" + (" (synthetic)" if entry.get("synthetic") else ""))
+        return
+
+    entry = record(sys.argv[2], sys.argv[3], "--render" in sys.argv[4:])
+    print(f"Recorded {entry['name']} into {entry['file']}")
+    print("Run 'python -m benchmarks.extraction --update-golden' after checking the extracted data")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# Extraction benchmark over the offline HTML corpus
+#
+# Usage:
+#   python -m benchmarks.extraction [--rounds N] [--update-golden]
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from itemadapter import ItemAdapter
+from scrapy.http import HtmlResponse
+
+from benchmarks.corpus import GOLDEN_DIR, load_index, load_response
+from kinobox_crawler.helpers import extractors
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+# Total time spent in every field and compiled XPath query, keyed by its label
+query_timings = defaultdict(float)
+
+# Compiled queries of the extractors module evaluated outside of the movie fields
+TIMED_XPATHS = (
+    "COMMENTS_URL_XPATH",
+    "RANKING_ITEM_XPATH",
+    "RANKING_TITLE_URL_XPATH",
+    "COMMENT_XPATH",
+    "COMMENT_PARTS_XPATH",
+)
+
+
+def timed(label: str, function):
+    """
+    Wrap the function so the time of every call is added to query_timings under the label.
+
+    Args:
+        label (str): The label the time is reported under.
+        function: The field extract method or the compiled XPath.
+
+    Returns:
+        The wrapping function.
+    """
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        query_timings[label] += time.perf_counter() - start
+
+        return result
+
+    return call
+
+
+def instrument_extractors() -> None:
+    """
+    Time every movie field and the comment, comments url and ranking queries of the extractors module.
+
+    The extractors evaluate compiled XPath expressions directly on the lxml tree, so the timings are taken around the
+    fields and the compiled queries instead of the Scrapy selectors.
+
+    Returns:
+        None
+    """
+    for field in extractors.MOVIE_FIELDS:
+        field.extract = timed(f"field {field.name}", field.extract)
+
+    for name in TIMED_XPATHS:
+        xpath = getattr(extractors, name)
+        setattr(extractors, name, timed(f"{name} {xpath.path}", xpath))
+
+
+def extract(spider, entry: dict, response: HtmlResponse):
+    """
+    Run the spider extraction for the page kind.
+
+    Args:
+        spider (Spider): The spider instance.
+        entry (dict): The corpus entry.
+        response (HtmlResponse): The recorded page.
+
+    Returns:
+        The extracted data, None if the spider does not handle the page kind.
+    """
+    if entry["kind"] == "overview":
+        return spider.extract_movie_data(response)
+
+    if entry["kind"] == "comments":
+        return spider.extract_comments(response)
+
+    if entry["kind"] == "ranking" and hasattr(spider, "extract_overview_urls"):
+        return spider.extract_overview_urls(response)
+
+    return None
+
+
+def count_items(data) -> int:
+    if data is None:
+        return 0
+
+    return len(data) if isinstance(data, list) else 1
+
+
+def to_json_data(data):
+    # items are compared and stored as plain dicts
+    if isinstance(data, list):
+        return [to_json_data(value) for value in data]
+
+    return ItemAdapter(data).asdict() if ItemAdapter.is_item(data) else data
+
+
+def golden_path(entry: dict) -> str:
+    return os.path.join(GOLDEN_DIR, f"{entry['name']}.json")
+
+
+def check_golden(entry: dict, data, update: bool) -> bool:
+    """
+    Compare the extracted data with the golden JSON, or store it as the new golden JSON.
+
+    Args:
+        entry (dict): The corpus entry.
+        data: The extracted data.
+        update (bool): True to overwrite the golden JSON.
+
+    Returns:
+        bool: True if the data matches the golden JSON.
+    """
+    path = golden_path(entry)
+    data = to_json_data(data)
+
+    if update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=4, ensure_ascii=False)
+            file.write("\n")
+        return True
+
+    if not os.path.exists(path):
+        print(f"  MISSING golden for {entry['name']}")
+        return False
+
+    with open(path, encoding="utf-8") as file:
+        expected = json.load(file)
+
+    # JSON round trip so tuples and other types compare like the stored data
+    if json.loads(json.dumps(data)) != expected:
+        print(f"  MISMATCH {entry['name']}, see {path}")
+        return False
+
+    return True
+
+
+def run(rounds: int, update_golden: bool) -> bool:
+    """
+    Benchmark the extraction of both spiders over the corpus.
+
+    Args:
+        rounds (int): How many times every page is extracted.
+        update_golden (bool): True to overwrite the golden JSON with the extracted data.
+
+    Returns:
+        bool: True if all extracted data matches the golden JSON, False also for an empty corpus.
+    """
+    index = load_index()
+
+    # nothing measured and nothing checked must not pass silently
+    if not index:
+        print("The corpus is empty, record pages with 'python -m benchmarks.corpus record <kind> <url>'")
+        return False
+
+    # the body is decoded once so the benchmark measures extraction only
+    pages = [(entry, load_response(entry)) for entry in index]
+    ok = True
+
+    synthetic = sum(1 for entry in index if entry.get("synthetic"))
+    if synthetic:
+        print(f"{synthetic} of {len(index)} corpus pages are synthetic fixtures, not recorded from the site")
+
+    instrument_extractors()
+
+    for spider in (KinoboxSpider(), KinoboxSitemapSpider()):
+        query_timings.clear()
+        page_count = item_count = 0
+
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        for _ in range(rounds):
+            for entry, response in pages:
+                # a fresh response per round so the parsed tree is not cached between rounds
+                data = extract(spider, entry, HtmlResponse(url=response.url, body=response.body, encoding="utf-8"))
+
+                if data is not None:
+                    page_count += 1
+                    item_count += count_items(data)
+
+        elapsed = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{spider.name}: {page_count} pages, {item_count} items in {elapsed:.3f}s")
+        print(f"  {page_count / elapsed:.1f} pages/s, {item_count / elapsed:.1f} items/s, peak memory {peak_memory / 1024 / 1024:.1f} MiB")
+
+        for query, seconds in sorted(query_timings.items(), key=lambda timing: timing[1], reverse=True):
+            print(f"  {seconds * 1000:9.2f} ms  {query[:100]}")
+
+        for entry, response in pages:
+            data = extract(spider, entry, response)
+
+            # both spiders must agree, so the golden JSON is written only from the first one
+            if data is not None:
+                ok = check_golden(entry, data, update_golden and spider.name == KinoboxSpider.name) and ok
+
+    return ok
+
+
+def main():
+    rounds = int(sys.argv[sys.argv.index("--rounds") + 1]) if "--rounds" in sys.argv else 10
+    update_golden = "--update-golden" in sys.argv
+
+    sys.exit(0 if run(rounds, update_golden) else 1)
+
+
+if __name__ == "__main__":
+    main()
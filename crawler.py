@@ -1,17 +1,34 @@
 from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
 from kinobox_crawler.spiders.kinobox import KinoboxSpider
 from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
 import sys
 import os
+import glob
+import json
 import shutil
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
 import scrapy.utils.reactor
-import pexpect
+from kinobox_crawler.helpers.merge import merge_outputs
+from kinobox_crawler.helpers.search import SearchIndex
 
+CONTROL_URL = "http://localhost:9411"
 
-def get_job_dir(spider_name):
+# Shard K serves metrics on SHARD_METRICS_PORT + K and the control endpoint on SHARD_CONTROL_PORT + K
+SHARD_METRICS_PORT = 9500
+SHARD_CONTROL_PORT = 9600
+
+
+def get_job_dir(spider_name, shards=1, shard_id=0):
     if spider_name == "kinobox":
         return 'crawls/kinobox_jobdir'
     elif spider_name == "kinobox_sitemap":
+        if shards > 1:
+            return f'crawls/kinobox_sitemap_shard_{shard_id}_of_{shards}_jobdir'
         return 'crawls/kinobox_sitemap_jobdir'
     else:
         print(f"Unknown spider: {spider_name}")
@@ -41,7 +58,52 @@ def reset_job_dir(job_dir):
     print(f"Job directory reset: {job_dir} (hidden files preserved)")
 
 
-def start_crawler(spider_name, reset_state=False):
+def get_frontier_db(spider_name):
+    return f'crawls/{spider_name}_frontier.db'
+
+
+def reset_frontier(spider_name):
+    """Remove the shared frontier database with its WAL files."""
+    path = get_frontier_db(spider_name)
+
+    for file_path in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    print(f"Shared frontier reset: {path}")
+
+
+def get_frontier_settings(spider_name):
+    """Settings of a worker pulling its requests from the shared frontier instead of the job directory queue."""
+    return {
+        "SCHEDULER": "kinobox_crawler.scheduler.SharedFrontierScheduler",
+        "DUPEFILTER_CLASS": "kinobox_crawler.scheduler.SharedFrontierDupeFilter",
+        "KINOBOX_FRONTIER_DB": get_frontier_db(spider_name),
+    }
+
+
+def get_shard_output_dir(spider_name, shards, shard_id):
+    return os.path.join("output", "shards", f"{spider_name}-shard-{shard_id}-of-{shards}")
+
+
+def get_shard_settings(spider_name, shards, shard_id, frontier=False):
+    """Settings of one shard worker, every shard has its own job directory, output directory and ports."""
+    output_dir = get_shard_output_dir(spider_name, shards, shard_id)
+
+    return {
+        # workers of a shared frontier take any request, there is nothing to partition
+        "KINOBOX_SHARDS": 1 if frontier else shards,
+        "KINOBOX_SHARD_ID": 0 if frontier else shard_id,
+        "JOBDIR": get_job_dir(spider_name, shards, shard_id),
+        "KINOBOX_JSONL_DIR": output_dir,
+        "KINOBOX_PARQUET_DIR": output_dir,
+        "KINOBOX_METRICS_PORT": SHARD_METRICS_PORT + shard_id,
+        "KINOBOX_CONTROL_PORT": SHARD_CONTROL_PORT + shard_id,
+        "TELNETCONSOLE_ENABLED": False,
+    }
+
+
+def start_crawler(spider_name, reset_state=False, incremental=False, shards=1, shard_id=0, frontier=False):
     """Start the crawler with the specified spider."""
     # Install the required reactor
     scrapy.utils.reactor.install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
@@ -56,7 +118,15 @@ def start_crawler(spider_name, reset_state=False):
         print("Available spiders: 'kinobox', 'kinobox_sitemap'")
         return
 
-    job_dir = get_job_dir(spider_name)
+    if shards > 1 and spider_name != "kinobox_sitemap":
+        print("Only the 'kinobox_sitemap' spider can be sharded")
+        return
+
+    if not 0 <= shard_id < shards:
+        print(f"Shard id must be between 0 and {shards - 1}")
+        return
+
+    job_dir = get_job_dir(spider_name, shards, shard_id)
     if job_dir is None:
         return
 
@@ -64,70 +134,268 @@ def start_crawler(spider_name, reset_state=False):
     if reset_state:
         reset_job_dir(job_dir)
 
+        # workers started by the launcher share the frontier, the launcher resets it once
+        if frontier and shards == 1:
+            reset_frontier(spider_name)
+
     # Create and configure the crawler process
-    process = CrawlerProcess()
+    overrides = {"KINOBOX_INCREMENTAL": incremental}
+    if shards > 1:
+        overrides.update(get_shard_settings(spider_name, shards, shard_id, frontier))
+    if frontier:
+        overrides.update(get_frontier_settings(spider_name))
+
+    # command line priority, like scrapy crawl -s, so the overrides win over the spider custom_settings
+    settings = Settings()
+    settings.setdict(overrides, priority="cmdline")
+
+    process = CrawlerProcess(settings=settings)
 
     # Add the spider to the process
     process.crawl(spider_class)
 
     # Start the crawler process
-    print(f"Starting {spider_name} spider" + (" with fresh state" if reset_state else " resuming previous state"))
-    print("Telnet console available at localhost:6025")
+    print(f"Starting {spider_name} spider" + (f" shard {shard_id} of {shards}" if shards > 1 else "") + (" with fresh state" if reset_state else " resuming previous state") + (" in incremental mode" if incremental else "") + (" from the shared frontier" if frontier else ""))
+    if shards > 1:
+        print(f"Metrics available at http://localhost:{SHARD_METRICS_PORT + shard_id}/metrics")
+        print(f"Control endpoint available at {get_control_url(shard_id)}")
+    else:
+        print("Telnet console available at localhost:6025")
+        print("Metrics available at http://localhost:9410/metrics")
+        print(f"Control endpoint available at {CONTROL_URL}")
     process.start()  # This blocks until the crawling is finished
 
 
-def stop_crawler():
-    # Define the rules (prompts and responses)
-    rules = [
-        ("Username:", "scrapy"),         # Send username when we see 'Username:'
-        ("Password:", "1111"),           # Send password when we see 'Password:'
-        (r"\>>>", "engine.stop()"),      # Send stop command when we see the prompt '>>>'
-        (r"\>>>", "exit"),               # Exit after the stop command
-        (pexpect.EOF, None),             # End of the file (connection closed)
+def launch_shards(spider_name, shards, reset_state=False, incremental=False, frontier=False):
+    """Run every shard in its own worker process, then merge the shard outputs."""
+    started_at = time.time()
+    flags = (["-r"] if reset_state else []) + (["-i"] if incremental else []) + (["--frontier"] if frontier else [])
+
+    if reset_state and frontier:
+        reset_frontier(spider_name)
+
+    # each worker has its own event loop and browser, so the shards use all CPU cores
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "start", spider_name, "--shards", str(shards), "--shard-id", str(shard_id), *flags])
+        for shard_id in range(shards)
     ]
 
-    # Spawn a new Telnet session to the desired host
-    client = pexpect.spawn("telnet localhost 6025")
+    print(f"Started {shards} shard workers of the {spider_name} spider")
+    exit_codes = [worker.wait() for worker in workers]
+
+    for shard_id, exit_code in enumerate(exit_codes):
+        if exit_code != 0:
+            print(f"Shard {shard_id} exited with code {exit_code}")
+
+    merge_shard_outputs(spider_name, shards, started_at)
+
+
+def merge_shard_outputs(spider_name, shards, since):
+    """
+    Concatenate the JSON lines files the shards wrote since the given time into one file per compression.
+
+    The shards crawl disjoint movies, so the files are only concatenated. Gzip and zstd streams stay valid when
+    concatenated, so compressed files are not decompressed.
+    """
+    merged = {}
+
+    for shard_id in range(shards):
+        output_dir = get_shard_output_dir(spider_name, shards, shard_id)
+        if not os.path.isdir(output_dir):
+            continue
+
+        for file_name in sorted(os.listdir(output_dir)):
+            path = os.path.join(output_dir, file_name)
+            if ".jsonl" not in file_name or os.path.getmtime(path) < since:
+                continue
+
+            suffix = file_name[file_name.index(".jsonl"):]
+            merged.setdefault(suffix, []).append(path)
+
+    run_id = time.strftime("%Y%m%dT%H%M%S", time.localtime(since))
+
+    for suffix, paths in merged.items():
+        merged_path = os.path.join("output", f"{spider_name}-{run_id}-merged{suffix}")
+
+        with open(merged_path, "wb") as merged_file:
+            for path in paths:
+                with open(path, "rb") as file:
+                    shutil.copyfileobj(file, merged_file)
+
+        print(f"Merged {len(paths)} shard files into {merged_path}")
 
-    # This is so we can see what's happening
-    client.logfile = sys.stdout.buffer
+    if not merged:
+        print("The shards did not write any output")
 
-    # Iterate over the expected prompts and corresponding responses
-    for expect, send in rules:
-        client.expect(expect)  # Wait for the expected prompt
-        if send is None:
-            break  # Exit the loop when there's no further action
-        client.sendline(send)  # Send the response
+
+def merge_crawl_outputs(input_paths, output_path=None):
+    """Merge the crawl outputs into one deduplicated dataset, by default all outputs in the output directory."""
+    if not input_paths:
+        # oldest first, so newer versions of a movie win
+        input_paths = sorted(glob.glob(os.path.join("output", "*.jsonl*")), key=os.path.getmtime)
+        if os.path.exists("movies.json"):
+            input_paths.insert(0, "movies.json")
+
+    if not input_paths:
+        print("No crawl outputs to merge")
+        return
+
+    output_path = output_path or os.path.join("output", "merged", f"movies-{time.strftime('%Y%m%dT%H%M%S')}.jsonl")
+
+    print(f"Merging {len(input_paths)} files into {output_path}")
+    counts = merge_outputs(input_paths, output_path)
+    print(f"Read {counts['records']} records, wrote {counts['movies']} movies with {counts['comments']} comments")
+
+
+def search_index(query, kind=None, limit=20, db_path=None):
+    """Search the movie descriptions and comment texts indexed by the SearchIndexPipeline, best matches first."""
+    db_path = db_path or KinoboxSpider.custom_settings["KINOBOX_SEARCH_DB"]
+    if not os.path.exists(db_path):
+        print(f"No search index at {db_path}, crawl with KINOBOX_SEARCH_ENABLED to build it")
+        return
+
+    index = SearchIndex(db_path)
+    try:
+        results = index.search(query, limit, kind)
+    finally:
+        index.close()
+
+    if not results:
+        print(f"Nothing found for: {query}")
+        return
+
+    for result in results:
+        print(f"[{result['kind']}] {result['title'] or ''} (id {result['movie_id']})")
+        print(f"    {result['snippet']}")
+
+
+def get_control_url(shard_id=None):
+    if shard_id is None:
+        return CONTROL_URL
+    return f"http://localhost:{SHARD_CONTROL_PORT + shard_id}"
+
+
+def get_control_urls(args):
+    """Control endpoints selected by the --shards N (all shards) or --shard-id K (one shard) options."""
+    if "--shard-id" in args:
+        return [get_control_url(int(get_option(args, "--shard-id")))]
+
+    if "--shards" in args:
+        return [get_control_url(shard_id) for shard_id in range(int(get_option(args, "--shards")))]
+
+    return [CONTROL_URL]
+
+
+def get_option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def send_command(command, control_url=CONTROL_URL, **params):
+    """Send the command to the control endpoint of the running crawler and print its status."""
+    url = f"{control_url}/{command}"
+    if params:
+        url += "?" + urllib.parse.urlencode(params)
+
+    # GET reads the status, all other commands are POST
+    request = urllib.request.Request(url, method="GET" if command == "status" else "POST")
+
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = json.load(response)
+    except urllib.error.HTTPError as error:
+        print(f"Command {command} failed: {json.load(error).get('error', error.reason)}")
+        return
+    except urllib.error.URLError as error:
+        print(f"Crawler is not running or the control endpoint is disabled ({error.reason})")
+        return
+
+    print(json.dumps(status, indent=4))
+
+
+def stop_crawler(now=False, control_url=CONTROL_URL):
+    """Stop the crawler, by default after the in-flight movies are finished."""
+    if now:
+        send_command("stop", control_url)
+    else:
+        send_command("drain", control_url)
+        print("Draining: the crawler stops after the in-flight movies are finished, the rest is kept for the next run")
 
 
 def main():
     # Check if enough arguments are provided
     if len(sys.argv) < 2:
         print("Usage:")
-        print("  python crawler.py start <spider_name> [-r]")
-        print("  python crawler.py stop")
+        print("  python crawler.py start <spider_name> [-r] [-i] [--shards N [--shard-id K]] [--frontier]")
+        print("  python crawler.py stop [--now] [--shards N | --shard-id K]")
+        print("  python crawler.py pause|resume|status [--shards N | --shard-id K]")
+        print("  python crawler.py throttle <budget> <max> [--shards N | --shard-id K]")
+        print("  python crawler.py delay <seconds> [--shards N | --shard-id K]")
+        print("  python crawler.py merge [files...] [-o output]")
+        print("  python crawler.py search <query> [--movies | --comments] [-n limit] [--db path]")
         print("")
         print("  spider_name: 'kinobox' or 'kinobox_sitemap'")
         print("  -r: Optional flag to reset the resumable state")
+        print("  -i: Optional flag to skip unchanged movies and fetch only new comments")
+        print("  --shards N: Optional number of shards the sitemap movies are split into, starts N worker processes")
+        print("  --shard-id K: Optional shard crawled by this process only, e.g. on another machine")
+        print("  --frontier: Optional flag to pull the requests from a queue shared by all workers instead of partitioning")
+        print("  --now: Optional flag to stop without finishing the in-flight movies")
+        print("  budget: 'browser' or 'http'")
+        print("  files: JSON lines or JSON array outputs, oldest first, by default all files in output/")
+        print("  -o: Optional merged file, .gz or .zst to compress it")
+        print("  query: Words that all have to match, accents are optional, word* matches a prefix")
+        print("  --movies, --comments: Optional flag to search only the movie descriptions or the comments")
         return
 
     command = sys.argv[1].lower()
 
     if command == "start":
-        # Check if reset flag is present
-        reset_state = False
+        # Check if reset and incremental flags are present
         spider_name = sys.argv[2].lower()
-        if len(sys.argv) > 3 and sys.argv[3] == "-r":
-            reset_state = True
+        reset_state = "-r" in sys.argv[3:]
+        incremental = "-i" in sys.argv[3:]
+        shards = int(get_option(sys.argv, "--shards", 1))
+        shard_id = get_option(sys.argv, "--shard-id")
+        frontier = "--frontier" in sys.argv[3:]
 
-        start_crawler(spider_name, reset_state)
+        if shards > 1 and shard_id is None:
+            launch_shards(spider_name, shards, reset_state, incremental, frontier)
+        else:
+            start_crawler(spider_name, reset_state, incremental, shards, int(shard_id or 0), frontier)
 
     elif command == "stop":
-        stop_crawler()
+        for control_url in get_control_urls(sys.argv):
+            stop_crawler("--now" in sys.argv[2:], control_url)
+
+    elif command in ("pause", "resume", "status"):
+        for control_url in get_control_urls(sys.argv):
+            send_command(command, control_url)
+
+    elif command == "throttle":
+        for control_url in get_control_urls(sys.argv):
+            send_command("throttle", control_url, budget=sys.argv[2].lower(), max=sys.argv[3])
+
+    elif command == "delay":
+        for control_url in get_control_urls(sys.argv):
+            send_command("delay", control_url, seconds=sys.argv[2])
+
+    elif command == "merge":
+        output_path = get_option(sys.argv, "-o")
+        input_paths = [arg for arg in sys.argv[2:] if arg not in ("-o", output_path)]
+
+        merge_crawl_outputs(input_paths, output_path)
+
+    elif command == "search":
+        limit = get_option(sys.argv, "-n", 20)
+        db_path = get_option(sys.argv, "--db")
+        kind = "movie" if "--movies" in sys.argv else "comment" if "--comments" in sys.argv else None
+        words = [arg for arg in sys.argv[2:] if arg not in ("-n", limit, "--db", db_path, "--movies", "--comments")]
+
+        search_index(" ".join(words), kind, int(limit), db_path)
 
     else:
         print(f"Unknown command: {command}")
-        print("Available commands: 'start', 'stop'")
+        print("Available commands: 'start', 'stop', 'pause', 'resume', 'status', 'throttle', 'delay', 'merge', 'search'")
 
 
 if __name__ == "__main__":
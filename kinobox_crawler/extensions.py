@@ -0,0 +1,348 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import logging
+import os
+import resource
+from collections import defaultdict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the response latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, exporter):
+        super().__init__()
+        self.exporter = exporter
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.exporter.render().encode("utf-8")
+
+
+class MetricsExporter:
+    """
+    Serves the crawl metrics in the Prometheus text format on http://KINOBOX_METRICS_HOST:KINOBOX_METRICS_PORT/metrics.
+
+    Exposes responses by callback, response latency histograms for browser and plain HTTP requests, in-flight movies,
+    the comment page backlog, memory RSS and all numeric Scrapy stats (retries, status codes, Playwright pages).
+    """
+
+    def __init__(self, crawler, host: str, port: int):
+        self.crawler = crawler
+        self.host = host
+        self.port = port
+        self.spider = None
+        self.listener = None
+
+        self.responses = defaultdict(int)
+        self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.latency_sum = defaultdict(float)
+        self.latency_count = defaultdict(int)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("KINOBOX_METRICS_ENABLED", False):
+            raise NotConfigured
+
+        extension = cls(
+            crawler,
+            crawler.settings.get("KINOBOX_METRICS_HOST", "127.0.0.1"),
+            crawler.settings.getint("KINOBOX_METRICS_PORT", 9410),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+
+        try:
+            self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self)), interface=self.host)
+        except CannotListenError as error:
+            logger.error(f"Metrics endpoint could not listen on {self.host}:{self.port}: {error}")
+            return
+
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    def spider_closed(self, spider):
+        if self.listener is not None:
+            self.listener.stopListening()
+
+    def response_received(self, response, request, spider):
+        callback = getattr(request.callback, "__name__", None) or "parse"
+        self.responses[callback] += 1
+
+        latency = request.meta.get("download_latency")
+        if latency is None:
+            return
+
+        handler = "browser" if request.meta.get("playwright") else "http"
+        buckets = self.latency_buckets[handler]
+
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                buckets[index] += 1
+
+        self.latency_sum[handler] += latency
+        self.latency_count[handler] += 1
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = [
+            "# HELP kinobox_responses_total Responses received by the spider callback.",
+            "# TYPE kinobox_responses_total counter",
+        ]
+        for callback, count in sorted(self.responses.items()):
+            lines.append(f'kinobox_responses_total{{callback="{callback}"}} {count}')
+
+        lines += [
+            "# HELP kinobox_response_latency_seconds Download latency of the responses.",
+            "# TYPE kinobox_response_latency_seconds histogram",
+        ]
+        for handler, buckets in sorted(self.latency_buckets.items()):
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'kinobox_response_latency_seconds_bucket{{handler="{handler}",le="{bound}"}} {count}')
+            lines.append(f'kinobox_response_latency_seconds_bucket{{handler="{handler}",le="+Inf"}} {self.latency_count[handler]}')
+            lines.append(f'kinobox_response_latency_seconds_sum{{handler="{handler}"}} {self.latency_sum[handler]}')
+            lines.append(f'kinobox_response_latency_seconds_count{{handler="{handler}"}} {self.latency_count[handler]}')
+
+        in_flight_movies, comment_backlog = self.get_movie_progress()
+        lines += [
+            "# HELP kinobox_in_flight_movies Movies with comments still being fetched.",
+            "# TYPE kinobox_in_flight_movies gauge",
+            f"kinobox_in_flight_movies {in_flight_movies}",
+            "# HELP kinobox_comment_backlog_pages Known comment pages not fetched yet.",
+            "# TYPE kinobox_comment_backlog_pages gauge",
+            f"kinobox_comment_backlog_pages {comment_backlog}",
+            "# HELP kinobox_memory_rss_bytes Resident memory of the crawler process.",
+            "# TYPE kinobox_memory_rss_bytes gauge",
+            f"kinobox_memory_rss_bytes {get_memory_rss()}",
+            "# HELP kinobox_scrapy_stat Numeric Scrapy stats, e.g. retries, status codes and Playwright pages.",
+            "# TYPE kinobox_scrapy_stat gauge",
+        ]
+        for name, value in sorted(self.crawler.stats.get_stats().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'kinobox_scrapy_stat{{name="{escape_label(name)}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def get_movie_progress(self) -> tuple:
+        """
+        Count the in-flight movies and their comment pages not fetched yet.
+
+        Returns:
+            tuple: The number of in-flight movies and the comment backlog in pages.
+        """
+        movies = getattr(self.spider, "movie_comments_map", {})
+        backlog = 0
+
+        for state in list(movies.values()):
+            if state.get("total_pages"):
+                backlog += max(0, state["total_pages"] - len(state["pages"]))
+
+        return len(movies), backlog
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def get_memory_rss() -> int:
+    """
+    Get the current resident memory of the process, or the peak when the current value is not available.
+
+    Returns:
+        int: The memory in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+class ControlResource(Resource):
+    isLeaf = True
+
+    def __init__(self, server):
+        super().__init__()
+        self.server = server
+
+    def render_GET(self, request):
+        return self.respond(request, 200, self.server.get_status())
+
+    def render_POST(self, request):
+        command = request.path.decode("utf-8").strip("/")
+        args = {key.decode("utf-8"): values[0].decode("utf-8") for key, values in request.args.items()}
+
+        try:
+            result = self.server.run_command(command, args)
+        except (KeyError, ValueError) as error:
+            return self.respond(request, 400, {"error": str(error)})
+
+        return self.respond(request, 200, result)
+
+    def respond(self, request, status: int, data: dict) -> bytes:
+        request.setResponseCode(status)
+        request.setHeader(b"Content-Type", b"application/json")
+        return json.dumps(data).encode("utf-8")
+
+
+class ControlServer:
+    """
+    Local HTTP control endpoint of the running crawl on http://KINOBOX_CONTROL_HOST:KINOBOX_CONTROL_PORT.
+
+    GET / returns the crawl status, POST commands:
+        /drain: Finish the comments of in-flight movies, then stop. Other requests are kept for a resumed crawl.
+        /stop: Stop right away.
+        /pause, /resume: Pause and resume the downloads.
+        /throttle?budget=http&max=16&limit=8: Change an AdaptiveThrottleMiddleware budget.
+        /delay?seconds=1.5: Change the download delay.
+    """
+
+    def __init__(self, crawler, host: str, port: int):
+        self.crawler = crawler
+        self.host = host
+        self.port = port
+        self.spider = None
+        self.listener = None
+        self.paused = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("KINOBOX_CONTROL_ENABLED", False):
+            raise NotConfigured
+
+        extension = cls(
+            crawler,
+            crawler.settings.get("KINOBOX_CONTROL_HOST", "127.0.0.1"),
+            crawler.settings.getint("KINOBOX_CONTROL_PORT", 9411),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.spider_idle, signal=signals.spider_idle)
+
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        spider.draining = False
+
+        try:
+            self.listener = reactor.listenTCP(self.port, Site(ControlResource(self)), interface=self.host)
+        except CannotListenError as error:
+            logger.error(f"Control endpoint could not listen on {self.host}:{self.port}: {error}")
+            return
+
+        logger.info(f"Control endpoint available at http://{self.host}:{self.port}")
+
+    def spider_closed(self, spider):
+        if self.listener is not None:
+            self.listener.stopListening()
+
+    def spider_idle(self, spider):
+        if not spider.draining:
+            return
+
+        # the scheduler serves only the in-flight movies while draining, the other requests stay queued for the next run
+        logger.info(f"Drained, {len(self.crawler.engine.slot.scheduler)} requests kept for the next run")
+        self.crawler.engine.close_spider(spider, "drained")
+
+    def get_status(self) -> dict:
+        spider = self.spider
+        movies = getattr(spider, "movie_comments_map", {})
+
+        return {
+            "spider": spider.name if spider else None,
+            "paused": self.paused,
+            "draining": getattr(spider, "draining", False),
+            "in_flight_movies": len(movies),
+            "pending_requests": len(self.crawler.engine.slot.scheduler) if self.crawler.engine.slot else 0,
+            "throttle": {
+                name: {"limit": budget.limit, "max": budget.maximum, "in_flight": budget.in_flight}
+                for name, budget in self.get_throttle_budgets().items()
+            },
+        }
+
+    def run_command(self, command: str, args: dict) -> dict:
+        """
+        Run the control command.
+
+        Args:
+            command (str): The command name.
+            args (dict): The command arguments from the query string.
+
+        Returns:
+            dict: The crawl status after the command.
+        """
+        engine = self.crawler.engine
+
+        if command == "drain":
+            logger.info("Draining: finishing in-flight movies before stopping")
+            self.spider.draining = True
+            if self.paused:
+                engine.unpause()
+                self.paused = False
+        elif command == "stop":
+            engine.close_spider(self.spider, "shutdown")
+        elif command == "pause":
+            engine.pause()
+            self.paused = True
+        elif command == "resume":
+            engine.unpause()
+            self.paused = False
+        elif command == "throttle":
+            budget = self.get_throttle_budgets()[args["budget"]]
+            if "max" in args:
+                budget.maximum = float(args["max"])
+            budget.limit = min(budget.maximum, float(args.get("limit", budget.limit)))
+            budget.wake()
+        elif command == "delay":
+            delay = float(args["seconds"])
+            for slot in engine.downloader.slots.values():
+                slot.delay = delay
+        else:
+            raise ValueError(f"Unknown command: {command}")
+
+        return self.get_status()
+
+    def get_throttle_budgets(self) -> dict:
+        """
+        Get the budgets of the AdaptiveThrottleMiddleware, if it is enabled.
+
+        Returns:
+            dict: The budgets by name.
+        """
+        engine = self.crawler.engine
+        if engine is None:
+            return {}
+
+        for middleware in engine.downloader.middleware.middlewares:
+            if hasattr(middleware, "budgets"):
+                return middleware.budgets
+
+        return {}
@@ -0,0 +1,165 @@
+# Response cache used by the ResponseCacheMiddleware
+import json
+import sqlite3
+import time
+import zlib
+
+from kinobox_crawler.helpers.helpers import connect_sqlite
+
+# Number of cache hits whose access time is kept in memory before it is written in one transaction
+ACCESS_BATCH_SIZE = 100
+
+
+class ResponseCacheStore:
+    """
+    SQLite store with zlib compressed responses keyed by url, evicting the least recently used entries.
+
+    Besides the response it keeps the ETag and Last-Modified validators, so a stale entry can be revalidated with a
+    conditional request instead of downloaded again. Access times of cache hits are written in batches of
+    ACCESS_BATCH_SIZE, and before the eviction that orders by them.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.accessed = {}
+
+        self.connection = connect_sqlite(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.commit()
+
+        self.total_bytes = self.get_total_bytes()
+
+    def get(self, key: str) -> dict | None:
+        """
+        Get the cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict | None: The response with url, status, headers, body, validators and stored_at, None if not cached.
+        """
+        row = self.connection.execute("SELECT * FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.accessed[key] = time.time()
+        if len(self.accessed) >= ACCESS_BATCH_SIZE:
+            self.flush_accessed()
+            self.connection.commit()
+
+        entry = dict(row)
+        entry["headers"] = json.loads(entry["headers"])
+        entry["body"] = zlib.decompress(entry["body"])
+
+        return entry
+
+    def put(self, key: str, url: str, status: int, headers: dict, body: bytes) -> None:
+        """
+        Store the response and evict the least recently used responses when the cache is full.
+
+        Args:
+            key (str): The cache key.
+            url (str): The response url.
+            status (int): The response status.
+            headers (dict): The response headers, every name with a list of values.
+            body (bytes): The response body.
+
+        Returns:
+            None
+        """
+        compressed = zlib.compress(body, 6)
+        now = time.time()
+        self.accessed.pop(key, None)
+
+        # a stale or revalidated entry is replaced, its old size no longer counts
+        previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            self.total_bytes -= previous["size"]
+
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO responses (key, url, status, headers, body, etag, last_modified, size, stored_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, url, status, json.dumps(headers), compressed, get_header(headers, "ETag"), get_header(headers, "Last-Modified"), len(compressed), now, now)
+        )
+        self.connection.commit()
+
+        self.total_bytes += len(compressed)
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def touch(self, key: str) -> None:
+        # the response was revalidated, it is fresh again
+        now = time.time()
+        self.accessed.pop(key, None)
+        self.connection.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+        self.connection.commit()
+
+    def evict(self) -> int:
+        """
+        Delete the least recently used responses until the cache is below 90 % of its maximum size.
+
+        Returns:
+            int: The number of deleted responses.
+        """
+        # recently read responses must not be evicted as the least recently used ones
+        self.flush_accessed()
+
+        # other workers sharing the cache may have stored responses too
+        self.total_bytes = self.get_total_bytes()
+        target = self.max_bytes * 0.9
+        deleted = 0
+
+        for row in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if self.total_bytes <= target:
+                break
+
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+            self.total_bytes -= row["size"]
+            deleted += 1
+
+        self.connection.commit()
+
+        return deleted
+
+    def flush_accessed(self) -> None:
+        self.connection.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self.accessed.items()]
+        )
+        self.accessed = {}
+
+    def get_total_bytes(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush_accessed()
+        self.connection.commit()
+        self.connection.close()
+
+
+def get_header(headers: dict, name: str) -> str | None:
+    for key, values in headers.items():
+        if key.lower() == name.lower() and values:
+            return values[0]
+
+    return None
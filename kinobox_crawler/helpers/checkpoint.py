@@ -0,0 +1,179 @@
+# Checkpoint of the comments collected for the in-flight movies
+import dataclasses
+import json
+import zlib
+
+from kinobox_crawler.helpers.helpers import connect_sqlite
+from kinobox_crawler.items import Comment, Movie
+
+
+class CommentsCheckpointStore:
+    """
+    SQLite store with the comment pages of the movies that are not finished yet.
+
+    Scrapy keeps the pending requests in the job directory, but the comments of the pages already parsed live only in
+    memory. Every parsed page is written here and the movie is deleted once it is emitted, so a resumed crawl can
+    continue the movies with the comments of their earlier pages. Comments are stored as zlib compressed JSON rows.
+    The movie data and the url of its first comments page are stored too, so a movie whose remaining pages were lost
+    can be crawled again.
+    """
+
+    def __init__(self, path: str):
+        self.connection = connect_sqlite(path, autocommit=True, synchronous="NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS movies (
+                movie_id TEXT PRIMARY KEY,
+                total_pages INTEGER,
+                newest_comment TEXT,
+                newest_comment_ids TEXT,
+                movie_data TEXT,
+                comments_url TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                movie_id TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                comments_count INTEGER NOT NULL,
+                comments BLOB,
+                PRIMARY KEY (movie_id, page)
+            ) WITHOUT ROWID;
+            """
+        )
+
+        # checkpoints created before the movie data was kept
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(movies)")]
+        for column in ("movie_data", "comments_url"):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE movies ADD COLUMN {column} TEXT")
+
+    def save_page(self, movie_id: int | str, page_num: int, state: dict, comments: list | int) -> None:
+        """
+        Store one parsed comments page with the movie state.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+            page_num (int): The number of the comments page.
+            state (dict): The in-memory state of the movie with total_pages, newest_comment and newest_comment_ids.
+            comments (list | int): The comments from the page, or their number when the comments are streamed.
+
+        Returns:
+            None
+        """
+        key = json.dumps(movie_id)
+
+        if isinstance(comments, int):
+            comments_count, data = comments, None
+        else:
+            comments_count = len(comments)
+            rows = [dataclasses.astuple(comment) for comment in comments]
+            data = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.save_movie(key, state)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (movie_id, page, comments_count, comments) VALUES (?, ?, ?, ?)",
+                (key, page_num, comments_count, data)
+            )
+
+    def save_movie_data(self, movie_data: Movie, comments_url: str) -> None:
+        """
+        Store the movie whose comments are started.
+
+        Args:
+            movie_data (Movie): The movie data without comments.
+            comments_url (str): The url of the first comments page.
+
+        Returns:
+            None
+        """
+        data = json.dumps(dataclasses.asdict(movie_data), ensure_ascii=False)
+
+        self.connection.execute(
+            """
+            INSERT INTO movies (movie_id, movie_data, comments_url) VALUES (?, ?, ?)
+            ON CONFLICT (movie_id) DO UPDATE SET movie_data = excluded.movie_data, comments_url = excluded.comments_url
+            """,
+            (json.dumps(movie_data.id), data, comments_url)
+        )
+
+    def get_movie_data(self, movie_id: int | str) -> tuple | None:
+        """
+        Get the stored movie data of the movie.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            tuple | None: The Movie and the url of its first comments page, None if they were not stored.
+        """
+        row = self.connection.execute(
+            "SELECT movie_data, comments_url FROM movies WHERE movie_id = ?", (json.dumps(movie_id),)
+        ).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+
+        return Movie(**json.loads(row[0])), row[1]
+
+    def save_state(self, movie_id: int | str, state: dict) -> None:
+        self.save_movie(json.dumps(movie_id), state)
+
+    def save_movie(self, key: str, state: dict) -> None:
+        self.connection.execute(
+            """
+            INSERT INTO movies (movie_id, total_pages, newest_comment, newest_comment_ids) VALUES (?, ?, ?, ?)
+            ON CONFLICT (movie_id) DO UPDATE SET
+                total_pages = excluded.total_pages,
+                newest_comment = excluded.newest_comment,
+                newest_comment_ids = excluded.newest_comment_ids
+            """,
+            (key, state["total_pages"], state["newest_comment"], json.dumps(sorted(state["newest_comment_ids"])))
+        )
+
+    def delete(self, movie_id: int | str) -> None:
+        key = json.dumps(movie_id)
+
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM pages WHERE movie_id = ?", (key,))
+            self.connection.execute("DELETE FROM movies WHERE movie_id = ?", (key,))
+
+    def load(self, stream_comments: bool) -> dict:
+        """
+        Load the state of all checkpointed movies.
+
+        Args:
+            stream_comments (bool): Whether the comments are streamed, the pages then hold only the comment counts.
+
+        Returns:
+            dict: The movie states keyed by the movie id, in the format of CommentsMixin.movie_comments_map.
+        """
+        states = {}
+
+        rows = self.connection.execute("SELECT movie_id, total_pages, newest_comment, newest_comment_ids FROM movies")
+
+        for key, total_pages, newest_comment, newest_comment_ids in rows:
+            states[json.loads(key)] = {
+                "pages": {},
+                "total_pages": total_pages,
+                "newest_comment": newest_comment,
+                "newest_comment_ids": set(json.loads(newest_comment_ids or "[]")),
+            }
+
+        for key, page_num, comments_count, data in self.connection.execute("SELECT movie_id, page, comments_count, comments FROM pages"):
+            state = states.get(json.loads(key))
+            if state is None:
+                continue
+
+            if stream_comments:
+                state["pages"][page_num] = comments_count
+            else:
+                # comments of pages checkpointed in the streaming mode were already emitted
+                rows = json.loads(zlib.decompress(data)) if data is not None else []
+                state["pages"][page_num] = [Comment(*row) for row in rows]
+
+        return states
+
+    def close(self) -> None:
+        self.connection.close()
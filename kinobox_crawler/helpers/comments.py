@@ -0,0 +1,628 @@
+# Comments module shared by the kinobox spiders
+import json
+import os
+from urllib.parse import urlparse, parse_qsl
+
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http.response import Response
+from playwright.async_api import Page
+from w3lib.url import add_or_replace_parameter
+
+from kinobox_crawler.helpers.checkpoint import CommentsCheckpointStore
+from kinobox_crawler.helpers.helpers import get_comment_id, parse_date
+from kinobox_crawler.helpers.extractors import extract_comments, FillRateMixin, PAGINATION_SELECTOR, NEXT_PAGE_SELECTOR, COMMENT_SELECTOR
+from kinobox_crawler.helpers.pages import PagePoolMixin
+from kinobox_crawler.helpers.state import IncrementalMixin
+from kinobox_crawler.items import Movie, CommentsPage
+
+
+# Keys that may hold the comment page count in the Next.js page payload
+PAGE_COUNT_KEYS = ("totalPages", "pageCount", "lastPage", "pagesCount")
+
+# Comment pages are prioritized over new movies so in-flight movies finish first
+COMMENTS_PRIORITY_BOOST = 10
+
+
+class CommentsMixin(IncrementalMixin, PagePoolMixin, FillRateMixin):
+    """
+    Comment pagination shared by the kinobox spiders.
+
+    Comment pages are fetched with plain HTTP requests. Once the total page count and the page URL scheme are known
+    from the first page, all remaining pages are requested at once. When the static HTML does not contain the
+    comments, the first page is rendered in a browser and the pages are followed one by one.
+
+    Comments are kept per in-flight movie and released once the movie item is emitted. With the
+    KINOBOX_STREAM_COMMENTS setting enabled, every comments page is emitted right away as a separate comments item
+    linked to the movie by its id, so only the page counts are kept in memory.
+
+    In the incremental mode the pages are followed one by one and only comments not older than the newest stored
+    comment are read.
+
+    With a JOBDIR, the comments of the in-flight movies are checkpointed into the job directory and loaded back when
+    the crawl is resumed, so the movies whose remaining pages are in the persisted queue are emitted complete. Movies
+    whose remaining pages were lost are crawled again from their first comments page.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.movie_comments_map = {}
+        self.seen_movie_ids = set()
+        self.checkpoint = None
+        self.resumed_movie_ids = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        job_dir = crawler.settings.get("JOBDIR")
+        if job_dir:
+            spider.open_checkpoint(os.path.join(job_dir, "comments_checkpoint.db"))
+            crawler.signals.connect(spider.restart_orphaned_movies, signal=signals.spider_idle)
+
+        return spider
+
+    def open_checkpoint(self, path: str) -> None:
+        """
+        Open the checkpoint store and load the comments of the movies left unfinished by the previous run.
+
+        Args:
+            path (str): The path of the checkpoint database.
+
+        Returns:
+            None
+        """
+        self.checkpoint = CommentsCheckpointStore(path)
+        self.movie_comments_map.update(self.checkpoint.load(self.stream_comments))
+        self.resumed_movie_ids = set(self.movie_comments_map)
+
+        if self.resumed_movie_ids:
+            self.logger.info(f"Resuming {len(self.resumed_movie_ids)} movies with checkpointed comments")
+            self.crawler.stats.set_value("kinobox/checkpoint/resumed", len(self.resumed_movie_ids))
+
+    def restart_orphaned_movies(self, spider) -> None:
+        """
+        Crawl again the resumed movies that are still unfinished when the crawl runs out of requests.
+
+        Their remaining pages were not in the persisted queue, e.g. requests in flight when the crawler was killed, so
+        their checkpointed comments are discarded and the movie is requested again from its first comments page. In
+        the streaming mode the pages emitted before are emitted again. Movies checkpointed without their movie data
+        are dropped.
+
+        Args:
+            spider (Spider): The idle spider.
+
+        Returns:
+            None
+        """
+        orphaned = [movie_id for movie_id in self.resumed_movie_ids if movie_id in self.movie_comments_map]
+        self.resumed_movie_ids.clear()
+
+        restarted = 0
+        for movie_id in orphaned:
+            saved = self.checkpoint.get_movie_data(movie_id)
+            del self.movie_comments_map[movie_id]
+            self.checkpoint.delete(movie_id)
+
+            if saved is None:
+                self.logger.warning(f"Dropping the checkpointed comments of movie {movie_id}, its remaining pages were lost")
+                self.crawler.stats.inc_value("kinobox/checkpoint/orphaned")
+                continue
+
+            movie_data, comments_url = saved
+            self.logger.warning(f"Restarting the comments of movie {movie_id}, its remaining pages were lost")
+            # the dupefilter of the job directory already saw the pages of the movie
+            self.crawler.engine.crawl(self.comments_request(comments_url, movie_data, restarted=True))
+            restarted += 1
+
+        if restarted:
+            self.crawler.stats.inc_value("kinobox/checkpoint/restarted", restarted)
+            raise DontCloseSpider
+
+    def closed(self, reason: str) -> None:
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+        super().closed(reason)
+
+    def is_duplicate_movie(self, movie_id: int | str) -> bool:
+        """
+        Check whether the movie was already scraped, e.g. when it is reachable through several urls.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            bool: True if the movie was already seen.
+        """
+        if movie_id in self.seen_movie_ids:
+            return True
+
+        self.seen_movie_ids.add(movie_id)
+        return False
+
+    @property
+    def stream_comments(self) -> bool:
+        return self.settings.getbool("KINOBOX_STREAM_COMMENTS", False)
+
+    def comments_request(self, comments_url: str, movie_data: Movie, priority: int = 0, restarted: bool = False) -> Request:
+        """
+        Create the request for the first comments page of the movie.
+
+        Args:
+            comments_url (str): The absolute url of the first comments page.
+            movie_data (Movie): The movie data.
+            priority (int): The priority of the overview request.
+            restarted (bool): Whether the movie is crawled again, its comments pages then bypass the dupefilter.
+
+        Returns:
+            Request: The request for the first comments page.
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.save_movie_data(movie_data, comments_url)
+
+        return Request(
+            comments_url,
+            meta={
+                "movie_data": movie_data,
+                "page_num": 1,
+                "comments_since": self.get_comments_since(movie_data.id),
+                "url": comments_url,
+                "restarted": restarted
+            },
+            priority=priority + COMMENTS_PRIORITY_BOOST,
+            dont_filter=restarted,
+            callback=self.parse_comments,
+            errback=self.comments_failed
+        )
+
+    async def parse_comments(self, response: Response) -> None:
+        """
+        Parse the comments for the movie.
+
+        Args:
+            response (Response): The response from the comments page.
+
+        Returns:
+            None
+        """
+        if "playwright_page" in response.meta:
+            async for result in self.parse_rendered_comments(response):
+                yield result
+        else:
+            for result in self.parse_static_comments(response):
+                yield result
+
+    def parse_static_comments(self, response: Response) -> None:
+        """
+        Parse the comments from the server-rendered comments page and schedule the remaining pages.
+
+        Args:
+            response (Response): The response from the comments page.
+
+        Returns:
+            None
+        """
+        current_page = response.meta.get("page_num", 1)
+        movie_data = response.meta["movie_data"]
+        movie_id = movie_data.id
+
+        comments = self.extract_comments(response)
+
+        if current_page == 1 and not comments:
+            # comments are not part of the static HTML, fall back to the browser
+            self.crawler.stats.inc_value("kinobox/comments_browser_fallback")
+            yield response.request.replace(
+                meta=self.browser_meta(**response.meta),
+                dont_filter=True
+            )
+            return
+
+        comments_since = response.meta.get("comments_since")
+        comments, reached_known = self.filter_new_comments(movie_id, comments, comments_since)
+
+        batch = self.store_comments(movie_id, current_page, comments)
+        if batch:
+            yield batch
+
+        next_page_url = None if reached_known else self.get_next_page_url(response)
+
+        if current_page == 1 and next_page_url and not comments_since:
+            total_pages = self.get_total_pages(response)
+            page_urls = self.build_page_urls(next_page_url, total_pages)
+
+            if page_urls:
+                self.set_total_pages(movie_id, total_pages)
+
+                for page_num, page_url in page_urls:
+                    yield self.comments_page_request(page_url, movie_data, page_num, total_pages, priority=response.request.priority, restarted=response.meta.get("restarted", False))
+                return
+
+        total_pages = response.meta.get("total_pages")
+
+        if total_pages is None and next_page_url:
+            # the page url scheme is unknown, follow the next page link
+            yield self.comments_page_request(next_page_url, movie_data, current_page + 1, None, comments_since, response.request.priority, response.meta.get("restarted", False))
+        elif total_pages is None or self.is_complete(movie_id):
+            yield from self.finalize_movie_data(movie_data, movie_id)
+
+    async def parse_rendered_comments(self, response: Response) -> None:
+        """
+        Parse the comments from the browser rendered comments page and follow the next page.
+
+        Args:
+            response (Response): The response from the comments page.
+
+        Returns:
+            None
+        """
+        page: Page = response.meta["playwright_page"]
+        current_page = response.meta.get("page_num", 1)
+
+        movie_data = response.meta["movie_data"]
+        movie_id = movie_data.id
+
+        try:
+            await page.wait_for_selector(NEXT_PAGE_SELECTOR, state="visible")
+            await page.wait_for_selector(COMMENT_SELECTOR, state="visible")
+
+            comments, reached_known = self.filter_new_comments(movie_id, self.extract_comments(response), response.meta.get("comments_since"))
+
+            batch = self.store_comments(movie_id, current_page, comments)
+            if batch:
+                yield batch
+
+            next_page_url = None if reached_known else await page.evaluate(f'document.querySelector("{NEXT_PAGE_SELECTOR}").closest("a").href')
+
+            if next_page_url:
+                yield Request(
+                    next_page_url,
+                    meta=self.browser_meta(
+                        movie_data=movie_data,
+                        page_num=current_page + 1,
+                        comments_since=response.meta.get("comments_since"),
+                        url=next_page_url,
+                        restarted=response.meta.get("restarted", False)
+                    ),
+                    priority=response.request.priority,
+                    dont_filter=response.meta.get("restarted", False),
+                    callback=self.parse_comments,
+                    errback=self.comments_failed
+                )
+            else:
+                for item in self.finalize_movie_data(movie_data, movie_id):
+                    yield item
+        except Exception:
+            # it is still possible that there are some comments but no next page button
+            comments, _ = self.filter_new_comments(movie_id, self.extract_comments(response), response.meta.get("comments_since"))
+
+            batch = self.store_comments(movie_id, current_page, comments)
+            if batch:
+                yield batch
+            for item in self.finalize_movie_data(movie_data, movie_id):
+                yield item
+
+        await self.release_page(page)
+
+    def comments_page_request(self, url: str, movie_data: Movie, page_num: int, total_pages: int | None, comments_since: str | None = None, priority: int = 0, restarted: bool = False) -> Request:
+        """
+        Create a plain HTTP request for a comments page.
+
+        Args:
+            url (str): The url of the comments page.
+            movie_data (Movie): The movie data.
+            page_num (int): The number of the comments page.
+            total_pages (int | None): The total number of comments pages, None if unknown.
+            comments_since (str | None): The ISO date of the newest stored comment in the incremental mode.
+            priority (int): The priority of the comments request.
+            restarted (bool): Whether the movie is crawled again, the request then bypasses the dupefilter.
+
+        Returns:
+            Request: The request for the comments page.
+        """
+        return Request(
+            url,
+            meta={
+                "movie_data": movie_data,
+                "page_num": page_num,
+                "total_pages": total_pages,
+                "comments_since": comments_since,
+                "url": url,
+                "restarted": restarted
+            },
+            priority=priority,
+            dont_filter=restarted,
+            callback=self.parse_comments,
+            errback=self.comments_failed
+        )
+
+    async def comments_failed(self, failure) -> None:
+        """
+        Count a failed comments page as done so the movie can still be finalized.
+
+        Args:
+            failure (Failure): The failure of the comments request.
+
+        Returns:
+            None
+        """
+        meta = failure.request.meta
+        movie_data = meta["movie_data"]
+        movie_id = movie_data.id
+
+        if "playwright_page" in meta:
+            await self.page_failed(failure)
+
+        self.logger.warning(f"[FAILED {movie_data.title}] Comments page {meta.get('page_num')} failed: {failure.value!r}")
+        self.store_comments(movie_id, meta.get("page_num", 1), [])
+
+        if meta.get("total_pages") is None or self.is_complete(movie_id):
+            for item in self.finalize_movie_data(movie_data, movie_id):
+                yield item
+
+    def get_next_page_url(self, response: Response) -> str | None:
+        """
+        Get the absolute url of the next page from the static HTML of a paginated comments or ranking page.
+
+        Args:
+            response (Response): The response from the comments or ranking page.
+
+        Returns:
+            str | None: The url of the next page, None if this is the last page.
+        """
+        next_page_url = response.css(NEXT_PAGE_SELECTOR).xpath('ancestor::a[1]/@href').get()
+
+        return response.urljoin(next_page_url) if next_page_url else None
+
+    def get_total_pages(self, response: Response) -> int | None:
+        """
+        Get the total number of comments or ranking pages.
+
+        The page count from the Next.js page payload is cross-checked with the highest page number in the pagination.
+        The payload search can pick up the count of an unrelated widget, so the larger value is used and a mismatch is
+        logged and counted in the kinobox/page_count_mismatch stat.
+
+        Args:
+            response (Response): The response from the first comments or ranking page.
+
+        Returns:
+            int | None: The total number of pages, None if it could not be found.
+        """
+        payload_pages = None
+        next_data = response.xpath('//script[@id="__NEXT_DATA__"]/text()').get()
+
+        if next_data:
+            try:
+                payload_pages = find_page_count(json.loads(next_data))
+            except ValueError:
+                payload_pages = None
+
+        page_numbers = [
+            int(text) for text in response.css(f"{PAGINATION_SELECTOR} a::text").getall()
+            if text.strip().isdigit()
+        ]
+        pagination_pages = max(page_numbers) if page_numbers else None
+
+        if payload_pages and pagination_pages and payload_pages != pagination_pages:
+            self.logger.warning(
+                f"[PAGE COUNT url: {response.url}] Page payload says {payload_pages} pages, "
+                f"pagination links {pagination_pages}, using {max(payload_pages, pagination_pages)}"
+            )
+            self.crawler.stats.inc_value("kinobox/page_count_mismatch")
+
+        return max(payload_pages or 0, pagination_pages or 0) or None
+
+    def build_page_urls(self, next_page_url: str, total_pages: int | None) -> list:
+        """
+        Build the urls of pages 2..N from the url of the second page.
+
+        Args:
+            next_page_url (str): The url of the second page.
+            total_pages (int | None): The total number of pages.
+
+        Returns:
+            list: Tuples of page number and url, empty if the url scheme is not recognized.
+        """
+        if not total_pages or total_pages < 2:
+            return []
+
+        page_param = next(
+            (name for name, value in parse_qsl(urlparse(next_page_url).query) if value == "2"),
+            None
+        )
+
+        if page_param is None:
+            return []
+
+        return [
+            (page_num, add_or_replace_parameter(next_page_url, page_param, str(page_num)))
+            for page_num in range(2, total_pages + 1)
+        ]
+
+    def store_comments(self, movie_id: int | str, page_num: int, comments: list) -> CommentsPage | None:
+        """
+        Store the comments of one comments page.
+
+        In streaming mode only the number of comments is stored and the comments are returned as a batch item.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+            page_num (int): The number of the comments page.
+            comments (list): The comments from the page.
+
+        Returns:
+            CommentsPage | None: The comments batch item in streaming mode, None otherwise.
+        """
+        state = self.movie_comments_map.setdefault(movie_id, new_movie_state())
+
+        for comment in comments:
+            self.track_fill_rate(comment)
+
+            date = parse_date(comment.published)
+            if not date or date < (state["newest_comment"] or ""):
+                continue
+
+            if date > (state["newest_comment"] or ""):
+                state["newest_comment"] = date
+                state["newest_comment_ids"] = set()
+
+            # the ids of the newest day are needed only to skip these comments in the next incremental crawl
+            if self.incremental:
+                state["newest_comment_ids"].add(get_comment_id(comment))
+
+        state["pages"][page_num] = comments if not self.stream_comments else len(comments)
+
+        if self.checkpoint is not None:
+            self.checkpoint.save_page(movie_id, page_num, state, state["pages"][page_num])
+
+        if not self.stream_comments or not comments:
+            return None
+
+        return CommentsPage(movie_id=movie_id, page=page_num, comments=comments)
+
+    def set_total_pages(self, movie_id: int | str, total_pages: int) -> None:
+        state = self.movie_comments_map[movie_id]
+        state["total_pages"] = total_pages
+
+        if self.checkpoint is not None:
+            self.checkpoint.save_state(movie_id, state)
+
+    def is_complete(self, movie_id: int | str) -> bool:
+        """
+        Check whether all comments pages of the movie were processed.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            bool: True if all pages were processed.
+        """
+        state = self.movie_comments_map[movie_id]
+
+        return state["total_pages"] is not None and len(state["pages"]) >= state["total_pages"]
+
+    def finalize_movie_data(self, movie_data: Movie, movie_id: int | str) -> None:
+        """
+        Add the comments to the movie data.
+
+        Args:
+            movie_data (Movie): The movie data.
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            None
+        """
+        # the movie is done, release its comments
+        state = self.movie_comments_map.pop(movie_id, new_movie_state())
+        pages = state["pages"]
+
+        if self.checkpoint is not None:
+            self.checkpoint.delete(movie_id)
+        self.resumed_movie_ids.discard(movie_id)
+
+        if self.stream_comments:
+            comments_count = movie_data.comments_count = sum(pages.values())
+        else:
+            movie_data.comments = [comment for page_num in sorted(pages) for comment in pages[page_num]]
+            comments_count = len(movie_data.comments)
+
+        self.logger.info(f"[FINISHED {movie_data.title}] Got all comments for movie, comments count: {comments_count}")
+
+        comments_since = self.get_comments_since(movie_id)
+        if comments_since:
+            movie_data.comments_since = comments_since
+
+        if self.update_movie_state(movie_data, comments_count, state["newest_comment"], state["newest_comment_ids"]):
+            yield movie_data
+
+    def filter_new_comments(self, movie_id: int | str, comments: list, comments_since: str | None) -> tuple:
+        """
+        Keep only the comments of the movie that were not crawled before, see filter_new_comments.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+            comments (list): The comments from the page.
+            comments_since (str | None): The ISO date of the newest stored comment, None keeps all comments.
+
+        Returns:
+            tuple: The new comments and whether an already crawled comment was reached.
+        """
+        if not comments_since:
+            return comments, False
+
+        return filter_new_comments(comments, comments_since, self.get_known_comment_ids(movie_id))
+
+    def extract_comments(self, response: Response) -> list:
+        """
+        Read the comments from the response.
+
+        Args:
+            response (Response): The response from the comments page.
+
+        Returns:
+            list: The comments from the page.
+        """
+        return extract_comments(response)
+
+
+def new_movie_state() -> dict:
+    return {"pages": {}, "total_pages": None, "newest_comment": None, "newest_comment_ids": set()}
+
+
+def filter_new_comments(comments: list, comments_since: str | None, known_ids: frozenset = frozenset()) -> tuple:
+    """
+    Keep only the comments that are newer than the newest stored comment.
+
+    Comments are listed from the newest, so a comment older than comments_since means the rest was already crawled.
+    Dates have only a day precision, comments from the comments_since day are new unless their id is in known_ids.
+
+    Args:
+        comments (list): The comments from the page.
+        comments_since (str | None): The ISO date of the newest stored comment, None keeps all comments.
+        known_ids (frozenset): The ids of the stored comments from the comments_since day.
+
+    Returns:
+        tuple: The new comments and whether an already crawled comment was reached.
+    """
+    if not comments_since:
+        return comments, False
+
+    new_comments = []
+
+    for comment in comments:
+        date = parse_date(comment.published) or comments_since
+
+        if date > comments_since or (date == comments_since and get_comment_id(comment) not in known_ids):
+            new_comments.append(comment)
+
+    return new_comments, len(new_comments) < len(comments)
+
+
+def find_page_count(data) -> int | None:
+    """
+    Recursively search the Next.js page payload for the comment page count.
+
+    Args:
+        data: The decoded JSON payload.
+
+    Returns:
+        int | None: The page count, None if not found.
+    """
+    if isinstance(data, dict):
+        for key in PAGE_COUNT_KEYS:
+            if isinstance(data.get(key), int):
+                return data[key]
+
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+
+    for value in values:
+        page_count = find_page_count(value)
+
+        if page_count:
+            return page_count
+
+    return None
@@ -0,0 +1,351 @@
+# Extraction shared by the kinobox spiders
+#
+# All XPath expressions are compiled once at import and evaluated directly on the lxml tree of the response.
+# Kinobox uses CSS modules, so class names carry a build hash (FilmLayout_metadata__7nnz4). Selectors match only the
+# stable prefix (FilmLayout_metadata__) so a redeploy does not break the extraction.
+from collections import deque
+
+from lxml import etree
+from scrapy.http.response import Response
+
+from kinobox_crawler.helpers.helpers import get_movie_id, parse_int, parse_duration, parse_date
+from kinobox_crawler.items import Movie, Comment
+
+# Normalized string value of the context node, same as normalize-space(.) in the spider queries
+NORMALIZED_TEXT_XPATH = etree.XPath("normalize-space()")
+
+# Minimum share of pages (or comments) in which the field is found, lower means the selectors are broken
+DEFAULT_MIN_FILL_RATES = {
+    "title": 0.95,
+    "year": 0.9,
+    "duration": 0.5,
+    "main_actors": 0.5,
+    "director": 0.5,
+    "user": 0.9,
+    "published": 0.9,
+    "text": 0.5,
+}
+
+# CSS selectors used in the browser and on the static HTML
+PAGINATION_SELECTOR = "[class*='Pagination_container__']"
+NEXT_PAGE_SELECTOR = f"{PAGINATION_SELECTOR} a:not([disabled]) i[class*='Pagination_nextIcon__']"
+COMMENT_SELECTOR = "[class*='UserRatingItem_container__']"
+
+
+def has_class(prefix: str) -> str:
+    """
+    Build an XPath predicate matching elements with a class starting with the prefix.
+
+    Args:
+        prefix (str): The stable part of the CSS module class name, e.g. FilmLayout_metadata__.
+
+    Returns:
+        str: The XPath predicate.
+    """
+    return f'contains(concat(" ", normalize-space(@class)), " {prefix}")'
+
+
+def has_class_prefix(node, prefix: str) -> bool:
+    return any(name.startswith(prefix) for name in (node.get("class") or "").split())
+
+
+class Field:
+    """
+    Declarative description of one extracted field.
+
+    Args:
+        name (str): The field name.
+        *xpaths (str): The XPath expressions compiled at import, tried in order until one finds a value.
+        many (bool): True to extract the normalized text of every matched node, False to extract a single string.
+    """
+
+    def __init__(self, name: str, *xpaths: str, many: bool = False):
+        self.name = name
+        self.many = many
+        self.xpaths = [etree.XPath(xpath) for xpath in xpaths]
+
+    def extract(self, root) -> str | list:
+        for xpath in self.xpaths:
+            result = xpath(root)
+
+            if not self.many:
+                value = str(result)
+            else:
+                # every node is normalized once and empty values are dropped
+                value = [value for value in (normalize_space(node) for node in result) if value]
+
+            if value:
+                return value
+
+        return [] if self.many else ""
+
+
+MOVIE_FIELDS = (
+    Field("title", 'normalize-space(//h1)'),
+    Field(
+        "title_eng",
+        f'normalize-space(//div[{has_class("FilmLayout_metadata__")}]/h2)',
+        'normalize-space(//h1/following-sibling::h2)',
+    ),
+    Field(
+        "year",
+        f'normalize-space(//div[{has_class("FilmLayout_metadata__")}]//p[{has_class("FilmLayout_yearLabel__")}])',
+        f'normalize-space(//p[{has_class("FilmLayout_yearLabel__")}])',
+    ),
+    Field("duration", f'normalize-space(//div[{has_class("FilmLayout_metadata__")}]//span[2])'),
+    Field(
+        "rating",
+        f'normalize-space(//aside//div[{has_class("FilmLayout_score__")}]/div)',
+        f'normalize-space(//aside//div[{has_class("Score_container__")}]/div)',
+    ),
+    Field(
+        "description",
+        f'normalize-space(//main/div[{has_class("FilmPageOverviewContainer_summary__")}])',
+        f'normalize-space(//main//div[{has_class("FilmPageOverviewContainer_summary__")}])',
+    ),
+    Field(
+        "main_actors",
+        f'//section/div/div/a[{has_class("CastItem_container__")}]//h4',
+        f'//a[{has_class("CastItem_container__")}]//h4',
+        many=True
+    ),
+    Field(
+        "roles",
+        f'//section//div[{has_class("FilmPageOverviewContainer_castInfo__")}]//a',
+        f'//div[{has_class("FilmPageOverviewContainer_castInfo__")}]//a',
+        many=True
+    ),
+)
+
+# Order of the people in the cast info roles
+ROLE_FIELDS = ("director", "screenwriter", "music")
+
+COMMENTS_URL_XPATH = etree.XPath('//ul[@role="list"]/li//i[@title="Komentáře"]/../../../@href')
+
+RANKING_ITEM_XPATH = etree.XPath(f'//main//li//div[{has_class("FilmRankingItemExtended_metaRowWrapper__")}]')
+RANKING_TITLE_URL_XPATH = etree.XPath('(.//a[@data-context="title"])[1]/@href')
+
+COMMENT_XPATH = etree.XPath(f'//article[{has_class("UserRatingItem_container__")}]')
+
+COMMENT_SCORE_CLASS = "UserRatingItem_score__"
+COMMENT_TEXT_CLASS = "UserRatingItem_ratingContent__"
+
+# All nodes of one comment in a single query, in document order
+COMMENT_PARTS_XPATH = etree.XPath(
+    '(.//header/div/a)[1]'
+    ' | (.//header//time)[1]'
+    f' | (.//header/div[{has_class(COMMENT_SCORE_CLASS)}])[1]'
+    f' | (.//div[{has_class(COMMENT_TEXT_CLASS)}])[1]'
+    ' | (.//footer//div)[1]'
+)
+
+
+def normalize_space(node) -> str:
+    """
+    Get the text of the node normalized like XPath normalize-space().
+
+    Args:
+        node: The lxml element.
+
+    Returns:
+        str: The normalized text.
+    """
+    return str(NORMALIZED_TEXT_XPATH(node))
+
+
+def extract_movie_data(response: Response) -> Movie:
+    """
+    Extract the movie data from the response.
+
+    Args:
+        response (Response): The response from the movie details.
+
+    Returns:
+        Movie: The movie data.
+    """
+    root = response.selector.root
+    values = {field.name: field.extract(root) for field in MOVIE_FIELDS}
+    roles = values.pop("roles")
+
+    return Movie(
+        id=get_movie_id(response.url),
+        title=values["title"],
+        title_eng=values["title_eng"],
+        year=parse_int(values["year"]),
+        duration=parse_duration(values["duration"]),
+        rating=parse_int(values["rating"]),
+        description=values["description"],
+        main_actors=values["main_actors"],
+        **{name: roles[index] if len(roles) > index else None for index, name in enumerate(ROLE_FIELDS)}
+    )
+
+
+def extract_comments_url(response: Response) -> str | None:
+    """
+    Extract the link to the comments from the movie details.
+
+    Args:
+        response (Response): The response from the movie details.
+
+    Returns:
+        str | None: The relative url of the comments, None if the movie has no comments.
+    """
+    urls = COMMENTS_URL_XPATH(response.selector.root)
+
+    return str(urls[0]) if urls else None
+
+
+def extract_overview_urls(response: Response) -> list:
+    """
+    Extract the links to the movie details from the best movies list.
+
+    Args:
+        response (Response): The response from the best movies list.
+
+    Returns:
+        list: The relative urls of the movie details.
+    """
+    overview_urls = []
+
+    for movie in RANKING_ITEM_XPATH(response.selector.root):
+        urls = RANKING_TITLE_URL_XPATH(movie)
+
+        if urls and urls[0]:
+            overview_urls.append(str(urls[0]))
+
+    return overview_urls
+
+
+def extract_comments(response: Response) -> list:
+    """
+    Read the comments from the response.
+
+    Args:
+        response (Response): The response from the comments page.
+
+    Returns:
+        list: The Comment items from the page.
+    """
+    comments = []
+
+    for article in COMMENT_XPATH(response.selector.root):
+        parts = {"user": "", "published": "", "rating": "", "text": "", "likes": ""}
+
+        for node in COMMENT_PARTS_XPATH(article):
+            parts[comment_part_name(node)] = normalize_space(node)
+
+        rating = parts["rating"]
+
+        comments.append(Comment(
+            user=parts["user"],
+            # relative dates that cannot be parsed are kept as displayed
+            published=parse_date(parts["published"]) or parts["published"] or None,
+            # the score is shown on a 0-10 scale
+            rating=int(float(rating) * 10) if rating else None,
+            text=parts["text"],
+            likes=parse_int(parts["likes"])
+        ))
+
+    return comments
+
+
+def comment_part_name(node) -> str:
+    """
+    Name the comment node matched by COMMENT_PARTS_XPATH.
+
+    Args:
+        node: The lxml element.
+
+    Returns:
+        str: The comment field the node holds.
+    """
+    if node.tag == "a":
+        return "user"
+
+    if node.tag == "time":
+        return "published"
+
+    if has_class_prefix(node, COMMENT_SCORE_CLASS):
+        return "rating"
+
+    if has_class_prefix(node, COMMENT_TEXT_CLASS):
+        return "text"
+
+    return "likes"
+
+
+class FillRateMixin:
+    """
+    Watches how often the extracted fields are filled to detect broken selectors early.
+
+    The fill rate of every field in KINOBOX_MIN_FILL_RATES is computed over the last KINOBOX_FILL_RATE_WINDOW
+    extracted records. When it drops below the minimum, the kinobox/fields/<field>/low_fill_rate stat is set and,
+    with KINOBOX_FILL_RATE_CLOSE_SPIDER enabled, the spider is closed instead of producing empty data for hours.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field_windows = {}
+        self.low_fill_fields = set()
+        self.min_fill_rates = dict(DEFAULT_MIN_FILL_RATES)
+        self.fill_rate_window = 200
+        self.fill_rate_close_spider = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        # resolved once, the fill rates are tracked for every extracted record
+        settings = crawler.settings
+        spider.min_fill_rates = {**DEFAULT_MIN_FILL_RATES, **settings.getdict("KINOBOX_MIN_FILL_RATES")}
+        spider.fill_rate_window = settings.getint("KINOBOX_FILL_RATE_WINDOW", 200)
+        spider.fill_rate_close_spider = settings.getbool("KINOBOX_FILL_RATE_CLOSE_SPIDER", False)
+
+        return spider
+
+    def track_fill_rate(self, data: Movie | Comment) -> None:
+        """
+        Count the filled fields of the extracted record and check their fill rates.
+
+        Args:
+            data (Movie | Comment): The extracted movie or comment.
+
+        Returns:
+            None
+        """
+        window_size = self.fill_rate_window
+        stats = self.crawler.stats
+
+        for name, min_fill_rate in self.min_fill_rates.items():
+            if not hasattr(data, name):
+                continue
+
+            filled = getattr(data, name) not in (None, "", [])
+            window = self.field_windows.setdefault(name, deque(maxlen=window_size))
+            window.append(filled)
+
+            stats.inc_value(f"kinobox/fields/{name}/total")
+            if filled:
+                stats.inc_value(f"kinobox/fields/{name}/filled")
+
+            if len(window) < window_size:
+                continue
+
+            fill_rate = sum(window) / window_size
+
+            if fill_rate >= min_fill_rate:
+                if name in self.low_fill_fields:
+                    self.low_fill_fields.discard(name)
+                    stats.set_value(f"kinobox/fields/{name}/low_fill_rate", 0)
+                continue
+
+            if name in self.low_fill_fields:
+                continue
+
+            self.low_fill_fields.add(name)
+            stats.set_value(f"kinobox/fields/{name}/low_fill_rate", 1)
+            stats.inc_value("kinobox/fields/low_fill_rate")
+            self.logger.error(f"[SELECTORS] Field {name} filled in {fill_rate:.0%} of the last {window_size} records, expected at least {min_fill_rate:.0%}")
+
+            if self.fill_rate_close_spider:
+                self.crawler.engine.close_spider(self, "low_field_fill_rate")
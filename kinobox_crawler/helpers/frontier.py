@@ -0,0 +1,168 @@
+# Request frontier shared by several crawler processes
+import time
+
+from kinobox_crawler.helpers.helpers import connect_sqlite
+
+
+class FrontierStore:
+    """
+    SQLite store with the request queue and the seen request fingerprints shared by several crawler processes.
+
+    A dequeued request is leased to the worker and deleted once the requests from its callback are queued. Every
+    worker updates its heartbeat regularly and the leases of workers without a recent heartbeat are put back into the
+    queue.
+    """
+
+    def __init__(self, path: str):
+        # autocommit, every statement is atomic on its own
+        self.connection = connect_sqlite(path, autocommit=True)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                worker TEXT,
+                leased_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS requests_queue ON requests (state, priority DESC, id);
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                fingerprint TEXT PRIMARY KEY
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS workers (
+                worker TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+            """
+        )
+
+    def add_fingerprint(self, fingerprint: str) -> bool:
+        """
+        Store the request fingerprint.
+
+        Args:
+            fingerprint (str): The request fingerprint.
+
+        Returns:
+            bool: True if the fingerprint is new, False if any worker has already seen it.
+        """
+        cursor = self.connection.execute("INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)", (fingerprint,))
+
+        return cursor.rowcount == 1
+
+    def remove_fingerprint(self, fingerprint: str) -> None:
+        self.connection.execute("DELETE FROM fingerprints WHERE fingerprint = ?", (fingerprint,))
+
+    def push(self, payload: bytes, priority: int, request_id: int | None = None) -> int:
+        """
+        Queue the request.
+
+        Args:
+            payload (bytes): The serialized request.
+            priority (int): The request priority, higher is dequeued first.
+            request_id (int | None): The id of the leased request the payload replaces, e.g. for a retry.
+
+        Returns:
+            int: The id of the queued request.
+        """
+        if request_id is not None:
+            # a request returned by its worker goes back to the queue instead of being queued twice
+            cursor = self.connection.execute(
+                "UPDATE requests SET state = 'queued', worker = NULL, leased_at = NULL, payload = ?, priority = ? WHERE id = ?",
+                (payload, priority, request_id)
+            )
+            if cursor.rowcount:
+                return request_id
+
+        cursor = self.connection.execute("INSERT INTO requests (priority, payload) VALUES (?, ?)", (priority, payload))
+
+        return cursor.lastrowid
+
+    def lease(self, worker: str) -> tuple | None:
+        """
+        Lease the queued request with the highest priority to the worker.
+
+        Args:
+            worker (str): The worker id.
+
+        Returns:
+            tuple | None: The request id and payload, None if the queue is empty.
+        """
+        rows = self.connection.execute(
+            """
+            UPDATE requests SET state = 'leased', worker = ?, leased_at = ?
+            WHERE id = (SELECT id FROM requests WHERE state = 'queued' ORDER BY priority DESC, id LIMIT 1)
+            RETURNING id, payload
+            """,
+            (worker, time.time())
+        ).fetchall()
+
+        return tuple(rows[0]) if rows else None
+
+    def ack(self, request_id: int) -> None:
+        self.connection.execute("DELETE FROM requests WHERE id = ?", (request_id,))
+
+    def heartbeat(self, worker: str) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO workers (worker, heartbeat) VALUES (?, ?)", (worker, time.time()))
+
+    def requeue_expired(self, timeout: float) -> int:
+        """
+        Put the requests leased by workers without a heartbeat in the last timeout seconds back into the queue.
+
+        Args:
+            timeout (float): The lease timeout in seconds.
+
+        Returns:
+            int: The number of requeued requests.
+        """
+        alive_since = time.time() - timeout
+        cursor = self.connection.execute(
+            """
+            UPDATE requests SET state = 'queued', worker = NULL, leased_at = NULL
+            WHERE state = 'leased' AND worker NOT IN (SELECT worker FROM workers WHERE heartbeat >= ?)
+            """,
+            (alive_since,)
+        )
+        self.connection.execute("DELETE FROM workers WHERE heartbeat < ?", (alive_since,))
+
+        return cursor.rowcount
+
+    def release_worker(self, worker: str) -> int:
+        """
+        Put the requests leased by the worker back into the queue and remove the worker.
+
+        Args:
+            worker (str): The worker id.
+
+        Returns:
+            int: The number of requeued requests.
+        """
+        cursor = self.connection.execute(
+            "UPDATE requests SET state = 'queued', worker = NULL, leased_at = NULL WHERE state = 'leased' AND worker = ?",
+            (worker,)
+        )
+        self.connection.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+        return cursor.rowcount
+
+    def count_queued(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM requests WHERE state = 'queued'").fetchone()[0]
+
+    def count_leased(self, exclude_worker: str | None = None) -> int:
+        """
+        Count the leased requests, whose callbacks may still queue new requests.
+
+        Args:
+            exclude_worker (str | None): The worker whose leases are not counted.
+
+        Returns:
+            int: The number of leased requests.
+        """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM requests WHERE state = 'leased' AND worker IS NOT ?",
+            (exclude_worker,)
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
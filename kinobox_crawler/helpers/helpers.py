@@ -1,5 +1,301 @@
-def should_abort_request(req):
-    if req.resource_type == 'image':
-        return True
+# Helpers module
+import hashlib
+import os
+import re
+import sqlite3
+import zlib
+from urllib.parse import urlparse
 
-    return False
+# Fields that must be present in the server-rendered overview page, otherwise the page is re-rendered in a browser
+REQUIRED_MOVIE_FIELDS = ("title", "year")
+
+# Movie urls look like /film/<id>-<slug>
+MOVIE_ID_PATTERN = re.compile(r"/film/(\d+)")
+
+# Durations look like 1h 42m, or 1 hod 42 min
+DURATION_PATTERN = re.compile(r"(?:(\d+)\s*h[a-z.]*)?\s*(?:(\d+)\s*m[a-z.]*)?")
+
+# Comment dates look like 30. 11. 2024
+DATE_PATTERN = re.compile(r"(\d{1,2})\.\s*(\d{1,2})\.\s*(\d{4})")
+
+# Dates normalized by parse_date look like 2024-11-30
+ISO_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Resource types aborted in the browser, fonts and stylesheets can be added but pagination icons may then stay hidden
+DEFAULT_BLOCKED_RESOURCE_TYPES = ("image", "media")
+
+# Analytics and advertisement domains aborted in the browser
+DEFAULT_BLOCKED_DOMAINS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "facebook.net",
+    "hotjar.com",
+    "gemius.pl",
+    "imedia.cz",
+    "criteo.com",
+    "criteo.net",
+)
+
+# Script domains allowed when third-party scripts are blocked
+DEFAULT_ALLOWED_SCRIPT_DOMAINS = ("kinobox.cz",)
+
+# Rough average size in bytes of the resource types, used to estimate the bytes saved by blocking
+DEFAULT_ESTIMATED_RESOURCE_SIZES = {
+    "image": 40_000,
+    "media": 500_000,
+    "font": 30_000,
+    "stylesheet": 20_000,
+    "script": 60_000,
+}
+
+
+class RequestBlockingPolicy:
+    """
+    Decides which browser requests are aborted and counts blocked and allowed requests per resource type.
+
+    The policy is configured from the KINOBOX_BLOCKED_RESOURCE_TYPES, KINOBOX_BLOCKED_DOMAINS,
+    KINOBOX_BLOCK_THIRD_PARTY_SCRIPTS and KINOBOX_ALLOWED_SCRIPT_DOMAINS settings. Aborted requests never report their
+    size, so the saved bytes are estimated from KINOBOX_ESTIMATED_RESOURCE_SIZES.
+    """
+
+    def __init__(self):
+        self.stats = None
+        self.blocked_resource_types = set(DEFAULT_BLOCKED_RESOURCE_TYPES)
+        self.blocked_domains = tuple(DEFAULT_BLOCKED_DOMAINS)
+        self.block_third_party_scripts = True
+        self.allowed_script_domains = tuple(DEFAULT_ALLOWED_SCRIPT_DOMAINS)
+        self.estimated_sizes = dict(DEFAULT_ESTIMATED_RESOURCE_SIZES)
+
+    def configure(self, settings, stats) -> None:
+        """
+        Load the policy from the crawler settings and report the counters to the crawler stats.
+
+        Args:
+            settings (Settings): The crawler settings.
+            stats (StatsCollector): The crawler stats.
+
+        Returns:
+            None
+        """
+        self.stats = stats
+        self.blocked_resource_types = set(settings.getlist("KINOBOX_BLOCKED_RESOURCE_TYPES", DEFAULT_BLOCKED_RESOURCE_TYPES))
+        self.blocked_domains = tuple(settings.getlist("KINOBOX_BLOCKED_DOMAINS", DEFAULT_BLOCKED_DOMAINS))
+        self.block_third_party_scripts = settings.getbool("KINOBOX_BLOCK_THIRD_PARTY_SCRIPTS", True)
+        self.allowed_script_domains = tuple(settings.getlist("KINOBOX_ALLOWED_SCRIPT_DOMAINS", DEFAULT_ALLOWED_SCRIPT_DOMAINS))
+        self.estimated_sizes = {**DEFAULT_ESTIMATED_RESOURCE_SIZES, **settings.getdict("KINOBOX_ESTIMATED_RESOURCE_SIZES")}
+
+    def __call__(self, req) -> bool:
+        blocked = self.should_block(req)
+
+        if self.stats is not None:
+            resource_type = req.resource_type
+
+            if blocked:
+                self.stats.inc_value(f"kinobox/blocking/blocked/{resource_type}")
+                self.stats.inc_value(f"kinobox/blocking/bytes_saved/{resource_type}", self.estimated_sizes.get(resource_type, 0))
+            else:
+                self.stats.inc_value(f"kinobox/blocking/allowed/{resource_type}")
+
+        return blocked
+
+    def should_block(self, req) -> bool:
+        """
+        Check whether the browser request should be aborted.
+
+        Args:
+            req (playwright.async_api.Request): The browser request.
+
+        Returns:
+            bool: True if the request should be aborted.
+        """
+        if req.resource_type in self.blocked_resource_types:
+            return True
+
+        host = urlparse(req.url).hostname or ""
+
+        if matches_domain(host, self.blocked_domains):
+            return True
+
+        if req.resource_type == "script" and self.block_third_party_scripts:
+            return not matches_domain(host, self.allowed_script_domains)
+
+        return False
+
+
+def matches_domain(host: str, domains: tuple) -> bool:
+    """
+    Check whether the host is one of the domains or their subdomain.
+
+    Args:
+        host (str): The host name.
+        domains (tuple): The domain names.
+
+    Returns:
+        bool: True if the host matches any of the domains.
+    """
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+# Default policy used by the spiders, configured from the crawler settings when the spider is created
+should_abort_request = RequestBlockingPolicy()
+
+
+def needs_browser_render(response, movie_data) -> bool:
+    """
+    Check whether the overview page has to be re-fetched through Playwright.
+
+    Overview pages are fetched with the plain HTTP handler first. Only when the static DOM is missing
+    some of the required fields and the page was not rendered by a browser yet, the browser fallback is used.
+
+    Args:
+        response (Response): The response from the movie details.
+        movie_data (Movie): The movie data extracted from the response.
+
+    Returns:
+        bool: True if the page should be rendered in a browser.
+    """
+    if response.meta.get("playwright"):
+        return False
+
+    return any(not getattr(movie_data, field) for field in REQUIRED_MOVIE_FIELDS)
+
+
+def get_movie_id(url: str) -> int | str:
+    """
+    Get the canonical movie id from the movie url.
+
+    Args:
+        url (str): The url of the movie page, e.g. https://www.kinobox.cz/film/123-movie-title.
+
+    Returns:
+        int | str: The numeric movie id, or the url itself if it does not contain the id.
+    """
+    match = MOVIE_ID_PATTERN.search(url)
+
+    return int(match.group(1)) if match else url
+
+
+def get_shard(movie_id: int | str, shards: int) -> int:
+    """
+    Get the shard the movie belongs to.
+
+    The shard is computed from a CRC32 of the movie id, which unlike hash() is the same in every process and on
+    every machine, so independent workers agree on the partitioning.
+
+    Args:
+        movie_id (int | str): The movie id.
+        shards (int): The number of shards.
+
+    Returns:
+        int: The shard id from 0 to shards - 1.
+    """
+    return zlib.crc32(str(movie_id).encode("utf-8")) % shards
+
+
+def connect_sqlite(path: str, autocommit: bool = False, synchronous: str | None = None) -> sqlite3.Connection:
+    """
+    Open a SQLite database, creating its directory.
+
+    Shard and frontier workers share the databases, WAL lets them read while another one writes and the busy timeout
+    waits for the writer instead of failing right away.
+
+    Args:
+        path (str): The database path.
+        autocommit (bool): True to make every statement atomic on its own, False to commit explicitly.
+        synchronous (str | None): The synchronous pragma, e.g. "NORMAL", None keeps the SQLite default.
+
+    Returns:
+        sqlite3.Connection: The connection in WAL mode.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None if autocommit else "")
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    if synchronous:
+        connection.execute(f"PRAGMA synchronous={synchronous}")
+
+    return connection
+
+
+def get_comment_id(comment) -> str:
+    """
+    Get the identity of the comment, the same comment crawled again gets the same id.
+
+    Args:
+        comment (Comment): The comment.
+
+    Returns:
+        str: The hex digest of the user, date and text.
+    """
+    identity = "\x1f".join((comment.user or "", comment.published or "", comment.text or ""))
+
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def parse_date(value: str | None) -> str | None:
+    """
+    Convert a czech formatted date to an ISO date.
+
+    Args:
+        value (str | None): The date, e.g. 30. 11. 2024, or an already converted ISO date.
+
+    Returns:
+        str | None: The ISO date, e.g. 2024-11-30, None if the value is not a date.
+    """
+    if ISO_DATE_PATTERN.match(value or ""):
+        return value[:10]
+
+    match = DATE_PATTERN.search(value or "")
+
+    if not match:
+        return None
+
+    day, month, year = match.groups()
+
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def parse_int(value) -> int | None:
+    """
+    Convert a number formatted for display to int.
+
+    Args:
+        value: The value, e.g. "2024", "88%" or "1 234".
+
+    Returns:
+        int | None: The number, None if the value does not contain digits.
+    """
+    if isinstance(value, int):
+        return value
+
+    digits = "".join(char for char in str(value or "") if char.isdigit())
+
+    return int(digits) if digits else None
+
+
+def parse_duration(value) -> int | None:
+    """
+    Convert a duration to minutes.
+
+    Args:
+        value: The duration, e.g. "1h 42m".
+
+    Returns:
+        int | None: The duration in minutes, None if the value is not a duration.
+    """
+    if isinstance(value, int):
+        return value
+
+    match = DURATION_PATTERN.fullmatch((value or "").strip())
+
+    if not match or not any(match.groups()):
+        return None
+
+    hours, minutes = match.groups()
+
+    return int(hours or 0) * 60 + int(minutes or 0)
@@ -0,0 +1,316 @@
+# Streaming merge and deduplication of crawl outputs
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import os
+import tempfile
+from itertools import groupby
+
+from kinobox_crawler.helpers.helpers import parse_date, parse_duration, parse_int
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the chunks read from JSON array files
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def open_output(path: str, mode: str = "rb"):
+    """
+    Open a crawl output file, compressed according to its suffix.
+
+    Args:
+        path (str): The file path, ending with .gz or .zst for compressed files.
+        mode (str): "rb" or "wb".
+
+    Returns:
+        The binary file object.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {path} requires the zstandard package")
+
+        file = open(path, mode)
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(file)
+        return zstandard.ZstdCompressor().stream_writer(file)
+
+    return open(path, mode)
+
+
+def read_records(path: str):
+    """
+    Read the records of a JSON lines file, or of a JSON array file like the legacy movies.json, one at a time.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        Iterable[dict]: The records.
+    """
+    with open_output(path) as file:
+        text = io.TextIOWrapper(file, encoding="utf-8")
+
+        if ".jsonl" in os.path.basename(path):
+            for line in text:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        yield from read_json_array(text)
+
+
+def read_json_array(text):
+    """
+    Decode the items of a JSON array without loading the whole array.
+
+    Args:
+        text (TextIO): The text stream with the array.
+
+    Returns:
+        Iterable: The array items.
+    """
+    decoder = json.JSONDecoder()
+    buffer = text.read(READ_CHUNK_SIZE).lstrip()
+
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+
+        if buffer.startswith("]"):
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # the item continues in the next chunk
+            if eof:
+                raise
+
+            chunk = text.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        yield item
+        buffer = buffer[end:]
+
+        if len(buffer) < READ_CHUNK_SIZE and not eof:
+            chunk = text.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+
+
+def normalize_legacy_movie(record: dict) -> dict:
+    """
+    Convert a record of the legacy movies.json, with display strings and without the movie id, to the typed format.
+
+    Args:
+        record (dict): The legacy movie record, e.g. with "year": "2024", "duration": "1h 42m" and "rating": "88%".
+
+    Returns:
+        dict: The movie record with normalized values and a null id.
+    """
+    movie = {key: None if value == "N/A" else value for key, value in record.items()}
+    movie["id"] = None
+    movie["year"] = parse_int(movie.get("year"))
+    movie["duration"] = parse_duration(movie.get("duration"))
+    movie["rating"] = parse_int(movie.get("rating"))
+    movie["comments"] = [
+        {
+            **comment,
+            "published": parse_date(comment.get("published")) or comment.get("published"),
+            "rating": parse_int(comment.get("rating")),
+            "likes": parse_int(comment.get("likes")),
+        }
+        for comment in record.get("comments") or []
+    ]
+
+    return movie
+
+
+def get_title_key(record: dict) -> tuple:
+    return record.get("title"), record.get("year")
+
+
+def get_movie_key(record: dict, movie_ids: dict | None = None) -> list:
+    """
+    Get the sort key of the movie a movie or comments page record belongs to.
+
+    Movies without an id, from the legacy movies.json, are keyed by the id of the movie with the same title and year,
+    or by their title and year when no such movie is known.
+
+    Args:
+        record (dict): The movie or comments page record.
+        movie_ids (dict | None): The movie ids keyed by the title and year, see get_title_key.
+
+    Returns:
+        list: The key, numeric ids sort before other ids and movies without an id sort last.
+    """
+    movie_id = record["movie_id"] if record.get("type") == "comments" else record.get("id")
+
+    if movie_id is None and movie_ids:
+        movie_id = movie_ids.get(get_title_key(record))
+
+    if movie_id is None:
+        return [2, 0, f"{record.get('title')}\x1f{record.get('year')}"]
+
+    return [0, movie_id, ""] if isinstance(movie_id, int) else [1, 0, str(movie_id)]
+
+
+def get_comment_key(comment: dict) -> tuple:
+    text_hash = hashlib.sha1((comment.get("text") or "").encode("utf-8")).hexdigest()
+
+    return comment.get("user"), comment.get("published"), text_hash
+
+
+def write_run(records: list, directory: str) -> str:
+    """
+    Sort the records and write them into a temporary run file.
+
+    Args:
+        records (list): The [key, sequence, record] lists.
+        directory (str): The temporary directory.
+
+    Returns:
+        str: The path of the run file.
+    """
+    records.sort(key=lambda run_record: (run_record[0], run_record[1]))
+
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".jsonl", delete=False) as file:
+        for run_record in records:
+            file.write(json.dumps(run_record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    return file.name
+
+
+def read_run(path: str):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def merge_movie(records: list) -> dict:
+    """
+    Merge all versions of one movie and its comment pages into one movie record.
+
+    Args:
+        records (list): The movie and comments page records in the order they were written.
+
+    Returns:
+        dict: The newest version of the movie with the deduplicated comments, None if only comment pages were found.
+    """
+    movies = [record for record in records if record.get("type") != "comments"]
+    if not movies:
+        return None
+
+    movie_id = next((record["id"] for record in reversed(movies) if record.get("id") is not None), None)
+
+    comments = {}
+    for record in records:
+        for comment in record.get("comments") or []:
+            # the newest version of a comment wins, e.g. with an updated likes count
+            comments[get_comment_key(comment)] = comment
+
+    movie = dict(movies[-1])
+    movie["id"] = movie_id
+    movie["comments"] = sorted(
+        comments.values(),
+        key=lambda comment: (comment.get("published") or "", comment.get("user") or ""),
+        reverse=True
+    )
+    movie["comments_count"] = len(movie["comments"])
+
+    # a full crawl of the movie makes the merged comments complete, otherwise keep the oldest incremental start
+    since = [record.get("comments_since") for record in movies]
+    movie["comments_since"] = None if None in since else min(since)
+
+    return movie
+
+
+def merge_outputs(input_paths: list, output_path: str, buffer_size: int = 100000) -> dict:
+    """
+    Merge the crawl outputs into one deduplicated dataset sorted by the movie id.
+
+    Records are sorted in runs of buffer_size records written to temporary files, which are then merged, so only one
+    run and the versions of one movie are held in memory. Later input files and later lines are considered newer.
+    Records of the legacy movies.json have no movie id, they are normalized and set aside until all inputs are read,
+    then merged into the movie with the same title and year, or with each other when there is no such movie.
+
+    Args:
+        input_paths (list): The JSON lines or JSON array files.
+        output_path (str): The merged JSON lines file, compressed when it ends with .gz or .zst.
+        buffer_size (int): The number of records sorted in memory at once.
+
+    Returns:
+        dict: The number of read records, written movies and written comments.
+    """
+    counts = {"records": 0, "movies": 0, "comments": 0}
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=output_dir or None) as run_dir:
+        run_paths = []
+        buffer = []
+
+        # the ids of the movies by their title and year, None when several movies share them
+        movie_ids = {}
+
+        with tempfile.NamedTemporaryFile("w+", encoding="utf-8", dir=run_dir, suffix=".jsonl") as legacy:
+            for path in input_paths:
+                for record in read_records(path):
+                    if record.get("type") != "comments" and "id" not in record:
+                        legacy.write(json.dumps([counts["records"], normalize_legacy_movie(record)], ensure_ascii=False) + "\n")
+                        counts["records"] += 1
+                        continue
+
+                    if record.get("type") != "comments" and record.get("id") is not None:
+                        title_key = get_title_key(record)
+                        movie_ids[title_key] = record["id"] if movie_ids.get(title_key, record["id"]) == record["id"] else None
+
+                    buffer.append([get_movie_key(record), counts["records"], record])
+                    counts["records"] += 1
+
+                    if len(buffer) >= buffer_size:
+                        run_paths.append(write_run(buffer, run_dir))
+                        buffer = []
+
+            legacy.seek(0)
+            for line in legacy:
+                sequence, record = json.loads(line)
+                buffer.append([get_movie_key(record, movie_ids), sequence, record])
+
+                if len(buffer) >= buffer_size:
+                    run_paths.append(write_run(buffer, run_dir))
+                    buffer = []
+
+        if buffer:
+            run_paths.append(write_run(buffer, run_dir))
+
+        runs = [read_run(path) for path in run_paths]
+        merged = heapq.merge(*runs, key=lambda run_record: (run_record[0], run_record[1]))
+
+        with open_output(output_path, "wb") as output:
+            for _, group in groupby(merged, key=lambda run_record: run_record[0]):
+                movie = merge_movie([run_record[2] for run_record in group])
+                if movie is None:
+                    continue
+
+                output.write((json.dumps(movie, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+                counts["movies"] += 1
+                counts["comments"] += movie["comments_count"]
+
+    return counts
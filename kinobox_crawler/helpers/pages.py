@@ -0,0 +1,122 @@
+# Browser page pool shared by the kinobox spiders
+from playwright.async_api import Page
+
+from kinobox_crawler.helpers.helpers import RequestBlockingPolicy
+
+
+class PagePoolMixin:
+    """
+    Pool of warm Playwright pages reused for browser rendered requests.
+
+    Pages returned by scrapy-playwright are released back to the pool instead of being closed. The PagePoolMiddleware
+    hands them to the next browser request through the playwright_page meta key right before its download. The pool
+    keeps at most KINOBOX_PAGE_POOL_SIZE idle pages and a page is closed after KINOBOX_PAGE_MAX_NAVIGATIONS navigations
+    to limit browser memory leaks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle_pages = []
+        self.page_navigations = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        # the abort predicate only gets the browser request, bind it to this crawl's settings and stats
+        policy = crawler.settings.get("PLAYWRIGHT_ABORT_REQUEST")
+        if isinstance(policy, RequestBlockingPolicy):
+            policy.configure(crawler.settings, crawler.stats)
+
+        return spider
+
+    @property
+    def page_pool_size(self) -> int:
+        return self.settings.getint("KINOBOX_PAGE_POOL_SIZE", 8)
+
+    @property
+    def page_max_navigations(self) -> int:
+        return self.settings.getint("KINOBOX_PAGE_MAX_NAVIGATIONS", 50)
+
+    def browser_meta(self, **meta) -> dict:
+        """
+        Create the meta for a browser rendered request, the PagePoolMiddleware adds a pooled page at its download.
+
+        Args:
+            **meta: Additional meta values of the request.
+
+        Returns:
+            dict: The request meta.
+        """
+        meta = {**meta, "playwright": True, "playwright_include_page": True}
+        meta.pop("playwright_page", None)
+
+        return meta
+
+    def acquire_page(self) -> Page | None:
+        """
+        Take an idle page from the pool.
+
+        Returns:
+            Page | None: The page, None when the pool is empty and scrapy-playwright should open a new one.
+        """
+        while self.idle_pages:
+            page = self.idle_pages.pop()
+
+            if not page.is_closed():
+                self.crawler.stats.inc_value("kinobox/page_pool/reused")
+                return page
+
+            self.page_navigations.pop(page, None)
+
+        self.crawler.stats.inc_value("kinobox/page_pool/created")
+
+        return None
+
+    async def release_page(self, page: Page) -> None:
+        """
+        Return the page to the pool, or close it when the pool is full or the page was used too many times.
+
+        Args:
+            page (Page): The page from the response.
+
+        Returns:
+            None
+        """
+        navigations = self.page_navigations.get(page, 0) + 1
+
+        if page.is_closed():
+            self.page_navigations.pop(page, None)
+            return
+
+        if navigations >= self.page_max_navigations or len(self.idle_pages) >= self.page_pool_size:
+            self.page_navigations.pop(page, None)
+            self.crawler.stats.inc_value("kinobox/page_pool/closed")
+            await page.close()
+            return
+
+        self.page_navigations[page] = navigations
+        self.idle_pages.append(page)
+
+    async def discard_page(self, page: Page) -> None:
+        self.page_navigations.pop(page, None)
+
+        if not page.is_closed():
+            await page.close()
+
+    async def page_failed(self, failure) -> None:
+        """
+        Close the page of a failed browser request so it does not leak.
+
+        Args:
+            failure (Failure): The failure of the request.
+
+        Returns:
+            None
+        """
+        page = failure.request.meta.get("playwright_page")
+
+        if page is not None:
+            await self.discard_page(page)
+
+        self.logger.warning(f"[FAILED url: {failure.request.url}] Browser request failed: {failure.value!r}")
@@ -0,0 +1,132 @@
+# Full-text search index over the movie descriptions and comment texts
+from kinobox_crawler.helpers.helpers import connect_sqlite
+
+# Weight of the title and text columns in the bm25 ranking
+TITLE_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+
+class SearchIndex:
+    """
+    SQLite FTS5 index of the movie descriptions and comment texts.
+
+    Documents are stored in the documents table keyed by movie:<id> or comment:<movie id>:<comment id> and indexed by
+    the external content FTS5 table documents_fts, kept up to date by triggers, so documents can be upserted while
+    the crawl runs. The unicode61 tokenizer folds the diacritics, so "pribeh" finds "příběh".
+    """
+
+    def __init__(self, path: str):
+        self.connection = connect_sqlite(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                movie_id TEXT NOT NULL,
+                title TEXT,
+                text TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                title,
+                text,
+                content = 'documents',
+                content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+                INSERT INTO documents_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+                INSERT INTO documents_fts (documents_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_update AFTER UPDATE ON documents BEGIN
+                INSERT INTO documents_fts (documents_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+                INSERT INTO documents_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+            END;
+            """
+        )
+
+    def upsert(self, documents: list) -> None:
+        """
+        Add the documents to the index, replacing the documents with the same key.
+
+        Args:
+            documents (list): Tuples of key, kind, movie id, title and text.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO documents (key, kind, movie_id, title, text) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET title = excluded.title, text = excluded.text
+                WHERE title IS NOT excluded.title OR text IS NOT excluded.text
+                """,
+                documents
+            )
+
+    def search(self, query: str, limit: int = 20, kind: str | None = None) -> list:
+        """
+        Search the documents, best matches first.
+
+        Args:
+            query (str): The words to search for, all of them have to match. A word ending with * matches a prefix.
+            limit (int): The maximum number of results.
+            kind (str | None): "movie" or "comment" to search only movies or comments.
+
+        Returns:
+            list: Dicts with the kind, movie id, movie title, snippet of the matched text and the rank.
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+
+        rows = self.connection.execute(
+            f"""
+            SELECT
+                documents.kind,
+                documents.movie_id,
+                COALESCE(documents.title, movies.title) AS title,
+                snippet(documents_fts, 1, '[', ']', '…', 16) AS snippet,
+                bm25(documents_fts, {TITLE_WEIGHT}, {TEXT_WEIGHT}) AS rank
+            FROM documents_fts
+            JOIN documents ON documents.id = documents_fts.rowid
+            LEFT JOIN documents AS movies ON movies.key = 'movie:' || documents.movie_id
+            WHERE documents_fts MATCH ? AND (? IS NULL OR documents.kind = ?)
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (match, kind, kind, limit)
+        ).fetchall()
+
+        return [
+            {"kind": kind, "movie_id": movie_id, "title": title, "snippet": snippet, "rank": rank}
+            for kind, movie_id, title, snippet, rank in rows
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def build_match_query(query: str) -> str:
+    """
+    Build the FTS5 match expression from the user query, quoting the words so they are not read as FTS5 syntax.
+
+    Args:
+        query (str): The user query, e.g. "válečný film*".
+
+    Returns:
+        str: The match expression, e.g. "válečný" "film"*.
+    """
+    terms = []
+
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+
+    return " ".join(terms)
@@ -0,0 +1,92 @@
+# Streaming sitemap parsing and lastmod based prioritisation
+from datetime import date
+from io import BytesIO
+
+from lxml import etree
+
+# Request priority by the maximum age of the sitemap lastmod in days, a small fixed set keeps the scheduler queues few
+LASTMOD_PRIORITIES = (
+    (1, 4),
+    (7, 3),
+    (30, 2),
+    (365, 1),
+)
+
+
+class StreamingSitemap:
+    """
+    Sitemap parser that yields the entries one by one without building the whole XML tree.
+
+    Large sub-sitemaps hold tens of thousands of urls, so every parsed entry is cleared from the tree right away.
+    """
+
+    def __init__(self, body: bytes):
+        self.context = etree.iterparse(
+            BytesIO(body),
+            events=("start", "end"),
+            resolve_entities=False,
+            recover=True,
+            huge_tree=True
+        )
+        _, self.root = next(self.context)
+        self.type = etree.QName(self.root).localname.lower()
+
+    def __iter__(self):
+        for event, element in self.context:
+            if event != "end" or etree.QName(element).localname not in ("url", "sitemap"):
+                continue
+
+            entry = {}
+            for child in element:
+                name = etree.QName(child).localname
+                if name in ("loc", "lastmod") and child.text:
+                    entry[name] = child.text.strip()
+
+            # drop the parsed entries so the tree does not grow
+            element.clear()
+            while element.getprevious() is not None:
+                del self.root[0]
+
+            if "loc" in entry:
+                yield entry
+
+
+def parse_lastmod(lastmod: str | None) -> date | None:
+    """
+    Parse the date part of the sitemap lastmod.
+
+    Args:
+        lastmod (str | None): The lastmod value, e.g. 2024-11-30 or 2024-11-30T10:00:00+00:00.
+
+    Returns:
+        date | None: The lastmod date, None if missing or invalid.
+    """
+    try:
+        return date.fromisoformat(lastmod[:10]) if lastmod else None
+    except ValueError:
+        return None
+
+
+def lastmod_priority(lastmod: str | None, today: date | None = None) -> int:
+    """
+    Get the request priority for the sitemap lastmod, recently changed pages get higher priority.
+
+    Args:
+        lastmod (str | None): The lastmod value.
+        today (date | None): The current date, defaults to today.
+
+    Returns:
+        int: The request priority.
+    """
+    lastmod_date = parse_lastmod(lastmod)
+
+    if lastmod_date is None:
+        return 0
+
+    age = ((today or date.today()) - lastmod_date).days
+
+    for max_age, priority in LASTMOD_PRIORITIES:
+        if age <= max_age:
+            return priority
+
+    return 0
@@ -0,0 +1,246 @@
+# Persistent movie state used by the incremental re-crawl mode
+import dataclasses
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+from kinobox_crawler.helpers.helpers import connect_sqlite, get_movie_id
+from kinobox_crawler.items import Movie
+
+# Movie data keys that are not part of the overview page and are left out of the overview hash
+NON_OVERVIEW_KEYS = ("comments", "comments_count", "comments_since")
+
+
+class MovieStateStore:
+    """
+    SQLite store with the last seen state of every movie.
+
+    For every movie id it keeps the sitemap lastmod, the hash of the overview data, the number of comments, the
+    date of the newest comment and the ids of the comments from that date. Comment dates have only a day precision,
+    the ids tell the already crawled comments of the newest day apart from the new ones.
+    """
+
+    def __init__(self, path: str):
+        self.connection = connect_sqlite(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS movie_state (
+                movie_id TEXT PRIMARY KEY,
+                lastmod TEXT,
+                overview_hash TEXT,
+                comments_count INTEGER NOT NULL DEFAULT 0,
+                newest_comment TEXT,
+                newest_comment_ids TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+
+        # stores created before the comment ids were kept
+        columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(movie_state)")]
+        if "newest_comment_ids" not in columns:
+            self.connection.execute("ALTER TABLE movie_state ADD COLUMN newest_comment_ids TEXT")
+
+        self.connection.commit()
+
+    def get(self, movie_id: int | str) -> dict | None:
+        """
+        Get the stored state of the movie.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            dict | None: The movie state, None if the movie was not crawled yet.
+        """
+        row = self.connection.execute("SELECT * FROM movie_state WHERE movie_id = ?", (str(movie_id),)).fetchone()
+
+        return dict(row) if row else None
+
+    def update(self, movie_id: int | str, lastmod: str | None, overview_hash: str, comments_count: int, newest_comment: str | None, newest_comment_ids: list) -> None:
+        """
+        Insert or update the state of the movie.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+            lastmod (str | None): The sitemap lastmod of the movie page, None keeps the stored value.
+            overview_hash (str): The hash of the overview data.
+            comments_count (int): The total number of comments seen so far.
+            newest_comment (str | None): The ISO date of the newest comment, None keeps the stored value.
+            newest_comment_ids (list): The ids of the comments from the newest_comment date.
+
+        Returns:
+            None
+        """
+        self.connection.execute(
+            """
+            INSERT INTO movie_state (movie_id, lastmod, overview_hash, comments_count, newest_comment, newest_comment_ids, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (movie_id) DO UPDATE SET
+                lastmod = COALESCE(excluded.lastmod, lastmod),
+                overview_hash = excluded.overview_hash,
+                comments_count = excluded.comments_count,
+                newest_comment = COALESCE(excluded.newest_comment, newest_comment),
+                newest_comment_ids = CASE WHEN excluded.newest_comment IS NULL THEN newest_comment_ids ELSE excluded.newest_comment_ids END,
+                updated_at = excluded.updated_at
+            """,
+            (str(movie_id), lastmod, overview_hash, comments_count, newest_comment, json.dumps(sorted(newest_comment_ids)), datetime.now(timezone.utc).isoformat())
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class IncrementalMixin:
+    """
+    Incremental re-crawl mode shared by the kinobox spiders.
+
+    With the KINOBOX_INCREMENTAL setting enabled, the state of every finished movie is stored in KINOBOX_STATE_DB.
+    Sitemap entries with an unchanged lastmod are skipped, comment pages are read only until a comment older than the
+    newest stored one is found, and movies with unchanged overview and no new comments are not emitted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state_store = None
+        self.pending_lastmods = {}
+
+    @property
+    def incremental(self) -> bool:
+        return self.settings.getbool("KINOBOX_INCREMENTAL", False)
+
+    def get_state_store(self) -> MovieStateStore:
+        """
+        Open the movie state store on first use.
+
+        Returns:
+            MovieStateStore: The movie state store.
+        """
+        if self.state_store is None:
+            self.state_store = MovieStateStore(self.settings.get("KINOBOX_STATE_DB", "crawls/movie_state.db"))
+
+        return self.state_store
+
+    def is_sitemap_entry_changed(self, entry: dict) -> bool:
+        """
+        Check whether the movie from the sitemap entry changed since the last crawl.
+
+        Args:
+            entry (dict): The sitemap entry with loc and optional lastmod.
+
+        Returns:
+            bool: False if the movie was crawled with the same lastmod before.
+        """
+        if not self.incremental or "/film/" not in entry["loc"]:
+            return True
+
+        movie_id = get_movie_id(entry["loc"])
+        lastmod = entry.get("lastmod")
+        previous = self.get_state_store().get(movie_id)
+
+        if previous and lastmod and previous["lastmod"] == lastmod:
+            self.crawler.stats.inc_value("kinobox/incremental/unchanged_lastmod")
+            return False
+
+        if lastmod:
+            self.pending_lastmods[movie_id] = lastmod
+
+        return True
+
+    def get_comments_since(self, movie_id: int | str) -> str | None:
+        """
+        Get the date of the newest stored comment of the movie.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            str | None: The ISO date of the newest comment, None if all comments should be read.
+        """
+        if not self.incremental:
+            return None
+
+        previous = self.get_state_store().get(movie_id)
+
+        return previous["newest_comment"] if previous else None
+
+    def get_known_comment_ids(self, movie_id: int | str) -> frozenset:
+        """
+        Get the ids of the stored comments from the date of the newest stored comment.
+
+        Args:
+            movie_id (int | str): The id of the movie.
+
+        Returns:
+            frozenset: The comment ids, empty if all comments should be read.
+        """
+        if not self.incremental:
+            return frozenset()
+
+        previous = self.get_state_store().get(movie_id)
+
+        return frozenset(json.loads(previous["newest_comment_ids"] or "[]")) if previous else frozenset()
+
+    def update_movie_state(self, movie_data: Movie, new_comments_count: int, newest_comment: str | None, newest_comment_ids: set) -> bool:
+        """
+        Store the state of the finished movie.
+
+        Args:
+            movie_data (Movie): The movie data.
+            new_comments_count (int): The number of comments read in this crawl.
+            newest_comment (str | None): The ISO date of the newest comment read in this crawl.
+            newest_comment_ids (set): The ids of the comments from the newest_comment date read in this crawl.
+
+        Returns:
+            bool: False if the movie did not change and should not be emitted.
+        """
+        if not self.incremental:
+            return True
+
+        movie_id = movie_data.id
+        store = self.get_state_store()
+        previous = store.get(movie_id)
+        overview_hash = hash_overview(movie_data)
+        incremental_comments = previous is not None and previous["newest_comment"] is not None
+
+        comments_count = new_comments_count
+        if incremental_comments:
+            comments_count += previous["comments_count"]
+
+        # new comments from the same day as the previous newest one join the already known ones
+        if incremental_comments and newest_comment == previous["newest_comment"]:
+            newest_comment_ids = set(newest_comment_ids) | set(json.loads(previous["newest_comment_ids"] or "[]"))
+
+        store.update(movie_id, self.pending_lastmods.pop(movie_id, None), overview_hash, comments_count, newest_comment, newest_comment_ids)
+
+        if previous and previous["overview_hash"] == overview_hash and new_comments_count == 0:
+            self.crawler.stats.inc_value("kinobox/incremental/unchanged_movie")
+            return False
+
+        return True
+
+    def closed(self, reason: str) -> None:
+        if self.state_store is not None:
+            self.state_store.close()
+
+
+def hash_overview(movie_data: Movie) -> str:
+    """
+    Hash the overview part of the movie data.
+
+    Args:
+        movie_data (Movie): The movie data.
+
+    Returns:
+        str: The hex digest of the overview data.
+    """
+    overview = {
+        field.name: getattr(movie_data, field.name)
+        for field in dataclasses.fields(movie_data)
+        if field.name not in NON_OVERVIEW_KEYS
+    }
+
+    return hashlib.sha1(json.dumps(overview, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
@@ -2,11 +2,84 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+#
+# Items are slotted dataclasses with values normalized at extraction time, so the comments of in-flight movies are
+# held in memory without per-instance dicts and display strings, and consumers do not have to parse them again.
+
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Comment:
+    """
+    One user comment of a movie.
+
+    Attributes:
+        user (str): The user name.
+        published (str | None): The ISO date, or the displayed date when it could not be parsed.
+        rating (int | None): The user rating in percent, None if the user did not rate the movie.
+        text (str): The comment text.
+        likes (int | None): The number of likes.
+    """
+
+    user: str
+    published: str | None
+    rating: int | None
+    text: str
+    likes: int | None
+
+
+@dataclass(slots=True)
+class Movie:
+    """
+    Movie details with its comments.
+
+    Attributes:
+        id (int | str): The movie id from the url.
+        title (str): The czech title.
+        title_eng (str): The english title.
+        year (int | None): The release year.
+        duration (int | None): The duration in minutes.
+        rating (int | None): The average rating in percent.
+        description (str): The plot summary.
+        main_actors (list[str]): The main actors.
+        director (str | None): The director.
+        screenwriter (str | None): The screenwriter.
+        music (str | None): The composer.
+        comments (list[Comment] | None): The comments, None when they are streamed as CommentsPage items.
+        comments_count (int | None): The number of streamed comments.
+        comments_since (str | None): In the incremental mode, the ISO date of the newest previously crawled comment.
+    """
+
+    id: int | str
+    title: str
+    title_eng: str
+    year: int | None
+    duration: int | None
+    rating: int | None
+    description: str
+    main_actors: list[str]
+    director: str | None
+    screenwriter: str | None
+    music: str | None
+    comments: list[Comment] | None = None
+    comments_count: int | None = None
+    comments_since: str | None = None
+
 
-import scrapy
+@dataclass(slots=True)
+class CommentsPage:
+    """
+    One page of comments emitted right away with the KINOBOX_STREAM_COMMENTS setting.
 
+    Attributes:
+        movie_id (int | str): The id of the movie the comments belong to.
+        page (int): The number of the comments page.
+        comments (list[Comment]): The comments from the page.
+        type (str): Always "comments", tells the page apart from movies in the exported lines.
+    """
 
-class KinoboxCrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    movie_id: int | str
+    page: int
+    comments: list[Comment]
+    type: str = "comments"
@@ -3,11 +3,24 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.misc import load_object
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from kinobox_crawler.helpers.cache import ResponseCacheStore
+from kinobox_crawler.scheduler import SharedFrontierScheduler
+
 
 class KinoboxCrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +114,420 @@ class KinoboxCrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ThrottleBudget:
+    """
+    Concurrency budget of one kind of requests, adjusted with additive increase and multiplicative decrease.
+
+    Requests wait in acquire() until there is a free slot and no Retry-After pause is active.
+    """
+
+    def __init__(self, name: str, start: float, minimum: float, maximum: float):
+        self.name = name
+        self.limit = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.successes = 0
+        self.latencies = deque(maxlen=100)
+        self.waiters = deque()
+        self.wake_scheduled = False
+
+    def has_slot(self) -> bool:
+        return self.in_flight < int(self.limit) and time.monotonic() >= self.blocked_until
+
+    async def acquire(self) -> None:
+        while not self.has_slot():
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+
+            # nothing may be in flight to release a slot, so wake up when the pause ends
+            pause = self.blocked_until - time.monotonic()
+            if pause > 0:
+                self.schedule_wake(pause)
+
+            await waiter
+
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Wake the waiting requests, or schedule the wake up when the budget is paused.
+
+        Returns:
+            None
+        """
+        self.wake_scheduled = False
+        delay = self.blocked_until - time.monotonic()
+
+        if delay > 0:
+            self.schedule_wake(delay)
+            return
+
+        # every waiter re-checks the slot, the ones without a slot wait again
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def schedule_wake(self, delay: float) -> None:
+        if not self.wake_scheduled:
+            self.wake_scheduled = True
+            asyncio.get_running_loop().call_later(delay, self.wake)
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+class AdaptiveThrottleMiddleware:
+    """
+    AIMD throttling with separate concurrency budgets for Playwright pages and plain HTTP requests.
+
+    While the server answers quickly, the budget grows by KINOBOX_THROTTLE_INCREASE after every
+    KINOBOX_THROTTLE_WINDOW successful responses. A 429 (or 503) response multiplies it by
+    KINOBOX_THROTTLE_DECREASE_FACTOR and pauses the budget for the Retry-After time, so retried requests back off too.
+    When the 90th latency percentile exceeds KINOBOX_THROTTLE_TARGET_LATENCY the budget stops growing and shrinks.
+    """
+
+    THROTTLE_HTTP_CODES = (429, 503)
+
+    def __init__(self, settings, stats):
+        self.stats = stats
+        self.increase = settings.getfloat("KINOBOX_THROTTLE_INCREASE", 1.0)
+        self.decrease_factor = settings.getfloat("KINOBOX_THROTTLE_DECREASE_FACTOR", 0.5)
+        self.window = settings.getint("KINOBOX_THROTTLE_WINDOW", 20)
+        self.target_latency = settings.getfloat("KINOBOX_THROTTLE_TARGET_LATENCY", 5.0)
+        self.default_retry_after = settings.getfloat("KINOBOX_THROTTLE_RETRY_AFTER", 10.0)
+
+        self.budgets = {
+            "browser": ThrottleBudget(
+                "browser",
+                settings.getfloat("KINOBOX_THROTTLE_BROWSER_START", 2),
+                settings.getfloat("KINOBOX_THROTTLE_BROWSER_MIN", 1),
+                settings.getfloat("KINOBOX_THROTTLE_BROWSER_MAX", 8),
+            ),
+            "http": ThrottleBudget(
+                "http",
+                settings.getfloat("KINOBOX_THROTTLE_HTTP_START", 4),
+                settings.getfloat("KINOBOX_THROTTLE_HTTP_MIN", 1),
+                settings.getfloat("KINOBOX_THROTTLE_HTTP_MAX", 32),
+            ),
+        }
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("KINOBOX_THROTTLE_ENABLED", True):
+            raise NotConfigured
+
+        return cls(crawler.settings, crawler.stats)
+
+    def get_budget(self, request) -> ThrottleBudget:
+        return self.budgets["browser" if request.meta.get("playwright") else "http"]
+
+    async def process_request(self, request, spider):
+        budget = self.get_budget(request)
+        await budget.acquire()
+
+        # remember the budget, responses served without a download (e.g. from a cache) have no slot to release
+        request.meta["kinobox_throttle_budget"] = budget.name
+        return None
+
+    def process_response(self, request, response, spider):
+        budget_name = request.meta.pop("kinobox_throttle_budget", None)
+        if budget_name is None:
+            return response
+
+        budget = self.budgets[budget_name]
+
+        if response.status in self.THROTTLE_HTTP_CODES:
+            self.stats.inc_value(f"kinobox/throttle/{budget.name}/throttled")
+            self.decrease(budget, self.get_retry_after(response))
+        else:
+            latency = request.meta.get("download_latency")
+            if latency is not None:
+                budget.latencies.append(latency)
+            self.on_success(budget)
+
+        budget.release()
+        return response
+
+    def process_exception(self, request, exception, spider):
+        budget_name = request.meta.pop("kinobox_throttle_budget", None)
+        if budget_name is not None:
+            self.budgets[budget_name].release()
+
+    def on_success(self, budget: ThrottleBudget) -> None:
+        budget.successes += 1
+
+        if budget.successes < self.window:
+            return
+
+        budget.successes = 0
+        latency = budget.latency_percentile(0.9)
+
+        if latency is not None and latency > self.target_latency:
+            self.stats.inc_value(f"kinobox/throttle/{budget.name}/slow")
+            self.decrease(budget, 0)
+            return
+
+        budget.limit = min(budget.maximum, budget.limit + self.increase)
+        self.stats.set_value(f"kinobox/throttle/{budget.name}/limit", budget.limit)
+
+    def decrease(self, budget: ThrottleBudget, pause: float) -> None:
+        """
+        Shrink the budget and pause it for the given time.
+
+        Args:
+            budget (ThrottleBudget): The throttled budget.
+            pause (float): Seconds without new requests of the budget.
+
+        Returns:
+            None
+        """
+        budget.successes = 0
+        budget.limit = max(budget.minimum, budget.limit * self.decrease_factor)
+        budget.blocked_until = max(budget.blocked_until, time.monotonic() + pause)
+        self.stats.set_value(f"kinobox/throttle/{budget.name}/limit", budget.limit)
+
+    def get_retry_after(self, response) -> float:
+        """
+        Read the Retry-After header, given either in seconds or as an HTTP date.
+
+        Args:
+            response (Response): The throttled response.
+
+        Returns:
+            float: Seconds to wait before the next request.
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
+            return self.default_retry_after
+
+        value = value.decode("latin-1").strip()
+
+        if value.isdigit():
+            return float(value)
+
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return self.default_retry_after
+
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class FrontierAckMiddleware:
+    """
+    Deletes the requests leased from the shared frontier once they are finished.
+
+    Enabled both as a spider middleware, acking a request after all output of its callback went through, so the new
+    requests are queued before the lease disappears, and as a downloader middleware, acking a request whose download
+    failed for good. Only active with the SharedFrontierScheduler.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not issubclass(load_object(crawler.settings["SCHEDULER"]), SharedFrontierScheduler):
+            raise NotConfigured
+
+        return cls(crawler)
+
+    def ack(self, request) -> None:
+        self.crawler.engine.slot.scheduler.ack(request)
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+        self.ack(response.request)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for item in result:
+            yield item
+        self.ack(response.request)
+
+    def process_spider_exception(self, response, exception, spider):
+        self.ack(response.request)
+
+    def process_exception(self, request, exception, spider):
+        # retries returned their request before reaching this middleware, the failure is final
+        self.ack(request)
+
+
+class ResponseCacheMiddleware:
+    """
+    Caches plain HTTP and browser rendered responses in a compressed SQLite store (KINOBOX_CACHE_DB).
+
+    Unlike the Scrapy HTTP cache it also works for responses of the Playwright handler. A cached response is fresh for
+    the TTL of its callback from KINOBOX_CACHE_TTLS (KINOBOX_CACHE_FIRST_COMMENTS_PAGE_TTL for the first comments
+    page, where new comments show up). A stale plain HTTP response with an ETag or Last-Modified header is revalidated
+    with a conditional request, other stale responses are downloaded again. Least recently used responses are evicted
+    when the cache outgrows KINOBOX_CACHE_MAX_BYTES. Requests driving a browser page in the callback are not cached,
+    there is no page to replay them on.
+    """
+
+    def __init__(self, store: ResponseCacheStore, ttls: dict, default_ttl: int, first_comments_page_ttl: int, stats):
+        self.store = store
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.first_comments_page_ttl = first_comments_page_ttl
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool("KINOBOX_CACHE_ENABLED", False):
+            raise NotConfigured
+
+        middleware = cls(
+            ResponseCacheStore(
+                settings.get("KINOBOX_CACHE_DB", "crawls/http_cache.db"),
+                settings.getint("KINOBOX_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024),
+            ),
+            settings.getdict("KINOBOX_CACHE_TTLS"),
+            settings.getint("KINOBOX_CACHE_TTL", 24 * 3600),
+            settings.getint("KINOBOX_CACHE_FIRST_COMMENTS_PAGE_TTL", 3600),
+            crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+
+        return middleware
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+    def process_request(self, request, spider):
+        if not self.is_cacheable(request):
+            return None
+
+        entry = self.store.get(self.get_key(request))
+
+        if entry is None:
+            self.stats.inc_value("kinobox/cache/miss")
+            return None
+
+        if time.time() - entry["stored_at"] < self.get_ttl(request):
+            self.stats.inc_value("kinobox/cache/hit")
+            return self.build_response(entry, request)
+
+        if not request.meta.get("playwright") and (entry["etag"] or entry["last_modified"]):
+            self.stats.inc_value("kinobox/cache/revalidate")
+            request.meta["kinobox_cache_revalidate"] = True
+
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+        else:
+            self.stats.inc_value("kinobox/cache/stale")
+
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags or not self.is_cacheable(request):
+            return response
+
+        key = self.get_key(request)
+
+        if request.meta.pop("kinobox_cache_revalidate", False) and response.status == 304:
+            entry = self.store.get(key)
+
+            if entry is not None:
+                self.stats.inc_value("kinobox/cache/revalidated")
+                self.store.touch(key)
+                return self.build_response(entry, request)
+
+        if response.status == 200:
+            headers = {
+                name.decode("latin-1"): [value.decode("latin-1") for value in values]
+                for name, values in response.headers.items()
+            }
+            self.store.put(key, response.url, response.status, headers, response.body)
+            self.stats.inc_value("kinobox/cache/stored")
+
+        return response
+
+    def is_cacheable(self, request) -> bool:
+        if request.method != "GET" or request.meta.get("dont_cache"):
+            return False
+
+        # the callback works with the live browser page, a cached body cannot replace it
+        return not request.meta.get("playwright_include_page")
+
+    def get_key(self, request) -> str:
+        # the rendered page differs from the static HTML of the same url
+        return f"{'rendered' if request.meta.get('playwright') else 'static'}:{request.url}"
+
+    def get_ttl(self, request) -> int:
+        """
+        Get the time the cached response of the request is fresh.
+
+        Args:
+            request (Request): The request.
+
+        Returns:
+            int: The TTL in seconds.
+        """
+        callback = getattr(request.callback, "__name__", None) or "parse"
+
+        if callback == "parse_comments" and request.meta.get("page_num", 1) == 1:
+            return self.first_comments_page_ttl
+
+        return self.ttls.get(callback, self.default_ttl)
+
+    def build_response(self, entry: dict, request):
+        headers = Headers(entry["headers"])
+        response_class = responsetypes.from_args(headers=headers, url=entry["url"], body=entry["body"])
+
+        return response_class(
+            url=entry["url"],
+            status=entry["status"],
+            headers=headers,
+            body=entry["body"],
+            request=request,
+            flags=["cached"],
+        )
+
+
+class PagePoolMiddleware:
+    """
+    Hands an idle page of the spider's page pool (see PagePoolMixin) to a browser request right before its download.
+
+    Queued browser requests do not hold a page, so the pool is not starved by requests waiting in the scheduler and
+    the requests can be serialized into the JOBDIR disk queue. Enabled after the AdaptiveThrottleMiddleware, so the page
+    is taken once the request got its browser budget. The page of a failed download is closed here, a retry of the
+    request gets another one.
+    """
+
+    def process_request(self, request, spider):
+        if not request.meta.get("playwright_include_page") or "playwright_page" in request.meta:
+            return None
+
+        page = spider.acquire_page() if hasattr(spider, "acquire_page") else None
+        if page is not None:
+            request.meta["playwright_page"] = page
+
+        return None
+
+    async def process_exception(self, request, exception, spider):
+        page = request.meta.pop("playwright_page", None)
+
+        if page is not None and hasattr(spider, "discard_page"):
+            await spider.discard_page(page)
+
+        return None
@@ -3,11 +3,522 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import gzip
+import json
+import os
+import time
+
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from kinobox_crawler.helpers.helpers import connect_sqlite, get_comment_id
+from kinobox_crawler.helpers.search import SearchIndex
+from kinobox_crawler.items import CommentsPage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Roles of the people linked to a movie in the movie_people table, main actors are stored as "actor"
+PERSON_ROLES = ("director", "screenwriter", "music")
+
+COMPRESSION_SUFFIXES = {
+    None: "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
 
 class KinoboxCrawlerPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class JsonLinesExportPipeline:
+    """
+    Writes every item as one JSON line into rotated output files.
+
+    Lines are buffered in memory and written in chunks of KINOBOX_JSONL_BUFFER_SIZE bytes. A new file is started once
+    the current one reaches KINOBOX_JSONL_MAX_BYTES of uncompressed data or is older than KINOBOX_JSONL_MAX_SECONDS.
+    Files are optionally compressed with gzip or zstd (KINOBOX_JSONL_COMPRESSION).
+    """
+
+    def __init__(self, output_dir: str, compression: str | None, buffer_size: int, max_bytes: int, max_seconds: int):
+        self.output_dir = output_dir
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+        self.file = None
+        self.file_index = 0
+        self.file_bytes = 0
+        self.file_opened_at = 0.0
+        self.spider_name = None
+        self.run_id = None
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        compression = settings.get("KINOBOX_JSONL_COMPRESSION") or None
+
+        if compression not in COMPRESSION_SUFFIXES:
+            raise NotConfigured(f"Unknown KINOBOX_JSONL_COMPRESSION: {compression}")
+
+        if compression == "zstd" and zstandard is None:
+            raise NotConfigured("KINOBOX_JSONL_COMPRESSION is zstd but the zstandard package is not installed")
+
+        return cls(
+            output_dir=settings.get("KINOBOX_JSONL_DIR", "output"),
+            compression=compression,
+            buffer_size=settings.getint("KINOBOX_JSONL_BUFFER_SIZE", 1024 * 1024),
+            max_bytes=settings.getint("KINOBOX_JSONL_MAX_BYTES", 256 * 1024 * 1024),
+            max_seconds=settings.getint("KINOBOX_JSONL_MAX_SECONDS", 0),
+        )
+
+    def open_spider(self, spider):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.spider_name = spider.name
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+
+    def close_spider(self, spider):
+        self.flush()
+        self.close_file()
+
+    def process_item(self, item, spider):
+        line = (json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False) + "\n").encode("utf-8")
+
+        self.buffer.append(line)
+        self.buffered_bytes += len(line)
+
+        if self.buffered_bytes >= self.buffer_size or (self.file is not None and self.should_rotate()):
+            self.flush()
+
+        return item
+
+    def flush(self) -> None:
+        """
+        Write the buffered lines, rotating the output file when it is full or too old.
+
+        Returns:
+            None
+        """
+        if not self.buffer:
+            return
+
+        if self.file is not None and self.should_rotate():
+            self.close_file()
+
+        if self.file is None:
+            self.open_file()
+
+        self.file.write(b"".join(self.buffer))
+        self.file_bytes += self.buffered_bytes
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def should_rotate(self) -> bool:
+        if self.max_bytes and self.file_bytes >= self.max_bytes:
+            return True
+
+        return bool(self.max_seconds) and time.monotonic() - self.file_opened_at >= self.max_seconds
+
+    def open_file(self) -> None:
+        self.file_index += 1
+        file_name = f"{self.spider_name}-{self.run_id}-{self.file_index:04d}.jsonl{COMPRESSION_SUFFIXES[self.compression]}"
+        path = os.path.join(self.output_dir, file_name)
+
+        if self.compression == "gzip":
+            self.file = gzip.open(path, "ab")
+        elif self.compression == "zstd":
+            self.file = zstandard.ZstdCompressor().stream_writer(open(path, "ab"))
+        else:
+            self.file = open(path, "ab")
+
+        self.file_bytes = 0
+        self.file_opened_at = time.monotonic()
+
+    def close_file(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetExportPipeline:
+    """
+    Writes movies and comments into two Parquet tables joined by the movie id.
+
+    Rows are written in row groups of KINOBOX_PARQUET_ROW_GROUP_SIZE. Repeated strings such as users and directors are
+    dictionary encoded. Enabled with KINOBOX_PARQUET_ENABLED, requires the pyarrow package.
+    """
+
+    # Columns with few distinct values that are dictionary encoded
+    DICTIONARY_COLUMNS = ["director", "screenwriter", "music", "user"]
+
+    def __init__(self, output_dir: str, row_group_size: int):
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+
+        self.movie_schema = pyarrow.schema([
+            ("id", pyarrow.string()),
+            ("title", pyarrow.string()),
+            ("title_eng", pyarrow.string()),
+            ("year", pyarrow.int32()),
+            ("duration_minutes", pyarrow.int32()),
+            ("rating", pyarrow.int32()),
+            ("description", pyarrow.string()),
+            ("main_actors", pyarrow.list_(pyarrow.string())),
+            ("director", pyarrow.string()),
+            ("screenwriter", pyarrow.string()),
+            ("music", pyarrow.string()),
+            ("comments_count", pyarrow.int32()),
+        ])
+        self.comment_schema = pyarrow.schema([
+            ("movie_id", pyarrow.string()),
+            ("user", pyarrow.string()),
+            ("published", pyarrow.string()),
+            ("rating", pyarrow.int32()),
+            ("text", pyarrow.string()),
+            ("likes", pyarrow.int32()),
+        ])
+
+        self.writers = {}
+        self.rows = {"movies": [], "comments": []}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool("KINOBOX_PARQUET_ENABLED", False):
+            raise NotConfigured("KINOBOX_PARQUET_ENABLED is not set")
+
+        if pyarrow is None:
+            raise NotConfigured("ParquetExportPipeline requires the pyarrow package")
+
+        return cls(
+            output_dir=settings.get("KINOBOX_PARQUET_DIR", "output"),
+            row_group_size=settings.getint("KINOBOX_PARQUET_ROW_GROUP_SIZE", 10000),
+        )
+
+    def open_spider(self, spider):
+        os.makedirs(self.output_dir, exist_ok=True)
+        run_id = time.strftime("%Y%m%dT%H%M%S")
+
+        for table, schema in (("movies", self.movie_schema), ("comments", self.comment_schema)):
+            path = os.path.join(self.output_dir, f"{spider.name}-{run_id}-{table}.parquet")
+            self.writers[table] = pyarrow.parquet.ParquetWriter(
+                path,
+                schema,
+                compression="zstd",
+                use_dictionary=[name for name in self.DICTIONARY_COLUMNS if name in schema.names]
+            )
+
+    def close_spider(self, spider):
+        for table, writer in self.writers.items():
+            self.write_rows(table)
+            writer.close()
+
+    def process_item(self, item, spider):
+        if isinstance(item, CommentsPage):
+            self.add_comments(item.movie_id, item.comments)
+            return item
+
+        comments = item.comments or []
+        self.add_row("movies", {
+            "id": str(item.id),
+            "title": item.title,
+            "title_eng": item.title_eng,
+            "year": item.year,
+            "duration_minutes": item.duration,
+            "rating": item.rating,
+            "description": item.description,
+            "main_actors": item.main_actors,
+            "director": item.director,
+            "screenwriter": item.screenwriter,
+            "music": item.music,
+            "comments_count": item.comments_count if item.comments_count is not None else len(comments),
+        })
+        self.add_comments(item.id, comments)
+
+        return item
+
+    def add_comments(self, movie_id, comments: list) -> None:
+        for comment in comments:
+            self.add_row("comments", {
+                "movie_id": str(movie_id),
+                "user": comment.user,
+                "published": comment.published,
+                "rating": comment.rating,
+                "text": comment.text,
+                "likes": comment.likes,
+            })
+
+    def add_row(self, table: str, row: dict) -> None:
+        self.rows[table].append(row)
+
+        if len(self.rows[table]) >= self.row_group_size:
+            self.write_rows(table)
+
+    def write_rows(self, table: str) -> None:
+        """
+        Write the collected rows of the table as one row group.
+
+        Args:
+            table (str): The table name, movies or comments.
+
+        Returns:
+            None
+        """
+        rows = self.rows[table]
+        if not rows:
+            return
+
+        writer = self.writers[table]
+        writer.write_table(pyarrow.Table.from_pylist(rows, schema=writer.schema), row_group_size=len(rows))
+        self.rows[table] = []
+
+
+class SqliteStorePipeline:
+    """
+    Upserts movies and comments into a local SQLite database (KINOBOX_SQLITE_DB) for querying.
+
+    Tables movies, people, movie_people (director, screenwriter, music and actors) and comments are indexed by year,
+    rating, director and comment date. Movies are keyed by their id and comments by the movie id and the hash of
+    their user, date and text, so re-runs and incremental crawls update the rows instead of duplicating them. Items
+    are written in WAL mode in transactions of about KINOBOX_SQLITE_BATCH_ROWS movie and comment rows, a movie with
+    thousands of comments is one large item.
+    """
+
+    def __init__(self, path: str, batch_rows: int):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.connection = None
+        self.items = []
+        self.pending_rows = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool("KINOBOX_SQLITE_ENABLED", False):
+            raise NotConfigured("KINOBOX_SQLITE_ENABLED is not set")
+
+        return cls(
+            path=settings.get("KINOBOX_SQLITE_DB", "output/kinobox.db"),
+            batch_rows=settings.getint("KINOBOX_SQLITE_BATCH_ROWS", 5000),
+        )
+
+    def open_spider(self, spider):
+        self.connection = connect_sqlite(self.path, synchronous="NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS movies (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                title_eng TEXT,
+                year INTEGER,
+                duration INTEGER,
+                rating INTEGER,
+                description TEXT,
+                director TEXT,
+                comments_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS movies_year ON movies (year);
+            CREATE INDEX IF NOT EXISTS movies_rating ON movies (rating);
+            CREATE INDEX IF NOT EXISTS movies_director_rating ON movies (director, rating);
+
+            CREATE TABLE IF NOT EXISTS people (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+
+            CREATE TABLE IF NOT EXISTS movie_people (
+                movie_id TEXT NOT NULL,
+                person_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (movie_id, role, person_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS movie_people_person ON movie_people (person_id, role);
+
+            CREATE TABLE IF NOT EXISTS comments (
+                movie_id TEXT NOT NULL,
+                comment_id TEXT NOT NULL,
+                user TEXT,
+                published TEXT,
+                rating INTEGER,
+                text TEXT,
+                likes INTEGER,
+                PRIMARY KEY (movie_id, comment_id)
+            );
+            CREATE INDEX IF NOT EXISTS comments_published ON comments (published);
+            CREATE INDEX IF NOT EXISTS comments_movie_published ON comments (movie_id, published);
+            """
+        )
+
+    def close_spider(self, spider):
+        self.flush()
+        self.connection.close()
+
+    def process_item(self, item, spider):
+        self.items.append(item)
+
+        if isinstance(item, CommentsPage):
+            self.pending_rows += len(item.comments)
+        else:
+            self.pending_rows += 1 + len(item.comments or [])
+
+        if self.pending_rows >= self.batch_rows:
+            self.flush()
+
+        return item
+
+    def flush(self) -> None:
+        """
+        Write the collected items in one transaction.
+
+        Returns:
+            None
+        """
+        if not self.items:
+            return
+
+        movie_ids = set()
+
+        with self.connection:
+            for item in self.items:
+                if isinstance(item, CommentsPage):
+                    self.upsert_comments(item.movie_id, item.comments)
+                    movie_ids.add(str(item.movie_id))
+                else:
+                    self.upsert_movie(item)
+                    self.upsert_comments(item.id, item.comments or [])
+                    movie_ids.add(str(item.id))
+
+            # incremental and streamed items carry only a part of the comments, count the stored ones
+            self.connection.executemany(
+                "UPDATE movies SET comments_count = (SELECT COUNT(*) FROM comments WHERE movie_id = movies.id) WHERE id = ?",
+                [(movie_id,) for movie_id in movie_ids]
+            )
+
+        self.items = []
+        self.pending_rows = 0
+
+    def upsert_movie(self, movie) -> None:
+        movie_id = str(movie.id)
+
+        self.connection.execute(
+            """
+            INSERT INTO movies (id, title, title_eng, year, duration, rating, description, director, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                title = excluded.title,
+                title_eng = excluded.title_eng,
+                year = excluded.year,
+                duration = excluded.duration,
+                rating = excluded.rating,
+                description = excluded.description,
+                director = excluded.director,
+                updated_at = excluded.updated_at
+            """,
+            (movie_id, movie.title, movie.title_eng, movie.year, movie.duration, movie.rating, movie.description, movie.director, time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+
+        people = [(role, getattr(movie, role), 0) for role in PERSON_ROLES if getattr(movie, role)]
+        people += [("actor", name, position) for position, name in enumerate(movie.main_actors)]
+
+        self.connection.execute("DELETE FROM movie_people WHERE movie_id = ?", (movie_id,))
+        self.connection.executemany("INSERT OR IGNORE INTO people (name) VALUES (?)", [(name,) for _, name, _ in people])
+        self.connection.executemany(
+            """
+            INSERT OR IGNORE INTO movie_people (movie_id, person_id, role, position)
+            SELECT ?, id, ?, ? FROM people WHERE name = ?
+            """,
+            [(movie_id, role, position, name) for role, name, position in people]
+        )
+
+    def upsert_comments(self, movie_id, comments: list) -> None:
+        self.connection.executemany(
+            """
+            INSERT INTO comments (movie_id, comment_id, user, published, rating, text, likes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (movie_id, comment_id) DO UPDATE SET
+                rating = excluded.rating,
+                likes = excluded.likes
+            """,
+            [
+                (str(movie_id), get_comment_id(comment), comment.user, comment.published, comment.rating, comment.text, comment.likes)
+                for comment in comments
+            ]
+        )
+
+
+class SearchIndexPipeline:
+    """
+    Indexes the movie titles, descriptions and comment texts into a SQLite FTS5 index (KINOBOX_SEARCH_DB).
+
+    Documents are upserted while the items are written, in transactions of KINOBOX_SEARCH_BATCH_SIZE items, so the
+    index grows incrementally and re-runs replace the documents instead of duplicating them. Diacritics are folded,
+    queries without the czech accents match the accented words. Queried with crawler.py search.
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        self.path = path
+        self.batch_size = batch_size
+        self.index = None
+        self.documents = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool("KINOBOX_SEARCH_ENABLED", False):
+            raise NotConfigured("KINOBOX_SEARCH_ENABLED is not set")
+
+        return cls(
+            path=settings.get("KINOBOX_SEARCH_DB", "output/search.db"),
+            batch_size=settings.getint("KINOBOX_SEARCH_BATCH_SIZE", 500),
+        )
+
+    def open_spider(self, spider):
+        self.index = SearchIndex(self.path)
+
+    def close_spider(self, spider):
+        self.flush()
+        self.index.close()
+
+    def process_item(self, item, spider):
+        if isinstance(item, CommentsPage):
+            self.add_comments(item.movie_id, item.comments)
+        else:
+            self.documents.append((f"movie:{item.id}", "movie", str(item.id), item.title, item.description))
+            self.add_comments(item.id, item.comments or [])
+
+        if len(self.documents) >= self.batch_size:
+            self.flush()
+
+        return item
+
+    def add_comments(self, movie_id, comments: list) -> None:
+        for comment in comments:
+            if comment.text:
+                key = f"comment:{movie_id}:{get_comment_id(comment)}"
+                self.documents.append((key, "comment", str(movie_id), None, comment.text))
+
+    def flush(self) -> None:
+        if self.documents:
+            self.index.upsert(self.documents)
+            self.documents = []
+
@@ -0,0 +1,374 @@
+# Define here your scheduler and dupefilter
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/scheduler.html
+
+import heapq
+import itertools
+import logging
+import os
+import pickle
+import socket
+import uuid
+
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler, Scheduler
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet.task import LoopingCall
+
+from kinobox_crawler.helpers.frontier import FrontierStore
+
+logger = logging.getLogger(__name__)
+
+# Requests bound to this process: a pooled browser page, or a movie whose comments are collected in its memory
+LOCAL_META_KEYS = ("playwright_page", "movie_data")
+
+
+def is_draining(spider) -> bool:
+    return getattr(spider, "draining", False)
+
+
+def move_to_disk_queue(scheduler: Scheduler) -> None:
+    """
+    Move the requests of the scheduler's memory queue to its disk queue.
+
+    Retried browser requests may still hold a pooled page, which cannot be serialized, the page is left out. Requests
+    that still cannot be serialized are logged and counted in the kinobox/scheduler/dropped stat.
+
+    Args:
+        scheduler (Scheduler): The opened Scrapy scheduler.
+
+    Returns:
+        None
+    """
+    if scheduler.dqs is None:
+        return
+
+    while (request := scheduler.mqs.pop()) is not None:
+        request.meta.pop("playwright_page", None)
+
+        if not scheduler._dqpush(request):
+            logger.warning(f"Dropped {request.url}, it cannot be kept in the job directory")
+            scheduler.stats.inc_value("kinobox/scheduler/dropped", spider=scheduler.spider)
+
+
+class DrainingScheduler(Scheduler):
+    """
+    Scrapy scheduler keeping the requests of in-flight movies (the ones carrying movie_data) in a queue of their own.
+
+    Movie requests are dequeued first. While the spider is draining (see ControlServer) only they are dequeued and
+    counted as pending, so the spider goes idle once the in-flight movies are finished. All other requests stay in the
+    disk queue of the JOBDIR and a resumed crawl continues with them, nothing is pulled into memory to hold them back.
+    """
+
+    def __init__(self, dupefilter, jobdir: str | None = None, *args, **kwargs):
+        super().__init__(dupefilter, jobdir, *args, **kwargs)
+
+        # the dupefilter of this scheduler already checked the movie requests
+        self.movies = Scheduler(BaseDupeFilter(), os.path.join(jobdir, "movies") if jobdir else None, *args, **kwargs)
+
+    def open(self, spider):
+        self.movies.open(spider)
+
+        return super().open(spider)
+
+    def close(self, reason):
+        # the memory queues are lost at close, move their requests to the disk queues of the JOBDIR first
+        for scheduler in (self.movies, self):
+            move_to_disk_queue(scheduler)
+
+        self.movies.close(reason)
+
+        return super().close(reason)
+
+    def has_pending_requests(self) -> bool:
+        if is_draining(self.spider):
+            return len(self.movies) > 0
+
+        return len(self) > 0
+
+    def enqueue_request(self, request) -> bool:
+        if "movie_data" not in request.meta:
+            return super().enqueue_request(request)
+
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+
+        return self.movies.enqueue_request(request)
+
+    def next_request(self):
+        # in-flight movies first, their comments are held until the last page
+        request = self.movies.next_request()
+
+        if request is not None or is_draining(self.spider):
+            return request
+
+        return super().next_request()
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self.movies)
+
+
+class SharedFrontierDupeFilter(BaseDupeFilter):
+    """
+    Request dupefilter with the fingerprints stored in the shared frontier, so no two workers fetch the same page.
+    """
+
+    def __init__(self, path: str, fingerprinter, debug: bool = False):
+        self.path = path
+        self.fingerprinter = fingerprinter
+        self.debug = debug
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.settings.get("KINOBOX_FRONTIER_DB", "crawls/frontier.db"),
+            crawler.request_fingerprinter,
+            crawler.settings.getbool("DUPEFILTER_DEBUG"),
+        )
+
+    def open(self):
+        self.store = FrontierStore(self.path)
+
+    def close(self, reason):
+        self.store.close()
+
+    def request_seen(self, request) -> bool:
+        return not self.store.add_fingerprint(self.fingerprinter.fingerprint(request).hex())
+
+    def forget(self, request) -> None:
+        # the request will not be fetched, let the other workers or the next run fetch it
+        self.store.remove_fingerprint(self.fingerprinter.fingerprint(request).hex())
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug(f"Filtered duplicate request: {request}")
+
+        spider.crawler.stats.inc_value("dupefilter/filtered", spider=spider)
+
+
+class SharedFrontierScheduler(BaseScheduler):
+    """
+    Scheduler pulling the requests from a SQLite frontier (KINOBOX_FRONTIER_DB) shared by several crawler processes.
+
+    Dequeued requests are leased to this worker and deleted by the FrontierAckMiddleware once the requests from
+    their callback are queued, or once their download failed for good. The worker updates its heartbeat every
+    KINOBOX_FRONTIER_HEARTBEAT seconds and requests leased by workers without a heartbeat for
+    KINOBOX_FRONTIER_LEASE_TIMEOUT seconds are requeued, so the pages of a crashed worker, including the ones it was
+    parsing, are fetched by the others. An idle worker is kept open while other workers hold leases, their callbacks
+    may still queue new requests. Requests that cannot leave this process (see LOCAL_META_KEYS) or cannot be
+    serialized stay in a local queue. While the spider is draining, no request is leased and only the local requests
+    of in-flight movies are dequeued.
+    """
+
+    def __init__(self, crawler, dupefilter, path: str, heartbeat_interval: float, lease_timeout: float):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.df = dupefilter
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+
+        self.worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.store = None
+        self.spider = None
+        self.local_queue = []
+        self.movie_queue = []
+        self.local_counter = itertools.count()
+        self.heartbeat = LoopingCall(self.beat)
+
+        # frontier ids leased by this worker and not acked yet, and the ones whose response reached the spider
+        self.leased = set()
+        self.responded = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        scheduler = cls(
+            crawler,
+            build_from_crawler(load_object(settings["DUPEFILTER_CLASS"]), crawler),
+            settings.get("KINOBOX_FRONTIER_DB", "crawls/frontier.db"),
+            settings.getfloat("KINOBOX_FRONTIER_HEARTBEAT", 10.0),
+            settings.getfloat("KINOBOX_FRONTIER_LEASE_TIMEOUT", 120.0),
+        )
+        crawler.signals.connect(scheduler.response_received, signal=signals.response_received)
+        crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.store = FrontierStore(self.path)
+        self.heartbeat.start(self.heartbeat_interval, now=True)
+        logger.info(f"Worker {self.worker} joined the shared frontier {self.path}")
+
+        return self.df.open()
+
+    def close(self, reason):
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+
+        # requests this worker did not finish are left for the other workers or the next run
+        requeued = self.store.release_worker(self.worker)
+        if requeued:
+            logger.info(f"Returned {requeued} unfinished requests to the shared frontier")
+
+        self.return_local_requests()
+        self.store.close()
+
+        return self.df.close(reason)
+
+    def beat(self) -> None:
+        self.store.heartbeat(self.worker)
+        requeued = self.store.requeue_expired(self.lease_timeout)
+
+        if requeued:
+            logger.warning(f"Requeued {requeued} requests leased by workers without a heartbeat")
+            self.stats.inc_value("kinobox/frontier/requeued", requeued, spider=self.spider)
+
+    def return_local_requests(self) -> None:
+        """
+        Move the requests of the local queue to the shared frontier when the worker closes.
+
+        Requests holding only a browser page are queued without it. Requests of a movie collected in this worker
+        cannot be continued elsewhere, they are logged and their fingerprints removed, so they are not filtered out
+        when they are requested again.
+
+        Returns:
+            None
+        """
+        for _, _, request in self.local_queue + self.movie_queue:
+            request.meta.pop("playwright_page", None)
+            payload = self.serialize(request)
+
+            if payload is not None:
+                self.store.push(payload, request.priority)
+                continue
+
+            logger.warning(f"Dropped {request.url}, it belongs to a movie collected by this worker")
+            self.df.forget(request)
+            self.stats.inc_value("kinobox/frontier/dropped", spider=self.spider)
+
+        self.local_queue = []
+        self.movie_queue = []
+
+    def has_pending_requests(self) -> bool:
+        if is_draining(self.spider):
+            return bool(self.movie_queue)
+
+        return bool(self.movie_queue or self.local_queue) or self.store.count_queued() > 0
+
+    def spider_idle(self, spider):
+        # callbacks of the other workers may still queue requests for this one, unless it is draining
+        if not is_draining(spider) and self.store.count_leased(exclude_worker=self.worker) > 0:
+            raise DontCloseSpider
+
+    def enqueue_request(self, request) -> bool:
+        frontier_id = request.meta.pop("frontier_id", None)
+
+        # a retry or a redirect of a leased request takes its place, requests from its callback are new
+        replaced_id = None
+        if frontier_id in self.leased and frontier_id not in self.responded:
+            replaced_id = frontier_id
+            self.leased.discard(frontier_id)
+
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            if replaced_id is not None:
+                self.store.ack(replaced_id)
+            return False
+
+        payload = self.serialize(request)
+
+        if payload is None:
+            queue = self.movie_queue if "movie_data" in request.meta else self.local_queue
+            heapq.heappush(queue, (-request.priority, next(self.local_counter), request))
+            if replaced_id is not None:
+                self.store.ack(replaced_id)
+            self.stats.inc_value("scheduler/enqueued/memory", spider=self.spider)
+        else:
+            self.store.push(payload, request.priority, replaced_id)
+            self.stats.inc_value("scheduler/enqueued/frontier", spider=self.spider)
+
+        self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+
+        return True
+
+    def next_request(self):
+        # local requests first, the in-flight movies of this worker, then the ones holding its browser pages
+        if self.movie_queue:
+            return self.pop_local(self.movie_queue)
+
+        # a draining worker starts no new work
+        if is_draining(self.spider):
+            return None
+
+        if self.local_queue:
+            return self.pop_local(self.local_queue)
+
+        leased = self.store.lease(self.worker)
+        if leased is None:
+            return None
+
+        request_id, payload = leased
+        request = request_from_dict(pickle.loads(payload), spider=self.spider)
+        request.meta["frontier_id"] = request_id
+        self.leased.add(request_id)
+
+        self.stats.inc_value("scheduler/dequeued/frontier", spider=self.spider)
+        self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+
+        return request
+
+    def pop_local(self, queue: list):
+        self.stats.inc_value("scheduler/dequeued/memory", spider=self.spider)
+        self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+
+        return heapq.heappop(queue)[2]
+
+    def ack(self, request) -> None:
+        """
+        Delete the finished request from the shared frontier.
+
+        Args:
+            request (Request): The request whose callback output is queued, or whose download failed for good.
+
+        Returns:
+            None
+        """
+        frontier_id = request.meta.get("frontier_id")
+
+        if frontier_id in self.leased:
+            self.store.ack(frontier_id)
+            self.leased.discard(frontier_id)
+            self.responded.discard(frontier_id)
+
+    def response_received(self, response, request, spider):
+        if request.meta.get("frontier_id") in self.leased:
+            self.responded.add(request.meta["frontier_id"])
+
+    def serialize(self, request) -> bytes | None:
+        """
+        Serialize the request for the shared frontier.
+
+        Args:
+            request (Request): The request.
+
+        Returns:
+            bytes | None: The pickled request, None if it has to stay in this process.
+        """
+        if any(key in request.meta for key in LOCAL_META_KEYS):
+            return None
+
+        try:
+            return pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError):
+            return None
+
+    def __len__(self) -> int:
+        return len(self.movie_queue) + len(self.local_queue) + self.store.count_queued()
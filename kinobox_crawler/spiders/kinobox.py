@@ -1,12 +1,19 @@
 from scrapy.http.response import Response
 from scrapy import Spider, Request
 from playwright.async_api import Page
-from kinobox_crawler.helpers.helpers import should_abort_request
+from kinobox_crawler.helpers.helpers import should_abort_request, needs_browser_render
+from kinobox_crawler.helpers.extractors import extract_movie_data, extract_comments_url, extract_overview_urls, NEXT_PAGE_SELECTOR
+from kinobox_crawler.helpers.comments import CommentsMixin
+from kinobox_crawler.items import Movie
 
 
-class KinoboxSpider(Spider):
+class KinoboxSpider(CommentsMixin, Spider):
     """
     Kinobox crawler that crawls through the best movies list and scrapes the movie details and comments.
+
+    The first ranking page is fetched as static HTML. Once the page count and the page URL scheme are known from it,
+    all remaining ranking pages are requested at once. When the static HTML does not contain the ranking, the pages
+    are rendered in a browser and followed one by one.
     """
 
     name = "kinobox"
@@ -25,7 +32,63 @@ class KinoboxSpider(Spider):
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
         'RETRY_TIMES': 5,  # Retry up to 5 times
         'RETRY_HTTP_CODES': [429],  # Retry on 429 status code
+        'SCHEDULER': 'kinobox_crawler.scheduler.DrainingScheduler',  # Keeps the other requests queued while draining
+        'SPIDER_MIDDLEWARES': {
+            'kinobox_crawler.middlewares.FrontierAckMiddleware': 10,
+        },
+        'DOWNLOADER_MIDDLEWARES': {
+            'kinobox_crawler.middlewares.FrontierAckMiddleware': 50,
+            'kinobox_crawler.middlewares.ResponseCacheMiddleware': 900,
+            'kinobox_crawler.middlewares.AdaptiveThrottleMiddleware': 950,
+            'kinobox_crawler.middlewares.PagePoolMiddleware': 960,
+        },
+        'KINOBOX_CACHE_ENABLED': False,  # Replay responses from KINOBOX_CACHE_DB, e.g. while developing the extraction
+        'KINOBOX_CACHE_TTLS': {  # Seconds a cached response is fresh, by the callback
+            'parse': 24 * 3600,
+            'parse_ranking': 24 * 3600,
+            'parse_overview': 7 * 24 * 3600,
+            'parse_comments': 24 * 3600,
+            '_parse_sitemap': 3600,
+        },
+        'KINOBOX_CACHE_FIRST_COMMENTS_PAGE_TTL': 3600,  # New comments appear on the first page
+        'KINOBOX_CACHE_MAX_BYTES': 2 * 1024 * 1024 * 1024,  # Evict least recently used responses above this size
+        # AdaptiveThrottleMiddleware sets the real concurrency, these are only upper bounds
+        'CONCURRENT_REQUESTS': 48,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 48,
+        'KINOBOX_THROTTLE_BROWSER_MAX': 8,  # Maximum concurrent Playwright pages
+        'KINOBOX_THROTTLE_HTTP_MAX': 32,  # Maximum concurrent plain HTTP requests
         'PLAYWRIGHT_ABORT_REQUEST': should_abort_request,
+        'KINOBOX_BLOCKED_RESOURCE_TYPES': ['image', 'media'],  # Add 'font' and 'stylesheet' to block them too
+        'KINOBOX_BLOCK_THIRD_PARTY_SCRIPTS': True,  # Block scripts outside KINOBOX_ALLOWED_SCRIPT_DOMAINS
+        'KINOBOX_STREAM_COMMENTS': False,  # Emit comments pages as separate items
+        'KINOBOX_PAGE_POOL_SIZE': 8,  # Idle browser pages kept for reuse
+        'KINOBOX_PAGE_MAX_NAVIGATIONS': 50,  # Close a pooled page after this many navigations
+        'PLAYWRIGHT_MAX_PAGES_PER_CONTEXT': 8,
+        'KINOBOX_FILL_RATE_WINDOW': 200,  # Number of recent records the field fill rates are computed over
+        'KINOBOX_FILL_RATE_CLOSE_SPIDER': False,  # Only report a dropped field fill rate, True also stops the crawl
+        'ITEM_PIPELINES': {
+            'kinobox_crawler.pipelines.JsonLinesExportPipeline': 300,
+            'kinobox_crawler.pipelines.ParquetExportPipeline': 310,
+            'kinobox_crawler.pipelines.SqliteStorePipeline': 320,
+            'kinobox_crawler.pipelines.SearchIndexPipeline': 330,
+        },
+        'KINOBOX_JSONL_DIR': 'output',
+        'KINOBOX_JSONL_COMPRESSION': None,  # None, "gzip" or "zstd"
+        'KINOBOX_JSONL_MAX_BYTES': 256 * 1024 * 1024,  # Rotate output files after this many bytes
+        'KINOBOX_JSONL_MAX_SECONDS': 3600,  # Rotate output files after this many seconds
+        'KINOBOX_PARQUET_ENABLED': False,  # Also write movies and comments Parquet tables (requires pyarrow)
+        'KINOBOX_SQLITE_ENABLED': False,  # Also upsert movies and comments into the KINOBOX_SQLITE_DB database
+        'KINOBOX_SQLITE_DB': 'output/kinobox.db',
+        'KINOBOX_SEARCH_ENABLED': False,  # Also index descriptions and comment texts into the KINOBOX_SEARCH_DB index
+        'KINOBOX_SEARCH_DB': 'output/search.db',
+        'EXTENSIONS': {
+            'kinobox_crawler.extensions.MetricsExporter': 500,
+            'kinobox_crawler.extensions.ControlServer': 500,
+        },
+        'KINOBOX_METRICS_ENABLED': True,
+        'KINOBOX_METRICS_PORT': 9410,  # Prometheus metrics at http://localhost:9410/metrics
+        'KINOBOX_CONTROL_ENABLED': True,
+        'KINOBOX_CONTROL_PORT': 9411,  # Control endpoint used by crawler.py stop/pause/resume/throttle
         'JOBDIR': 'crawls/kinobox_jobdir',
         # Telnet user settings
         'TELNETCONSOLE_USERNAME': "scrapy",
@@ -33,8 +96,6 @@ class KinoboxSpider(Spider):
         'TELNETCONSOLE_PORT': [6025]
     }
 
-    movie_comments_map = {}
-
     def start_requests(self):
         """
         Start the requests for the best movies list.
@@ -42,16 +103,14 @@ class KinoboxSpider(Spider):
         for url in self.start_urls:
             yield Request(
                 url,
-                meta={
-                    "playwright": True,
-                    "playwright_include_page": True
-                },
-                callback=self.parse
+                meta={"ranking_page": 1},
+                callback=self.parse_ranking
             )
 
-    async def parse(self, response: Response) -> None:
+    def parse_ranking(self, response: Response) -> None:
         """
-        Parse the best movies list and follow the links to the movie details.
+        Parse the server-rendered best movies list, follow the links to the movie details and schedule the remaining
+        ranking pages.
 
         Args:
             response (Response): The response from the best movies list.
@@ -59,205 +118,152 @@ class KinoboxSpider(Spider):
         Returns:
             None
         """
-        page: Page = response.meta["playwright_page"]
+        current_page = response.meta.get("ranking_page", 1)
+        overview_urls = self.extract_overview_urls(response)
 
-        try:
-            await page.wait_for_selector('.Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv', state="visible")
+        if not overview_urls:
+            # the ranking is not part of the static HTML, fall back to the browser
+            self.logger.info(f"[FALLBACK url: {response.url}] Static ranking page empty, rendering in browser")
+            self.crawler.stats.inc_value("kinobox/ranking_browser_fallback")
+            yield Request(
+                response.url,
+                meta=self.browser_meta(),
+                callback=self.parse,
+                errback=self.page_failed,
+                dont_filter=True
+            )
+            return
+
+        for overview_url in overview_urls:
+            yield response.follow(
+                overview_url,
+                callback=self.parse_overview
+            )
 
-            for movie in response.xpath('//main//li//div[@class = "FilmRankingItemExtended_metaRowWrapper__r3NGx"]'):
-                overview_url = movie.xpath(".//a[@data-context='title']/@href").get()
+        # pages of a fanned out ranking do not schedule any more pages
+        if response.meta.get("ranking_total_pages"):
+            return
 
-                if overview_url:
-                    yield response.follow(
-                        overview_url,
-                        callback=self.parse_overview
-                    )
-        except Exception:
-            self.logger.info("No next page found")
+        next_page_url = self.get_next_page_url(response)
 
-        next_page_url = await page.evaluate('document.querySelector(".Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv").closest("a").href')
+        if current_page == 1 and next_page_url:
+            total_pages = self.get_total_pages(response)
+            page_urls = self.build_page_urls(next_page_url, total_pages)
+
+            if page_urls:
+                self.logger.info(f"Scheduling {total_pages} ranking pages")
+
+                for page_num, page_url in page_urls:
+                    yield Request(
+                        page_url,
+                        meta={"ranking_page": page_num, "ranking_total_pages": total_pages},
+                        callback=self.parse_ranking
+                    )
+                return
 
         if next_page_url:
+            # the page url scheme is unknown, follow the next page link
             yield Request(
                 next_page_url,
-                meta={
-                    "playwright": True,
-                    "playwright_include_page": True
-                },
-                callback=self.parse
+                meta={"ranking_page": current_page + 1},
+                callback=self.parse_ranking
             )
 
-        await page.close()
-
-    def parse_overview(self, response: Response) -> None:
+    async def parse(self, response: Response) -> None:
         """
-        Parse the movie details and follow the link to the comments.
+        Parse the browser rendered best movies list, follow the links to the movie details and the next page.
 
         Args:
-            response (Response): The response from the movie details.
+            response (Response): The response from the best movies list.
 
         Returns:
             None
         """
-        movie_data = self.extract_movie_data(response)
-        comments_url = response.xpath('//ul[@role="list"]/li//i[@title="Komentáře"]/../../../@href').get()
+        page: Page = response.meta["playwright_page"]
+        next_page_url = None
 
-        self.logger.info(f"[STARTED {movie_data['title']}] Started scraping movie")
+        try:
+            await page.wait_for_selector(NEXT_PAGE_SELECTOR, state="visible")
 
-        if comments_url:
-            comments_url = response.urljoin(comments_url)
+            for overview_url in self.extract_overview_urls(response):
+                yield response.follow(
+                    overview_url,
+                    callback=self.parse_overview
+                )
+
+            next_page_url = await page.evaluate(f'document.querySelector("{NEXT_PAGE_SELECTOR}").closest("a").href')
+        except Exception:
+            self.logger.info("No next page found")
+        finally:
+            # the last page or a markup change must not leak the pooled page
+            await self.release_page(page)
+
+        if next_page_url:
             yield Request(
-                comments_url,
-                meta={
-                    "movie_data": movie_data,
-                    "playwright": True,
-                    "playwright_include_page": True,
-                    "page_num": 1,
-                    "url": comments_url
-                },
-                callback=self.parse_comments
+                next_page_url,
+                meta=self.browser_meta(),
+                callback=self.parse,
+                errback=self.page_failed
             )
-        else:
-            yield movie_data
 
-    def extract_movie_data(self, response: Response) -> dict:
+    def extract_overview_urls(self, response: Response) -> list:
         """
-        Extract the movie data from the response.
+        Extract the links to the movie details from the best movies list.
 
         Args:
-            response (Response): The response from the movie details.
+            response (Response): The response from the best movies list.
 
         Returns:
-            dict: The movie data.
+            list: The relative urls of the movie details.
         """
-        title = response.xpath('normalize-space(//h1)').get()
-        title_eng = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]/h2)').get()
-
-        year = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]//p[@class = "FilmLayout_yearLabel__MYmp_"])').get()
-
-        duration = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]//span[2])').get()
-
-        rating = response.xpath('normalize-space(//aside//div[@class = "Score_container__eAKcX Score_positive__IHjEw Score_staticBadge__a4po7 FilmLayout_score__2JrHf"]/div)').get()
-
-        description = response.xpath('normalize-space(//main/div[@class = "ShowMore_container__P4vGZ FilmPageOverviewContainer_summary__DJLug"])').get()
-
-        actors_sel = response.xpath('//section/div/div/a[@class="CastItem_container__hzzP4"]//h4')
-        main_actors = [actor.xpath('normalize-space(.)').get() for actor in actors_sel if actor.xpath('normalize-space(.)').get()]
-
-        roles = [
-            role.xpath("normalize-space(.)").get()
-            for role in response.xpath('//section//div[@class="FilmPageOverviewContainer_castInfo__aPQjG"]//a')
-            if role.xpath("normalize-space(.)").get()
-        ]
-        director = roles[0] if len(roles) > 0 else None
-        screenwriter = roles[1] if len(roles) > 1 else None
-        music = roles[2] if len(roles) > 2 else None
-
-        return {
-            "title": title,
-            "title_eng": title_eng,
-            "year": year,
-            "duration": duration,
-            "rating": rating,
-            "description": description,
-            "main_actors": main_actors,
-            "director": director,
-            "screenwriter": screenwriter,
-            "music": music
-        }
-
-    async def parse_comments(self, response: Response) -> None:
+        return extract_overview_urls(response)
+
+    def parse_overview(self, response: Response) -> None:
         """
-        Parse the comments for the movie.
+        Parse the movie details and follow the link to the comments.
 
         Args:
-            response (Response): The response from the comments page.
+            response (Response): The response from the movie details.
 
         Returns:
             None
         """
-        page: Page = response.meta["playwright_page"]
-        current_page = response.meta.get("page_num", 1)
-
-        movie_data = response.meta["movie_data"]
-        movie_title = movie_data["title"]
+        movie_data = self.extract_movie_data(response)
 
-        try:
-            await page.wait_for_selector('.Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv', state="visible")
-            await page.wait_for_selector('.UserRatingItem_container__HudHI', state="visible")
-
-            self.extract_comments(response, movie_title)
-
-            next_page_url = await page.evaluate('document.querySelector(".Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv").closest("a").href')
-
-            if next_page_url:
-                yield Request(
-                    next_page_url,
-                    meta={
-                        "movie_data": movie_data,
-                        "playwright": True,
-                        "playwright_include_page": True,
-                        "page_num": current_page + 1,
-                        "url": next_page_url
-                    },
-                    callback=self.parse_comments
-                )
-            else:
-                yield self.finalize_movie_data(movie_data, movie_title)
-        except Exception:
-            # it is still possible that there are some comments but no next page button
-            self.extract_comments(response, movie_title)
-            yield self.finalize_movie_data(movie_data, movie_title)
+        if needs_browser_render(response, movie_data):
+            # static HTML is missing required fields, render the page in a browser instead
+            self.logger.info(f"[FALLBACK url: {response.url}] Static overview incomplete, rendering in browser")
+            self.crawler.stats.inc_value("kinobox/overview_browser_fallback")
+            yield response.request.replace(
+                meta={**response.meta, "playwright": True},
+                dont_filter=True
+            )
+            return
 
-        await page.close()
+        self.track_fill_rate(movie_data)
 
-    def finalize_movie_data(self, movie_data: dict, movie_title: str) -> dict:
-        """
-        Add the comments to the movie data.
+        if self.is_duplicate_movie(movie_data.id):
+            self.logger.info(f"[DUPLICATE {movie_data.id} url: {response.url}] Movie already scraped")
+            return
 
-        Args:
-            movie_data (dict): The movie data.
-            movie_title (str): The title of the movie.
+        comments_url = extract_comments_url(response)
 
-        Returns:
-            dict: The movie data with comments.
-        """
-        self.logger.info(f"[FINISHED {movie_title}] Got all comments for movie, comments count: {len(self.movie_comments_map[movie_title])}")
-        movie_data["comments"] = self.movie_comments_map[movie_title]
+        self.logger.info(f"[STARTED {movie_data.title}] Started scraping movie")
 
-        return movie_data
+        if comments_url:
+            comments_url = response.urljoin(comments_url)
+            yield self.comments_request(comments_url, movie_data, response.request.priority)
+        elif self.update_movie_state(movie_data, 0, None, set()):
+            yield movie_data
 
-    def extract_comments(self, response: Response, movie_title: str) -> None:
+    def extract_movie_data(self, response: Response) -> Movie:
         """
-        Read the comments from the response.
+        Extract the movie data from the response.
 
         Args:
-            response (Response): The response from the comments page.
-            movie_title (str): The title of the movie.
+            response (Response): The response from the movie details.
 
         Returns:
-            None
+            Movie: The movie data.
         """
-        if movie_title not in self.movie_comments_map:
-            self.movie_comments_map[movie_title] = []
-
-        comments = []
-
-        for comment in response.xpath('//article[@class = "UserRatingItem_container__HudHI"]'):
-            user = comment.xpath('normalize-space(.//header/div/a)').get()
-            published = comment.xpath('normalize-space(.//header//time)').get()
-            rating = comment.xpath('normalize-space(.//header/div[@class = "UserRatingItem_score__kgilY"])').get()
-            text = comment.xpath('normalize-space(.//div[@class = "ShowMore_container__P4vGZ ShowMore_withoutOverlay__Pv_ox UserRatingItem_ratingContent__i_LV0"])').get()
-            likes = comment.xpath('normalize-space(.//footer//div)').get()
-
-            rating_string = f"{int(float(rating) * 10)}%" if rating else "N/A"
-
-            comments.append({
-                "user": user,
-                "published": published,
-                "rating": rating_string,
-                "text": text,
-                "likes": likes
-            })
-
-        self.movie_comments_map[movie_title].extend(comments)
+        return extract_movie_data(response)
@@ -1,11 +1,14 @@
 from scrapy.http.response import Response
 from scrapy import Request
 from scrapy.spiders import SitemapSpider
-from playwright.async_api import Page
-from kinobox_crawler.helpers.helpers import should_abort_request
+from kinobox_crawler.helpers.helpers import should_abort_request, needs_browser_render, get_movie_id, get_shard
+from kinobox_crawler.helpers.extractors import extract_movie_data, extract_comments_url
+from kinobox_crawler.helpers.comments import CommentsMixin
+from kinobox_crawler.items import Movie
+from kinobox_crawler.helpers.sitemap import StreamingSitemap, parse_lastmod, lastmod_priority
 
 
-class KinoboxSitemapSpider(SitemapSpider):
+class KinoboxSitemapSpider(CommentsMixin, SitemapSpider):
     """
     Kinobox crawler that crawls through the sitemap and scrapes the movie details and comments.
     """
@@ -30,183 +33,194 @@ class KinoboxSitemapSpider(SitemapSpider):
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
         'RETRY_TIMES': 5,  # Retry up to 5 times
         'RETRY_HTTP_CODES': [429],  # Retry on 429 status code
+        'SCHEDULER': 'kinobox_crawler.scheduler.DrainingScheduler',  # Keeps the other requests queued while draining
+        'SPIDER_MIDDLEWARES': {
+            'kinobox_crawler.middlewares.FrontierAckMiddleware': 10,
+        },
+        'DOWNLOADER_MIDDLEWARES': {
+            'kinobox_crawler.middlewares.FrontierAckMiddleware': 50,
+            'kinobox_crawler.middlewares.ResponseCacheMiddleware': 900,
+            'kinobox_crawler.middlewares.AdaptiveThrottleMiddleware': 950,
+            'kinobox_crawler.middlewares.PagePoolMiddleware': 960,
+        },
+        'KINOBOX_CACHE_ENABLED': False,  # Replay responses from KINOBOX_CACHE_DB, e.g. while developing the extraction
+        'KINOBOX_CACHE_TTLS': {  # Seconds a cached response is fresh, by the callback
+            'parse': 24 * 3600,
+            'parse_overview': 7 * 24 * 3600,
+            'parse_comments': 24 * 3600,
+            '_parse_sitemap': 3600,
+        },
+        'KINOBOX_CACHE_FIRST_COMMENTS_PAGE_TTL': 3600,  # New comments appear on the first page
+        'KINOBOX_CACHE_MAX_BYTES': 2 * 1024 * 1024 * 1024,  # Evict least recently used responses above this size
+        # AdaptiveThrottleMiddleware sets the real concurrency, these are only upper bounds
+        'CONCURRENT_REQUESTS': 48,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 48,
+        'KINOBOX_THROTTLE_BROWSER_MAX': 8,  # Maximum concurrent Playwright pages
+        'KINOBOX_THROTTLE_HTTP_MAX': 32,  # Maximum concurrent plain HTTP requests
         'PLAYWRIGHT_ABORT_REQUEST': should_abort_request,
+        'KINOBOX_BLOCKED_RESOURCE_TYPES': ['image', 'media'],  # Add 'font' and 'stylesheet' to block them too
+        'KINOBOX_BLOCK_THIRD_PARTY_SCRIPTS': True,  # Block scripts outside KINOBOX_ALLOWED_SCRIPT_DOMAINS
+        'KINOBOX_STREAM_COMMENTS': False,  # Emit comments pages as separate items
+        'KINOBOX_PAGE_POOL_SIZE': 8,  # Idle browser pages kept for reuse
+        'KINOBOX_PAGE_MAX_NAVIGATIONS': 50,  # Close a pooled page after this many navigations
+        'PLAYWRIGHT_MAX_PAGES_PER_CONTEXT': 8,
+        'KINOBOX_FILL_RATE_WINDOW': 200,  # Number of recent records the field fill rates are computed over
+        'KINOBOX_FILL_RATE_CLOSE_SPIDER': False,  # Only report a dropped field fill rate, True also stops the crawl
+        'ITEM_PIPELINES': {
+            'kinobox_crawler.pipelines.JsonLinesExportPipeline': 300,
+            'kinobox_crawler.pipelines.ParquetExportPipeline': 310,
+            'kinobox_crawler.pipelines.SqliteStorePipeline': 320,
+            'kinobox_crawler.pipelines.SearchIndexPipeline': 330,
+        },
+        'KINOBOX_JSONL_DIR': 'output',
+        'KINOBOX_JSONL_COMPRESSION': None,  # None, "gzip" or "zstd"
+        'KINOBOX_JSONL_MAX_BYTES': 256 * 1024 * 1024,  # Rotate output files after this many bytes
+        'KINOBOX_JSONL_MAX_SECONDS': 3600,  # Rotate output files after this many seconds
+        'KINOBOX_PARQUET_ENABLED': False,  # Also write movies and comments Parquet tables (requires pyarrow)
+        'KINOBOX_SQLITE_ENABLED': False,  # Also upsert movies and comments into the KINOBOX_SQLITE_DB database
+        'KINOBOX_SQLITE_DB': 'output/kinobox.db',
+        'KINOBOX_SEARCH_ENABLED': False,  # Also index descriptions and comment texts into the KINOBOX_SEARCH_DB index
+        'KINOBOX_SEARCH_DB': 'output/search.db',
+        'KINOBOX_SITEMAP_MIN_LASTMOD': None,  # Skip sitemap entries changed before this date, e.g. "2025-01-31"
+        'KINOBOX_SITEMAP_MAX_URLS': 0,  # Maximum number of movie urls scheduled per run, 0 for no limit
+        'KINOBOX_SHARDS': 1,  # Number of workers the movies are partitioned between
+        'KINOBOX_SHARD_ID': 0,  # Shard crawled by this worker, from 0 to KINOBOX_SHARDS - 1
+        'KINOBOX_FRONTIER_HEARTBEAT': 10,  # Seconds between the worker heartbeats in the shared frontier
+        'KINOBOX_FRONTIER_LEASE_TIMEOUT': 120,  # Requeue requests of workers without a heartbeat for this many seconds
+        'EXTENSIONS': {
+            'kinobox_crawler.extensions.MetricsExporter': 500,
+            'kinobox_crawler.extensions.ControlServer': 500,
+        },
+        'KINOBOX_METRICS_ENABLED': True,
+        'KINOBOX_METRICS_PORT': 9410,  # Prometheus metrics at http://localhost:9410/metrics
+        'KINOBOX_CONTROL_ENABLED': True,
+        'KINOBOX_CONTROL_PORT': 9411,  # Control endpoint used by crawler.py stop/pause/resume/throttle
         'JOBDIR': 'crawls/kinobox_sitemap_jobdir',
         'TELNETCONSOLE_USERNAME': "scrapy",
         'TELNETCONSOLE_PASSWORD': "1111",
         'TELNETCONSOLE_PORT': [6025]
     }
 
-    movie_comments_map = {}
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduled_movie_urls = 0
 
-    def parse_overview(self, response: Response) -> None:
+    def _parse_sitemap(self, response: Response) -> None:
         """
-        Parse the movie details and follow the link to the comments.
+        Parse the sitemap as a stream of entries and schedule the movie urls with lastmod based priority.
 
         Args:
-            response (Response): The response from the movie details.
+            response (Response): The response with the sitemap or robots.txt.
 
         Returns:
             None
         """
-        movie_data = self.extract_movie_data(response)
-        self.logger.info(f"[STARTED {movie_data['title']} url: {response.url}] Started scraping movie details")
-        comments_url = response.xpath('//ul[@role="list"]/li//i[@title="Komentáře"]/../../../@href').get()
-
-        if comments_url:
-            comments_url = response.urljoin(comments_url)
-            yield Request(
-                comments_url,
-                meta={
-                    "movie_data": movie_data,
-                    "playwright": True,
-                    "playwright_include_page": True,
-                    "page_num": 1,
-                    "url": comments_url
-                },
-                callback=self.parse_comments
-            )
-        else:
-            yield movie_data
-
-    def extract_movie_data(self, response: Response) -> dict:
+        if response.url.endswith("/robots.txt"):
+            yield from super()._parse_sitemap(response)
+            return
+
+        body = self._get_sitemap_body(response)
+        if body is None:
+            self.logger.warning(f"Ignoring invalid sitemap: {response.url}")
+            return
+
+        sitemap = StreamingSitemap(body)
+        entries = self.sitemap_filter(sitemap)
+
+        if sitemap.type == "sitemapindex":
+            for entry in entries:
+                if any(x.search(entry["loc"]) for x in self._follow):
+                    yield Request(entry["loc"], callback=self._parse_sitemap)
+        elif sitemap.type == "urlset":
+            max_urls = self.settings.getint("KINOBOX_SITEMAP_MAX_URLS", 0)
+
+            for entry in entries:
+                if max_urls and self.scheduled_movie_urls >= max_urls:
+                    self.logger.info(f"Reached the limit of {max_urls} movie urls, skipping the rest of {response.url}")
+                    return
+
+                for regex, callback in self._cbs:
+                    if regex.search(entry["loc"]):
+                        self.scheduled_movie_urls += 1
+                        yield Request(entry["loc"], callback=callback, priority=lastmod_priority(entry.get("lastmod")))
+                        break
+
+    def sitemap_filter(self, entries):
         """
-        Extract the movie data from the response.
+        Filter the sitemap entries by the shard and the minimum lastmod and, in the incremental mode, skip movies
+        that did not change since the last crawl.
 
         Args:
-            response (Response): The response from the movie details.
+            entries (Iterable[dict]): The sitemap entries.
 
         Returns:
-            dict: The movie data.
+            Iterable[dict]: The entries to crawl.
         """
-        title = response.xpath('normalize-space(//h1)').get()
-        title_eng = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]/h2)').get()
-
-        year = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]//p[@class = "FilmLayout_yearLabel__MYmp_"])').get()
-
-        duration = response.xpath('normalize-space(//div[@class = "FilmLayout_metadata__7nnz4"]//span[2])').get()
-
-        rating = response.xpath('normalize-space(//aside//div[@class = "Score_container__eAKcX Score_positive__IHjEw Score_staticBadge__a4po7 FilmLayout_score__2JrHf"]/div)').get()
-
-        description = response.xpath('normalize-space(//main/div[@class = "ShowMore_container__P4vGZ FilmPageOverviewContainer_summary__DJLug"])').get()
-
-        actors_sel = response.xpath('//section/div/div/a[@class="CastItem_container__hzzP4"]//h4')
-        main_actors = [actor.xpath('normalize-space(.)').get() for actor in actors_sel if actor.xpath('normalize-space(.)').get()]
-
-        roles = [
-            role.xpath("normalize-space(.)").get()
-            for role in response.xpath('//section//div[@class="FilmPageOverviewContainer_castInfo__aPQjG"]//a')
-            if role.xpath("normalize-space(.)").get()
-        ]
-        director = roles[0] if len(roles) > 0 else None
-        screenwriter = roles[1] if len(roles) > 1 else None
-        music = roles[2] if len(roles) > 2 else None
-
-        return {
-            "title": title,
-            "title_eng": title_eng,
-            "year": year,
-            "duration": duration,
-            "rating": rating,
-            "description": description,
-            "main_actors": main_actors,
-            "director": director,
-            "screenwriter": screenwriter,
-            "music": music
-        }
-
-    async def parse_comments(self, response: Response) -> None:
-        """
-        Parse the comments for the movie.
-
-        Args:
-            response (Response): The response from the comments page.
+        min_lastmod = parse_lastmod(self.settings.get("KINOBOX_SITEMAP_MIN_LASTMOD"))
+        shards = self.settings.getint("KINOBOX_SHARDS", 1)
+        shard_id = self.settings.getint("KINOBOX_SHARD_ID", 0)
 
-        Returns:
-            None
-        """
-        page: Page = response.meta["playwright_page"]
-        current_page = response.meta.get("page_num", 1)
-
-        movie_data = response.meta["movie_data"]
-        movie_title = movie_data["title"]
-
-        try:
-            await page.wait_for_selector('.Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv', state="visible")
-            await page.wait_for_selector('.UserRatingItem_container__HudHI', state="visible")
-
-            self.extract_comments(response, movie_title)
-
-            next_page_url = await page.evaluate('document.querySelector(".Pagination_container__PMgYg a:not([disabled]) i.Pagination_nextIcon__H_WMv").closest("a").href')
-
-            if next_page_url:
-                yield Request(
-                    next_page_url,
-                    meta={
-                        "movie_data": movie_data,
-                        "playwright": True,
-                        "playwright_include_page": True,
-                        "page_num": current_page + 1,
-                        "url": next_page_url
-                    },
-                    callback=self.parse_comments
-                )
-            else:
-                yield self.finalize_movie_data(movie_data, movie_title)
-        except Exception:
-            # it is still possible that there are some comments but no next page button
-            self.extract_comments(response, movie_title)
-            yield self.finalize_movie_data(movie_data, movie_title)
-
-        await page.close()
-
-    def finalize_movie_data(self, movie_data: dict, movie_title: str) -> dict:
-        """
-        Add the comments to the movie data.
+        for entry in entries:
+            # sitemap indexes are followed by every shard, only the movies are partitioned
+            if shards > 1 and "/film/" in entry["loc"] and get_shard(get_movie_id(entry["loc"]), shards) != shard_id:
+                self.crawler.stats.inc_value("kinobox/sitemap/other_shard")
+                continue
 
-        Args:
-            movie_data (dict): The movie data.
-            movie_title (str): The title of the movie.
+            lastmod = parse_lastmod(entry.get("lastmod"))
 
-        Returns:
-            dict: The movie data with comments.
-        """
-        self.logger.info(f"[FINISHED {movie_title}] Got all comments for movie, comments count: {len(self.movie_comments_map[movie_title])}")
-        movie_data["comments"] = self.movie_comments_map[movie_title]
+            # entries without lastmod are kept, they may still contain changed movies
+            if min_lastmod and lastmod and lastmod < min_lastmod:
+                self.crawler.stats.inc_value("kinobox/sitemap/old_lastmod")
+                continue
 
-        return movie_data
+            if self.is_sitemap_entry_changed(entry):
+                yield entry
 
-    def extract_comments(self, response: Response, movie_title: str) -> None:
+    def parse_overview(self, response: Response) -> None:
         """
-        Read the comments from the response.
+        Parse the movie details and follow the link to the comments.
 
         Args:
-            response (Response): The response from the comments page.
-            movie_title (str): The title of the movie.
+            response (Response): The response from the movie details.
 
         Returns:
             None
         """
-        if movie_title not in self.movie_comments_map:
-            self.movie_comments_map[movie_title] = []
+        movie_data = self.extract_movie_data(response)
+
+        if needs_browser_render(response, movie_data):
+            # static HTML is missing required fields, render the page in a browser instead
+            self.logger.info(f"[FALLBACK url: {response.url}] Static overview incomplete, rendering in browser")
+            self.crawler.stats.inc_value("kinobox/overview_browser_fallback")
+            yield response.request.replace(
+                meta={**response.meta, "playwright": True},
+                dont_filter=True
+            )
+            return
 
-        comments = []
+        self.track_fill_rate(movie_data)
 
-        for comment in response.xpath('//article[@class = "UserRatingItem_container__HudHI"]'):
-            user = comment.xpath('normalize-space(.//header/div/a)').get()
-            published = comment.xpath('normalize-space(.//header//time)').get()
-            rating = comment.xpath('normalize-space(.//header/div[@class = "UserRatingItem_score__kgilY"])').get()
-            text = comment.xpath('normalize-space(.//div[@class = "ShowMore_container__P4vGZ ShowMore_withoutOverlay__Pv_ox UserRatingItem_ratingContent__i_LV0"])').get()
-            likes = comment.xpath('normalize-space(.//footer//div)').get()
+        if self.is_duplicate_movie(movie_data.id):
+            self.logger.info(f"[DUPLICATE {movie_data.id} url: {response.url}] Movie already scraped")
+            return
 
-            rating_string = f"{int(float(rating) * 10)}%" if rating else "N/A"
+        self.logger.info(f"[STARTED {movie_data.title} url: {response.url}] Started scraping movie details")
+        comments_url = extract_comments_url(response)
 
-            comments.append({
-                "user": user,
-                "published": published,
-                "rating": rating_string,
-                "text": text,
-                "likes": likes
-            })
+        if comments_url:
+            comments_url = response.urljoin(comments_url)
+            yield self.comments_request(comments_url, movie_data, response.request.priority)
+        elif self.update_movie_state(movie_data, 0, None, set()):
+            yield movie_data
+
+    def extract_movie_data(self, response: Response) -> Movie:
+        """
+        Extract the movie data from the response.
 
-        self.movie_comments_map[movie_title].extend(comments)
+        Args:
+            response (Response): The response from the movie details.
+
+        Returns:
+            Movie: The movie data.
+        """
+        return extract_movie_data(response)
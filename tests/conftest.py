@@ -0,0 +1,40 @@
+import os
+
+import pytest
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "corpus")
+
+
+@pytest.fixture
+def make_spider():
+    """
+    Create a spider with a stats collector and the given settings, without starting a crawl.
+    """
+    def create(spider_class, **settings):
+        crawler = get_crawler()
+        crawler.stats = MemoryStatsCollector(crawler)
+        spider = spider_class()
+        spider.crawler = crawler
+        spider.settings = Settings(settings)
+
+        return spider
+
+    return create
+
+
+def corpus_response(file_name: str, url: str, replace: tuple = (), meta: dict | None = None) -> HtmlResponse:
+    """
+    Load a page of the benchmark corpus, optionally with some markup replaced.
+    """
+    with open(os.path.join(CORPUS_DIR, file_name), encoding="utf-8") as file:
+        body = file.read()
+
+    for old, new in replace:
+        body = body.replace(old, new)
+
+    return HtmlResponse(url=url, body=body.encode("utf-8"), encoding="utf-8", request=Request(url, meta=meta))
@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from benchmarks.corpus import load_index, load_response
+from benchmarks.extraction import extract, golden_path, to_json_data
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+
+@pytest.mark.parametrize("entry", load_index(), ids=lambda entry: entry["name"])
+def test_extraction_matches_the_golden_data(entry):
+    with open(golden_path(entry), encoding="utf-8") as file:
+        expected = json.load(file)
+
+    for spider in (KinoboxSpider(), KinoboxSitemapSpider()):
+        data = extract(spider, entry, load_response(entry))
+
+        if data is not None:
+            assert json.loads(json.dumps(to_json_data(data))) == expected
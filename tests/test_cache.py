@@ -0,0 +1,113 @@
+import sqlite3
+import time
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.helpers import cache
+from kinobox_crawler.helpers.cache import ResponseCacheStore
+from kinobox_crawler.middlewares import ResponseCacheMiddleware
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+OVERVIEW_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+
+def get_accessed_at(path, key):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT accessed_at FROM responses WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_cache_hits_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "ACCESS_BATCH_SIZE", 3)
+    path = str(tmp_path / "http_cache.db")
+    store = ResponseCacheStore(path, max_bytes=0)
+
+    for key in ("a", "b", "c"):
+        store.put(key, f"https://www.kinobox.cz/{key}", 200, {}, b"<html></html>")
+    stored_at = {key: get_accessed_at(path, key) for key in ("a", "b", "c")}
+
+    assert store.get("a")["body"] == b"<html></html>"
+    assert store.get("b") is not None
+    assert get_accessed_at(path, "a") == stored_at["a"]
+
+    assert store.get("c") is not None
+    assert get_accessed_at(path, "a") > stored_at["a"]
+    assert get_accessed_at(path, "c") > stored_at["c"]
+
+    assert store.get("a") is not None
+    store.close()
+    assert get_accessed_at(path, "a") > stored_at["a"]
+
+
+def test_replaced_response_is_counted_once(tmp_path):
+    store = ResponseCacheStore(str(tmp_path / "http_cache.db"), max_bytes=0)
+
+    store.put("a", "https://www.kinobox.cz/a", 200, {}, b"<html>old</html>")
+    store.put("a", "https://www.kinobox.cz/a", 200, {}, b"<html>new response</html>")
+
+    assert store.total_bytes == store.get_total_bytes()
+    store.close()
+
+
+def create_middleware(tmp_path):
+    store = ResponseCacheStore(str(tmp_path / "http_cache.db"), max_bytes=0)
+    ttls = {"parse_overview": 3600}
+
+    return ResponseCacheMiddleware(store, ttls, 600, 60, MemoryStatsCollector(get_crawler()))
+
+
+def test_fresh_response_is_served_from_the_cache(tmp_path):
+    middleware = create_middleware(tmp_path)
+    spider = KinoboxSpider()
+    request = Request(OVERVIEW_URL, callback=spider.parse_overview)
+
+    assert middleware.process_request(request, None) is None
+    middleware.process_response(request, HtmlResponse(OVERVIEW_URL, body=b"<html>movie</html>", request=request), None)
+
+    cached = middleware.process_request(request.replace(), None)
+    assert cached.body == b"<html>movie</html>"
+    assert "cached" in cached.flags
+
+    # the rendered page is cached apart from the static HTML
+    assert middleware.process_request(request.replace(meta={"playwright": True}), None) is None
+    assert middleware.stats.get_value("kinobox/cache/hit") == 1
+    assert middleware.stats.get_value("kinobox/cache/miss") == 2
+    middleware.store.close()
+
+
+def test_stale_response_is_revalidated(tmp_path, monkeypatch):
+    middleware = create_middleware(tmp_path)
+    request = Request(OVERVIEW_URL)
+    headers = {"ETag": '"v1"', "Content-Type": "text/html"}
+    middleware.process_response(request, HtmlResponse(OVERVIEW_URL, headers=headers, body=b"<html>v1</html>", request=request), None)
+
+    # the default TTL of 600 seconds is over
+    stale_at = time.time() + 601
+    monkeypatch.setattr("kinobox_crawler.middlewares.time.time", lambda: stale_at)
+
+    conditional = request.replace()
+    assert middleware.process_request(conditional, None) is None
+    assert conditional.headers["If-None-Match"] == b'"v1"'
+
+    response = middleware.process_response(conditional, HtmlResponse(OVERVIEW_URL, status=304, request=conditional), None)
+    assert response.status == 200
+    assert response.body == b"<html>v1</html>"
+    assert middleware.stats.get_value("kinobox/cache/revalidated") == 1
+    middleware.store.close()
+
+
+def test_first_comments_page_and_live_pages(tmp_path):
+    middleware = create_middleware(tmp_path)
+    spider = KinoboxSpider()
+
+    first_page = Request(f"{OVERVIEW_URL}/komentare", callback=spider.parse_comments, meta={"page_num": 1})
+    assert middleware.get_ttl(first_page) == 60
+    assert middleware.get_ttl(first_page.replace(meta={"page_num": 2})) == 600
+
+    # a callback driving the browser page cannot run on a cached body
+    live = Request(OVERVIEW_URL, meta={"playwright": True, "playwright_include_page": True})
+    middleware.process_response(live, HtmlResponse(OVERVIEW_URL, body=b"<html></html>", request=live), None)
+    assert middleware.store.get_total_bytes() == 0
+    middleware.store.close()
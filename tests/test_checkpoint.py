@@ -0,0 +1,70 @@
+import sqlite3
+
+from kinobox_crawler.helpers.checkpoint import CommentsCheckpointStore
+from kinobox_crawler.items import Comment, Movie
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+
+def movie():
+    return Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=[], director=None, screenwriter=None, music=None
+    )
+
+
+def comment(user, published):
+    return Comment(user=user, published=published, rating=80, text=f"Komentář od {user}.", likes=1)
+
+
+def test_resumed_movie_is_emitted_with_the_comments_of_both_runs(make_spider, tmp_path):
+    path = str(tmp_path / "comments_checkpoint.db")
+
+    spider = make_spider(KinoboxSpider)
+    spider.open_checkpoint(path)
+    spider.store_comments(1, 1, [comment("jirka", "2024-10-21"), comment("petra", "2024-10-20")])
+    spider.set_total_pages(1, 2)
+    spider.checkpoint.close()
+
+    resumed = make_spider(KinoboxSpider)
+    resumed.open_checkpoint(path)
+    assert resumed.crawler.stats.get_value("kinobox/checkpoint/resumed") == 1
+    assert resumed.movie_comments_map[1]["newest_comment"] == "2024-10-21"
+
+    resumed.store_comments(1, 2, [comment("karel", "2024-10-01")])
+    assert resumed.is_complete(1)
+
+    [item] = resumed.finalize_movie_data(movie(), 1)
+    assert [entry.user for entry in item.comments] == ["jirka", "petra", "karel"]
+    assert resumed.checkpoint.load(stream_comments=False) == {}
+    resumed.checkpoint.close()
+
+
+def test_streamed_pages_keep_only_their_counts(tmp_path):
+    store = CommentsCheckpointStore(str(tmp_path / "comments_checkpoint.db"))
+    state = {"pages": {}, "total_pages": 3, "newest_comment": "2024-10-21", "newest_comment_ids": {"a1"}}
+
+    store.save_page(1, 1, state, 20)
+    store.save_page(1, 2, state, 7)
+
+    assert store.load(stream_comments=True) == {
+        1: {"pages": {1: 20, 2: 7}, "total_pages": 3, "newest_comment": "2024-10-21", "newest_comment_ids": {"a1"}}
+    }
+    store.close()
+
+
+def test_checkpoint_without_movie_data_is_migrated(tmp_path):
+    path = str(tmp_path / "comments_checkpoint.db")
+
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE movies (movie_id TEXT PRIMARY KEY, total_pages INTEGER, newest_comment TEXT, newest_comment_ids TEXT)"
+        )
+        connection.execute("INSERT INTO movies VALUES ('1', 2, NULL, '[]')")
+
+    store = CommentsCheckpointStore(path)
+    assert store.get_movie_data(1) is None
+
+    store.save_movie_data(movie(), "https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare")
+    assert store.get_movie_data(1)[0] == movie()
+    assert store.load(stream_comments=False)[1]["total_pages"] == 2
+    store.close()
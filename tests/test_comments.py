@@ -0,0 +1,134 @@
+import pytest
+from scrapy import Request
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import HtmlResponse
+
+from conftest import corpus_response
+from kinobox_crawler.helpers.comments import new_movie_state
+from kinobox_crawler.items import Comment, CommentsPage, Movie
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+COMMENTS_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare"
+
+
+def comments_page(payload_pages, last_link):
+    links = "".join(f'<a href="?page={page}">{page}</a>' for page in (1, 2, last_link))
+    next_data = f'{{"props":{{"pageProps":{{"banner":{{"pageCount":{payload_pages}}}}}}}}}'
+    body = (
+        f'<html><body><nav class="Pagination_container__Xk20p">{links}</nav>'
+        f'<script id="__NEXT_DATA__" type="application/json">{next_data}</script></body></html>'
+    )
+
+    return HtmlResponse(url=COMMENTS_URL, body=body.encode("utf-8"), encoding="utf-8")
+
+
+def test_total_pages_agree(make_spider):
+    spider = make_spider(KinoboxSpider)
+
+    assert spider.get_total_pages(comments_page(12, 12)) == 12
+    assert spider.crawler.stats.get_value("kinobox/page_count_mismatch") is None
+
+
+def test_total_pages_mismatch_uses_larger_count(make_spider):
+    spider = make_spider(KinoboxSpider)
+
+    # the payload count belongs to another widget on the page
+    assert spider.get_total_pages(comments_page(3, 40)) == 40
+    assert spider.get_total_pages(comments_page(40, 3)) == 40
+    assert spider.crawler.stats.get_value("kinobox/page_count_mismatch") == 2
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.requests = []
+
+    def crawl(self, request):
+        self.requests.append(request)
+
+
+def rozzum():
+    return Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=["Lupita Nyong'o"], director="Chris Sanders", screenwriter=None, music=None
+    )
+
+
+def test_resume_restarts_movies_with_lost_pages(make_spider, tmp_path):
+    path = str(tmp_path / "comments_checkpoint.db")
+    movie = rozzum()
+
+    # the first run parsed one page of each movie and was killed with their remaining pages in flight
+    spider = make_spider(KinoboxSpider)
+    spider.open_checkpoint(path)
+    spider.comments_request(COMMENTS_URL, movie)
+    spider.store_comments(1, 1, [Comment(user="jirka", published="2024-10-20", rating=80, text="Krásné.", likes=3)])
+    spider.checkpoint.save_page(2, 1, new_movie_state(), [])
+    spider.checkpoint.close()
+
+    resumed = make_spider(KinoboxSpider)
+    resumed.crawler.engine = RecordingEngine()
+    resumed.open_checkpoint(path)
+    assert resumed.movie_comments_map[1]["pages"][1][0].user == "jirka"
+
+    with pytest.raises(DontCloseSpider):
+        resumed.restart_orphaned_movies(resumed)
+
+    [request] = resumed.crawler.engine.requests
+    assert request.url == COMMENTS_URL
+    assert request.dont_filter and request.meta["restarted"]
+    assert request.meta["movie_data"] == movie
+    assert resumed.movie_comments_map == {}
+    assert resumed.crawler.stats.get_value("kinobox/checkpoint/restarted") == 1
+    assert resumed.crawler.stats.get_value("kinobox/checkpoint/orphaned") == 1
+
+    # the restarted movie is checkpointed again from its first page
+    assert resumed.checkpoint.get_movie_data(1) == (movie, COMMENTS_URL)
+    assert resumed.checkpoint.get_movie_data(2) is None
+    resumed.checkpoint.close()
+
+
+COMMENTS_FILE = "comments-www-kinobox-cz-film-1-rozzum-v-divocine-komentare.html"
+
+
+def crawl_comments(spider, movie):
+    """
+    Parse the first comments page, then the pages it requested, and return all items.
+    """
+    first = corpus_response(COMMENTS_FILE, COMMENTS_URL, meta=spider.comments_request(COMMENTS_URL, movie).meta)
+    output = list(spider.parse_static_comments(first))
+    requests = [result for result in output if isinstance(result, Request)]
+
+    for request in requests:
+        response = corpus_response(COMMENTS_FILE, request.url, meta=request.meta)
+        output += spider.parse_static_comments(response)
+
+    return requests, [result for result in output if not isinstance(result, Request)]
+
+
+def test_comment_pages_are_requested_at_once(make_spider):
+    spider = make_spider(KinoboxSpider)
+    movie = rozzum()
+
+    requests, items = crawl_comments(spider, movie)
+
+    assert [(request.meta["page_num"], request.meta["total_pages"]) for request in requests] == [(2, 3), (3, 3)]
+    assert requests[1].url == f"{COMMENTS_URL}?page=3"
+    assert not any("playwright" in request.meta for request in requests)
+    assert items == [movie]
+    assert len(movie.comments) == 18
+
+
+def test_streamed_comments_are_emitted_per_page(make_spider):
+    spider = make_spider(KinoboxSpider, KINOBOX_STREAM_COMMENTS=True)
+    movie = rozzum()
+
+    _, items = crawl_comments(spider, movie)
+    pages = [item for item in items if isinstance(item, CommentsPage)]
+
+    assert sorted(page.page for page in pages) == [1, 2, 3]
+    assert all(page.movie_id == 1 and len(page.comments) == 6 for page in pages)
+    assert items[-1] is movie
+    assert movie.comments is None and movie.comments_count == 18
+
+    # only the page counts were held, and they are released with the movie
+    assert spider.movie_comments_map == {}
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.extensions import ControlServer
+from kinobox_crawler.middlewares import AdaptiveThrottleMiddleware
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+
+class FakeEngine:
+    """
+    Stand-in for the Scrapy engine, recording the calls of the control commands.
+    """
+
+    def __init__(self, throttle):
+        self.calls = []
+        self.slot = SimpleNamespace(scheduler=["queued"] * 3)
+        self.downloader = SimpleNamespace(
+            middleware=SimpleNamespace(middlewares=[throttle]),
+            slots={"www.kinobox.cz": SimpleNamespace(delay=0.5)},
+        )
+
+    def pause(self):
+        self.calls.append("pause")
+
+    def unpause(self):
+        self.calls.append("unpause")
+
+    def close_spider(self, spider, reason):
+        self.calls.append(reason)
+
+
+def open_server():
+    crawler = get_crawler()
+    throttle = AdaptiveThrottleMiddleware(Settings(), MemoryStatsCollector(crawler))
+    crawler.engine = FakeEngine(throttle)
+
+    server = ControlServer(crawler, "127.0.0.1", 0)
+    server.spider = KinoboxSpider()
+    server.spider.draining = False
+    server.spider.movie_comments_map = {1: {}, 2: {}}
+
+    return server, crawler.engine
+
+
+def test_status_reports_the_crawl():
+    server, _ = open_server()
+
+    status = server.get_status()
+
+    assert status["spider"] == "kinobox"
+    assert status["in_flight_movies"] == 2
+    assert status["pending_requests"] == 3
+    assert status["throttle"]["http"] == {"limit": 4, "max": 32, "in_flight": 0}
+
+
+def test_drain_resumes_a_paused_crawl_and_closes_when_idle():
+    server, engine = open_server()
+
+    assert server.run_command("pause", {})["paused"]
+    status = server.run_command("drain", {})
+
+    assert status["draining"] and not status["paused"]
+    assert engine.calls == ["pause", "unpause"]
+
+    server.spider_idle(server.spider)
+    assert engine.calls[-1] == "drained"
+
+
+def test_throttle_and_delay_commands():
+    server, engine = open_server()
+
+    status = server.run_command("throttle", {"budget": "browser", "max": "3", "limit": "6"})
+    assert status["throttle"]["browser"]["max"] == 3
+    assert status["throttle"]["browser"]["limit"] == 3
+
+    server.run_command("delay", {"seconds": "1.5"})
+    assert engine.downloader.slots["www.kinobox.cz"].delay == 1.5
+
+
+def test_invalid_commands_are_rejected():
+    server, engine = open_server()
+
+    with pytest.raises(ValueError):
+        server.run_command("restart", {})
+    with pytest.raises(KeyError):
+        server.run_command("throttle", {"budget": "gpu"})
+
+    # an idle spider that is not draining is left to the other extensions
+    server.spider_idle(server.spider)
+    assert engine.calls == []
@@ -0,0 +1,67 @@
+from conftest import corpus_response
+from kinobox_crawler.helpers.extractors import extract_movie_data
+from kinobox_crawler.items import Movie
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+OVERVIEW_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.closed = []
+
+    def close_spider(self, spider, reason):
+        self.closed.append(reason)
+
+
+def movie(director):
+    return Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=[], director=director, screenwriter=None, music=None
+    )
+
+
+def test_selectors_survive_changed_class_hashes():
+    # the rendered page has newer class hashes and a moved year
+    static = extract_movie_data(corpus_response("overview-www-kinobox-cz-film-1-rozzum-v-divocine.html", OVERVIEW_URL))
+    rendered = extract_movie_data(corpus_response("overview-www-kinobox-cz-film-1-rozzum-v-divocine-rendered.html", OVERVIEW_URL))
+
+    for name in ("title", "title_eng", "year", "duration", "director"):
+        assert getattr(rendered, name) == getattr(static, name)
+
+
+def low_fill_spider(make_spider, **settings):
+    spider = make_spider(KinoboxSpider, **settings)
+    spider.crawler.engine = RecordingEngine()
+    spider.min_fill_rates = {"director": 0.5}
+    spider.fill_rate_window = 4
+    spider.fill_rate_close_spider = spider.settings.getbool("KINOBOX_FILL_RATE_CLOSE_SPIDER", False)
+
+    return spider
+
+
+def test_low_fill_rate_is_reported_and_recovers(make_spider):
+    spider = low_fill_spider(make_spider)
+    stats = spider.crawler.stats
+
+    for director in ("Chris Sanders", None, None, None):
+        spider.track_fill_rate(movie(director))
+
+    assert stats.get_value("kinobox/fields/director/low_fill_rate") == 1
+    assert stats.get_value("kinobox/fields/low_fill_rate") == 1
+    assert spider.crawler.engine.closed == []
+
+    for director in ("Chris Sanders", "Chris Sanders", "Chris Sanders"):
+        spider.track_fill_rate(movie(director))
+
+    assert stats.get_value("kinobox/fields/director/low_fill_rate") == 0
+    assert stats.get_value("kinobox/fields/director/filled") == 4
+
+
+def test_low_fill_rate_closes_the_spider_when_enabled(make_spider):
+    spider = low_fill_spider(make_spider, KINOBOX_FILL_RATE_CLOSE_SPIDER=True)
+
+    for _ in range(4):
+        spider.track_fill_rate(movie(None))
+
+    assert spider.crawler.engine.closed == ["low_field_fill_rate"]
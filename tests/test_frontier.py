@@ -0,0 +1,76 @@
+from scrapy import Request, Spider
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.request import RequestFingerprinter
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.helpers.frontier import FrontierStore
+from kinobox_crawler.items import Movie
+from kinobox_crawler.scheduler import SharedFrontierDupeFilter, SharedFrontierScheduler
+
+
+class FrontierSpider(Spider):
+    name = "frontier"
+
+
+def open_worker(path):
+    crawler = get_crawler()
+    crawler.stats = MemoryStatsCollector(crawler)
+    scheduler = SharedFrontierScheduler(crawler, SharedFrontierDupeFilter(path, RequestFingerprinter()), path, 10.0, 120.0)
+    spider = FrontierSpider()
+    spider.crawler = crawler
+    scheduler.open(spider)
+
+    return scheduler
+
+
+def test_expired_leases_are_requeued(tmp_path):
+    store = FrontierStore(str(tmp_path / "frontier.db"))
+    store.push(b"low", 0)
+    store.push(b"high", 5)
+
+    store.heartbeat("alive")
+    assert store.lease("crashed")[1] == b"high"
+    assert store.lease("alive")[1] == b"low"
+    assert store.lease("alive") is None
+
+    # only the worker without a heartbeat loses its lease
+    assert store.requeue_expired(60) == 1
+    assert store.count_leased(exclude_worker="alive") == 0
+    assert store.lease("alive")[1] == b"high"
+    store.close()
+
+
+def test_workers_share_the_queue_and_the_seen_requests(tmp_path):
+    path = str(tmp_path / "frontier.db")
+    first, second = open_worker(path), open_worker(path)
+
+    assert first.enqueue_request(Request("https://www.kinobox.cz/film/1-rozzum-v-divocine"))
+    assert not second.enqueue_request(Request("https://www.kinobox.cz/film/1-rozzum-v-divocine"))
+
+    # the other worker takes the request, it is deleted once acked
+    request = second.next_request()
+    assert request.url == "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+    assert first.next_request() is None
+    second.ack(request)
+    assert not first.has_pending_requests()
+
+    second.close("finished")
+    first.close("finished")
+
+
+def test_movie_requests_stay_with_their_worker(tmp_path):
+    path = str(tmp_path / "frontier.db")
+    first, second = open_worker(path), open_worker(path)
+    movie = Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=[], director=None, screenwriter=None, music=None
+    )
+
+    first.enqueue_request(Request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2", meta={"movie_data": movie}))
+    assert second.next_request() is None
+
+    # a closed worker cannot continue the movie, the page may be requested again
+    first.close("shutdown")
+    assert first.stats.get_value("kinobox/frontier/dropped") == 1
+    assert second.enqueue_request(Request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2"))
+    second.close("finished")
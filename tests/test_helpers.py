@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.helpers.helpers import get_movie_id, RequestBlockingPolicy
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+
+def browser_request(resource_type, url):
+    return SimpleNamespace(resource_type=resource_type, url=url)
+
+
+def test_blocking_policy_defaults():
+    policy = RequestBlockingPolicy()
+
+    assert policy(browser_request("image", "https://img.kinobox.cz/poster.jpg"))
+    assert policy(browser_request("xhr", "https://www.google-analytics.com/g/collect"))
+    assert policy(browser_request("script", "https://cdn.example.com/widget.js"))
+    assert not policy(browser_request("script", "https://static.kinobox.cz/_next/app.js"))
+    assert not policy(browser_request("document", "https://www.kinobox.cz/film/1-rozzum-v-divocine"))
+
+
+def test_blocking_policy_from_settings_counts_requests():
+    stats = MemoryStatsCollector(get_crawler())
+    policy = RequestBlockingPolicy()
+    policy.configure(Settings({
+        "KINOBOX_BLOCKED_RESOURCE_TYPES": ["font"],
+        "KINOBOX_BLOCK_THIRD_PARTY_SCRIPTS": False,
+        "KINOBOX_ESTIMATED_RESOURCE_SIZES": {"font": 1000},
+    }), stats)
+
+    assert policy(browser_request("font", "https://static.kinobox.cz/font.woff2"))
+    assert not policy(browser_request("image", "https://img.kinobox.cz/poster.jpg"))
+    assert not policy(browser_request("script", "https://cdn.example.com/widget.js"))
+
+    assert stats.get_value("kinobox/blocking/blocked/font") == 1
+    assert stats.get_value("kinobox/blocking/bytes_saved/font") == 1000
+    assert stats.get_value("kinobox/blocking/allowed/image") == 1
+
+
+def test_movie_id_from_url():
+    assert get_movie_id("https://www.kinobox.cz/film/1-rozzum-v-divocine") == 1
+    assert get_movie_id("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2") == 1
+    assert get_movie_id("https://www.kinobox.cz/zebricky/nejlepsi/filmy") == "https://www.kinobox.cz/zebricky/nejlepsi/filmy"
+
+
+def test_movie_reached_through_several_urls_is_scraped_once(make_spider):
+    spider = make_spider(KinoboxSpider)
+
+    assert not spider.is_duplicate_movie(get_movie_id("https://www.kinobox.cz/film/1-rozzum-v-divocine"))
+    assert spider.is_duplicate_movie(get_movie_id("https://www.kinobox.cz/film/1-the-wild-robot"))
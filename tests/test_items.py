@@ -0,0 +1,29 @@
+from itemadapter import ItemAdapter
+
+from conftest import corpus_response
+from kinobox_crawler.helpers.extractors import extract_comments, extract_movie_data
+from kinobox_crawler.items import CommentsPage
+
+OVERVIEW_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+
+def test_extracted_items_hold_typed_values():
+    movie = extract_movie_data(corpus_response("overview-www-kinobox-cz-film-1-rozzum-v-divocine.html", OVERVIEW_URL))
+    comments = extract_comments(corpus_response("comments-www-kinobox-cz-film-1-rozzum-v-divocine-komentare.html", f"{OVERVIEW_URL}/komentare"))
+
+    assert (movie.id, movie.year, movie.duration, movie.rating) == (1, 2024, 102, 88)
+    assert all(comment.published[4] == "-" for comment in comments)
+    assert all(comment.rating is None or isinstance(comment.rating, int) for comment in comments)
+
+    # slotted items carry no per-instance dict
+    assert not hasattr(movie, "__dict__")
+    assert not hasattr(comments[0], "__dict__")
+
+
+def test_items_are_exported_as_nested_dicts():
+    comments = extract_comments(corpus_response("comments-www-kinobox-cz-film-1-rozzum-v-divocine-komentare.html", f"{OVERVIEW_URL}/komentare"))
+
+    data = ItemAdapter(CommentsPage(movie_id=1, page=2, comments=comments[:1])).asdict()
+
+    assert data == {"movie_id": 1, "page": 2, "comments": [ItemAdapter(comments[0]).asdict()], "type": "comments"}
+    assert set(data["comments"][0]) == {"user", "published", "rating", "text", "likes"}
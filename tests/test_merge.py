@@ -0,0 +1,102 @@
+import json
+import os
+
+from kinobox_crawler.helpers.merge import merge_outputs, read_records
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_lines(path, records):
+    with open(path, "w", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def comment(user, published, text, likes=0):
+    return {"user": user, "published": published, "rating": 80, "text": text, "likes": likes}
+
+
+def movie(movie_id, title, comments=None, comments_since=None):
+    return {
+        "id": movie_id, "title": title, "title_eng": title, "year": 2024, "duration": 102, "rating": 88,
+        "description": "", "main_actors": [], "director": None, "screenwriter": None, "music": None,
+        "comments": comments, "comments_count": None, "comments_since": comments_since,
+    }
+
+
+def test_merge_legacy_movies_json(tmp_path):
+    with open(os.path.join(REPO_DIR, "movies.json"), encoding="utf-8") as file:
+        legacy = json.load(file)
+    output_path = str(tmp_path / "merged.jsonl")
+
+    counts = merge_outputs([os.path.join(REPO_DIR, "movies.json")], output_path)
+    merged = list(read_records(output_path))
+
+    assert counts["records"] == len(legacy)
+    assert counts["movies"] == len({(record["title"], record["year"]) for record in legacy})
+    assert all(record["id"] is None for record in merged)
+
+    first = next(record for record in merged if record["title"] == legacy[0]["title"])
+    assert isinstance(first["year"], int)
+    assert isinstance(first["duration"], int)
+    assert isinstance(first["rating"], int)
+    assert all(entry["published"][4] == "-" for entry in first["comments"])
+
+
+def test_merge_jsonl_with_comment_pages(tmp_path):
+    old_path = str(tmp_path / "old.jsonl")
+    new_path = str(tmp_path / "new.jsonl")
+    output_path = str(tmp_path / "merged.jsonl.gz")
+
+    write_lines(old_path, [
+        movie(2, "Second", [comment("a", "2024-01-01", "old")]),
+        movie(1, "First", None),
+        {"movie_id": 1, "page": 1, "comments": [comment("b", "2024-02-01", "streamed")], "type": "comments"},
+        {"movie_id": 3, "page": 1, "comments": [comment("c", "2024-02-01", "orphan")], "type": "comments"},
+    ])
+    write_lines(new_path, [
+        movie(2, "Second renamed", [comment("a", "2024-01-01", "old", likes=5), comment("d", "2024-03-01", "new")], "2024-01-01"),
+        {"movie_id": 1, "page": 2, "comments": [comment("b", "2024-02-01", "streamed")], "type": "comments"},
+    ])
+
+    counts = merge_outputs([old_path, new_path], output_path, buffer_size=2)
+    merged = list(read_records(output_path))
+
+    assert counts == {"records": 6, "movies": 2, "comments": 3}
+    assert [record["id"] for record in merged] == [1, 2]
+
+    first, second = merged
+    assert [entry["text"] for entry in first["comments"]] == ["streamed"]
+    assert second["title"] == "Second renamed"
+    assert [entry["text"] for entry in second["comments"]] == ["new", "old"]
+    assert second["comments"][1]["likes"] == 5
+    assert second["comments_since"] is None
+
+
+def test_merge_legacy_record_into_crawled_movie(tmp_path):
+    legacy_path = str(tmp_path / "movies.json")
+    crawl_path = str(tmp_path / "crawl.jsonl")
+    output_path = str(tmp_path / "merged.jsonl")
+
+    with open(legacy_path, "w", encoding="utf-8") as file:
+        json.dump([
+            {
+                "title": "First", "title_eng": "First", "year": "2024", "duration": "1h 42m", "rating": "88%",
+                "description": "N/A", "main_actors": [], "director": "N/A", "screenwriter": "N/A", "music": "N/A",
+                "comments": [comment("a", "1. 1. 2024", "legacy")],
+            },
+            {
+                "title": "Unknown", "title_eng": "Unknown", "year": "2020", "duration": "N/A", "rating": "N/A",
+                "description": "N/A", "main_actors": [], "director": "N/A", "screenwriter": "N/A", "music": "N/A",
+                "comments": [],
+            },
+        ], file)
+
+    write_lines(crawl_path, [movie(1, "First", [comment("a", "2024-01-01", "legacy"), comment("b", "2024-02-01", "new")])])
+
+    counts = merge_outputs([crawl_path, legacy_path], output_path)
+    merged = list(read_records(output_path))
+
+    assert counts == {"records": 3, "movies": 2, "comments": 2}
+    assert [record["id"] for record in merged] == [1, None]
+    assert [entry["text"] for entry in merged[0]["comments"]] == ["new", "legacy"]
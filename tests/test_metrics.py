@@ -0,0 +1,38 @@
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.extensions import MetricsExporter
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+
+def test_metrics_are_rendered_in_the_prometheus_format():
+    crawler = get_crawler()
+    crawler.stats = MemoryStatsCollector(crawler)
+    crawler.stats.set_value("retry/count", 3)
+    crawler.stats.set_value("finish_reason", "finished")
+
+    exporter = MetricsExporter(crawler, "127.0.0.1", 0)
+    exporter.spider = KinoboxSpider()
+    exporter.spider.movie_comments_map = {
+        1: {"pages": {1: [], 2: []}, "total_pages": 5},
+        2: {"pages": {1: []}, "total_pages": None},
+    }
+
+    for latency, meta in ((0.2, {}), (3.0, {}), (7.0, {"playwright": True})):
+        request = Request(URL, callback=exporter.spider.parse_overview, meta={"download_latency": latency, **meta})
+        exporter.response_received(HtmlResponse(URL, request=request), request, exporter.spider)
+
+    lines = exporter.render().splitlines()
+
+    assert 'kinobox_responses_total{callback="parse_overview"} 3' in lines
+    assert 'kinobox_response_latency_seconds_bucket{handler="http",le="0.25"} 1' in lines
+    assert 'kinobox_response_latency_seconds_bucket{handler="http",le="5.0"} 2' in lines
+    assert 'kinobox_response_latency_seconds_count{handler="browser"} 1' in lines
+    assert "kinobox_in_flight_movies 2" in lines
+    assert "kinobox_comment_backlog_pages 3" in lines
+    assert 'kinobox_scrapy_stat{name="retry/count"} 3' in lines
+    assert not any("finish_reason" in line for line in lines)
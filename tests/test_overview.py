@@ -0,0 +1,33 @@
+from conftest import corpus_response
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+OVERVIEW_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+OVERVIEW_FILE = "overview-www-kinobox-cz-film-1-rozzum-v-divocine.html"
+
+
+def test_static_overview_is_parsed_without_the_browser(make_spider):
+    for spider_class in (KinoboxSpider, KinoboxSitemapSpider):
+        spider = make_spider(spider_class)
+
+        [request] = spider.parse_overview(corpus_response(OVERVIEW_FILE, OVERVIEW_URL))
+
+        assert request.url == f"{OVERVIEW_URL}/komentare"
+        assert "playwright" not in request.meta
+        assert request.meta["movie_data"].year == 2024
+
+
+def test_incomplete_static_overview_is_rendered_in_the_browser(make_spider):
+    spider = make_spider(KinoboxSpider)
+    # the year moved out of the static HTML
+    replace = (("FilmLayout_yearLabel__", "FilmLayout_label__"),)
+
+    [request] = spider.parse_overview(corpus_response(OVERVIEW_FILE, OVERVIEW_URL, replace=replace))
+
+    assert request.url == OVERVIEW_URL
+    assert request.meta["playwright"] and request.dont_filter
+    assert spider.crawler.stats.get_value("kinobox/overview_browser_fallback") == 1
+
+    # a rendered page is not rendered again
+    [request] = spider.parse_overview(corpus_response(OVERVIEW_FILE, OVERVIEW_URL, replace=replace, meta={"playwright": True}))
+    assert request.meta["movie_data"].year is None
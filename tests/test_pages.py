@@ -0,0 +1,99 @@
+import asyncio
+
+from scrapy import Request
+
+from conftest import corpus_response
+from kinobox_crawler.middlewares import PagePoolMiddleware
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+
+class FakePage:
+    """
+    Stand-in for a Playwright page, the pool only checks and closes it.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def browser_request(spider):
+    return Request("https://www.kinobox.cz/zebricky/nejlepsi/filmy?page=2", meta=spider.browser_meta())
+
+
+def test_queued_browser_request_holds_no_page(make_spider):
+    spider = make_spider(KinoboxSpider)
+    spider.idle_pages.append(FakePage())
+
+    request = browser_request(spider)
+
+    assert "playwright_page" not in request.meta
+    assert len(spider.idle_pages) == 1
+
+
+def test_page_is_acquired_at_download_and_returned(make_spider):
+    spider = make_spider(KinoboxSpider)
+    middleware = PagePoolMiddleware()
+    page = FakePage()
+    asyncio.run(spider.release_page(page))
+
+    request = browser_request(spider)
+    middleware.process_request(request, spider)
+
+    assert request.meta["playwright_page"] is page
+    assert spider.idle_pages == []
+
+    # the pool is empty, scrapy-playwright opens a new page
+    other = browser_request(spider)
+    middleware.process_request(other, spider)
+    assert "playwright_page" not in other.meta
+    assert spider.crawler.stats.get_value("kinobox/page_pool/created") == 1
+
+
+def test_failed_download_closes_the_page(make_spider):
+    spider = make_spider(KinoboxSpider)
+    middleware = PagePoolMiddleware()
+    page = FakePage()
+    spider.idle_pages.append(page)
+
+    request = browser_request(spider)
+    middleware.process_request(request, spider)
+    asyncio.run(middleware.process_exception(request, TimeoutError(), spider))
+
+    assert page.closed
+    assert "playwright_page" not in request.meta
+
+
+class LastRankingPage(FakePage):
+    """
+    Rendered ranking page with its next page button, but without the link around it.
+    """
+
+    async def wait_for_selector(self, selector, state=None):
+        return None
+
+    async def evaluate(self, expression):
+        raise RuntimeError("Cannot read properties of null (reading 'href')")
+
+
+def test_ranking_page_is_released_when_next_link_fails(make_spider):
+    spider = make_spider(KinoboxSpider)
+    page = LastRankingPage()
+    response = corpus_response(
+        "ranking-www-kinobox-cz-zebricky-nejlepsi-filmy.html",
+        "https://www.kinobox.cz/zebricky/nejlepsi/filmy",
+        meta={"playwright_page": page}
+    )
+
+    async def collect():
+        return [request async for request in spider.parse(response)]
+
+    requests = asyncio.run(collect())
+
+    assert len(requests) == 5
+    assert spider.idle_pages == [page]
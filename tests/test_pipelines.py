@@ -0,0 +1,96 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler import pipelines
+from kinobox_crawler.helpers.merge import read_records
+from kinobox_crawler.items import Comment, CommentsPage, Movie
+from kinobox_crawler.pipelines import JsonLinesExportPipeline, ParquetExportPipeline, SqliteStorePipeline
+
+
+def movie(movie_id, comments):
+    return Movie(
+        id=movie_id, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=[], director="Chris Sanders", screenwriter=None, music=None, comments=comments
+    )
+
+
+def comments(count):
+    return [Comment(user=f"user{index}", published="2024-11-30", rating=80, text="", likes=0) for index in range(count)]
+
+
+def count_rows(path, table):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_sqlite_store_batches_by_rows(tmp_path):
+    path = str(tmp_path / "kinobox.db")
+    pipeline = SqliteStorePipeline(path, batch_rows=10)
+    pipeline.open_spider(None)
+
+    # 1 movie row and 5 comment rows stay buffered
+    pipeline.process_item(movie(1, comments(5)), None)
+    assert count_rows(path, "movies") == 0
+
+    # one item with many comments fills the batch on its own
+    pipeline.process_item(CommentsPage(movie_id=1, page=2, comments=comments(20)), None)
+    assert count_rows(path, "comments") == 20
+    assert pipeline.pending_rows == 0
+
+    pipeline.process_item(movie(2, comments(3)), None)
+    pipeline.close_spider(None)
+
+    assert count_rows(path, "movies") == 2
+    assert count_rows(path, "comments") == 23
+
+
+def test_jsonl_files_are_rotated_and_compressed(tmp_path):
+    pipeline = JsonLinesExportPipeline(str(tmp_path), "gzip", buffer_size=1, max_bytes=1000, max_seconds=0)
+    spider = SimpleNamespace(name="kinobox")
+    pipeline.open_spider(spider)
+
+    for movie_id in range(1, 7):
+        pipeline.process_item(movie(movie_id, comments(2)), spider)
+    pipeline.process_item(CommentsPage(movie_id=6, page=2, comments=comments(1)), spider)
+    pipeline.close_spider(spider)
+
+    paths = sorted(os.path.join(tmp_path, file_name) for file_name in os.listdir(tmp_path))
+    records = [record for path in paths for record in read_records(path)]
+
+    assert len(paths) > 1
+    assert all(path.endswith(".jsonl.gz") for path in paths)
+    assert [record.get("id") for record in records] == [1, 2, 3, 4, 5, 6, None]
+    assert records[-1] == {"movie_id": 6, "page": 2, "comments": [records[0]["comments"][0]], "type": "comments"}
+
+
+def test_parquet_export_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(pipelines, "pyarrow", None)
+
+    with pytest.raises(NotConfigured, match="requires the pyarrow package"):
+        ParquetExportPipeline.from_crawler(get_crawler(settings_dict={"KINOBOX_PARQUET_ENABLED": True}))
+
+
+def test_parquet_tables_are_joined_by_the_movie_id(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    pipeline = ParquetExportPipeline(str(tmp_path), row_group_size=4)
+    spider = SimpleNamespace(name="kinobox")
+    pipeline.open_spider(spider)
+
+    pipeline.process_item(movie(1, comments(5)), spider)
+    pipeline.process_item(CommentsPage(movie_id=1, page=2, comments=comments(2)), spider)
+    pipeline.process_item(movie(2, None), spider)
+    pipeline.close_spider(spider)
+
+    tables = {
+        file_name.rsplit("-", 1)[1]: pyarrow.parquet.read_table(os.path.join(tmp_path, file_name))
+        for file_name in os.listdir(tmp_path)
+    }
+
+    assert tables["movies.parquet"].column("id").to_pylist() == ["1", "2"]
+    assert tables["movies.parquet"].column("comments_count").to_pylist() == [5, 0]
+    assert tables["comments.parquet"].column("movie_id").to_pylist() == ["1"] * 7
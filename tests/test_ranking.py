@@ -0,0 +1,53 @@
+from scrapy import Request
+
+from conftest import corpus_response
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+
+RANKING_URL = "https://www.kinobox.cz/zebricky/nejlepsi/filmy"
+RANKING_FILE = "ranking-www-kinobox-cz-zebricky-nejlepsi-filmy.html"
+
+
+def test_first_ranking_page_fans_out_all_pages(make_spider):
+    spider = make_spider(KinoboxSpider)
+
+    requests = list(spider.parse_ranking(corpus_response(RANKING_FILE, RANKING_URL, meta={"ranking_page": 1})))
+    overviews = [request for request in requests if request.callback == spider.parse_overview]
+    pages = [request for request in requests if request.callback == spider.parse_ranking]
+
+    assert len(overviews) == 5
+    assert overviews[0].url == "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+    assert [request.meta["ranking_page"] for request in pages] == list(range(2, 41))
+    assert pages[-1].url == f"{RANKING_URL}?page=40"
+    assert all(request.meta["ranking_total_pages"] == 40 for request in pages)
+
+
+def test_fanned_out_page_schedules_no_pages(make_spider):
+    spider = make_spider(KinoboxSpider)
+    response = corpus_response(RANKING_FILE, f"{RANKING_URL}?page=2", meta={"ranking_page": 2, "ranking_total_pages": 40})
+
+    requests = list(spider.parse_ranking(response))
+
+    assert all(request.callback == spider.parse_overview for request in requests)
+
+
+def test_ranking_without_page_count_follows_the_next_link(make_spider):
+    spider = make_spider(KinoboxSpider)
+    # without the numbered pagination links the page count is unknown
+    response = corpus_response(RANKING_FILE, RANKING_URL, replace=(('F2s8w">', 'F2s8w">Strana '),), meta={"ranking_page": 1})
+
+    [next_page] = [request for request in spider.parse_ranking(response) if request.callback == spider.parse_ranking]
+
+    assert next_page.url == f"{RANKING_URL}?page=2"
+    assert next_page.meta == {"ranking_page": 2}
+
+
+def test_empty_static_ranking_falls_back_to_the_browser(make_spider):
+    spider = make_spider(KinoboxSpider)
+    response = corpus_response(RANKING_FILE, RANKING_URL, replace=(("FilmRankingItemExtended_", "Banner_"),))
+
+    [request] = spider.parse_ranking(response)
+
+    assert isinstance(request, Request)
+    assert request.callback == spider.parse
+    assert request.meta["playwright"] and request.dont_filter
+    assert spider.crawler.stats.get_value("kinobox/ranking_browser_fallback") == 1
@@ -0,0 +1,88 @@
+from scrapy import Request, Spider
+from scrapy.utils.misc import build_from_crawler
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.items import Movie
+from kinobox_crawler.scheduler import DrainingScheduler
+
+
+class DrainSpider(Spider):
+    name = "drain"
+
+
+def open_scheduler(job_dir):
+    crawler = get_crawler(DrainSpider, {"JOBDIR": str(job_dir)})
+    spider = DrainSpider()
+    scheduler = build_from_crawler(DrainingScheduler, crawler)
+    scheduler.open(spider)
+
+    return scheduler, spider
+
+
+def movie_request(url):
+    return Request(url, meta={"movie_data": Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="", main_actors=[], director=None, screenwriter=None, music=None
+    )})
+
+
+def test_draining_serves_only_movie_requests(tmp_path):
+    scheduler, spider = open_scheduler(tmp_path)
+    scheduler.enqueue_request(Request("https://www.kinobox.cz/film/2-sedm"))
+    scheduler.enqueue_request(movie_request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2"))
+    scheduler.enqueue_request(movie_request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=3"))
+
+    spider.draining = True
+
+    assert scheduler.has_pending_requests()
+    assert "movie_data" in scheduler.next_request().meta
+    assert "movie_data" in scheduler.next_request().meta
+    assert scheduler.next_request() is None
+    assert not scheduler.has_pending_requests()
+    assert len(scheduler) == 1
+
+    scheduler.close("drained")
+
+    # the held back request is still in the job directory
+    resumed, _ = open_scheduler(tmp_path)
+    assert resumed.next_request().url == "https://www.kinobox.cz/film/2-sedm"
+    assert resumed.next_request() is None
+    resumed.close("finished")
+
+
+def test_movie_requests_are_served_first(tmp_path):
+    scheduler, _ = open_scheduler(tmp_path)
+    scheduler.enqueue_request(Request("https://www.kinobox.cz/film/2-sedm", priority=10))
+    scheduler.enqueue_request(movie_request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2"))
+
+    assert "movie_data" in scheduler.next_request().meta
+    assert scheduler.next_request().url == "https://www.kinobox.cz/film/2-sedm"
+    scheduler.close("finished")
+
+
+class PooledPage:
+    """
+    Stand-in for a live Playwright page, which cannot be serialized.
+    """
+
+    def __reduce__(self):
+        raise TypeError("cannot pickle a browser page")
+
+
+def test_close_keeps_requests_holding_a_page(tmp_path):
+    scheduler, spider = open_scheduler(tmp_path)
+    movie = movie_request("https://www.kinobox.cz/film/1-rozzum-v-divocine/komentare?page=2")
+    movie.meta.update(playwright=True, playwright_include_page=True, playwright_page=PooledPage())
+    overview = Request("https://www.kinobox.cz/film/2-sedm", meta={"playwright": True, "playwright_page": PooledPage()})
+    scheduler.enqueue_request(movie)
+    scheduler.enqueue_request(overview)
+
+    spider.draining = True
+    scheduler.close("drained")
+
+    resumed, _ = open_scheduler(tmp_path)
+    requests = [resumed.next_request(), resumed.next_request()]
+    assert [request.url for request in requests] == [movie.url, overview.url]
+    assert all("playwright_page" not in request.meta for request in requests)
+    assert requests[0].meta["movie_data"].id == 1
+    resumed.close("finished")
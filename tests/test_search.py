@@ -0,0 +1,66 @@
+import sqlite3
+
+from kinobox_crawler.helpers.search import SearchIndex, build_match_query
+from kinobox_crawler.items import Comment, CommentsPage, Movie
+from kinobox_crawler.pipelines import SearchIndexPipeline
+
+
+def movie(comments):
+    return Movie(
+        id=1, title="Rozzum v divočině", title_eng="The Wild Robot", year=2024, duration=102, rating=88,
+        description="Příběh robotky, která ztroskotá na pustém ostrově.", main_actors=[], director=None,
+        screenwriter=None, music=None, comments=comments
+    )
+
+
+def index_items(path, items):
+    pipeline = SearchIndexPipeline(path, batch_size=2)
+    pipeline.open_spider(None)
+
+    for item in items:
+        pipeline.process_item(item, None)
+
+    pipeline.close_spider(None)
+
+
+def test_indexed_items_are_found_without_accents(tmp_path):
+    path = str(tmp_path / "search.db")
+    comment = Comment(user="jirka", published="2024-10-20", rating=80, text="Krásný film o přátelství.", likes=3)
+    streamed = Comment(user="petra", published="2024-10-21", rating=60, text="Přátelství zvířat dojme.", likes=None)
+
+    index_items(path, [movie([comment]), CommentsPage(movie_id=1, page=2, comments=[streamed])])
+
+    index = SearchIndex(path)
+    movies = index.search("pribeh robot*")
+    comments = index.search("pratelstvi", kind="comment")
+
+    assert [(result["kind"], result["movie_id"]) for result in movies] == [("movie", "1")]
+    assert "[Příběh]" in movies[0]["snippet"]
+    assert len(comments) == 2
+    assert all(result["title"] == "Rozzum v divočině" for result in comments)
+    assert index.search("pratelstvi", kind="movie") == []
+    index.close()
+
+
+def test_reindexed_movie_replaces_its_documents(tmp_path):
+    path = str(tmp_path / "search.db")
+    comment = Comment(user="jirka", published="2024-10-20", rating=80, text="Krásný film.", likes=3)
+
+    index_items(path, [movie([comment])])
+    updated = movie([comment])
+    updated.description = "Robotka se učí přežít."
+    index_items(path, [updated])
+
+    index = SearchIndex(path)
+    assert index.search("ztroskota") == []
+    assert len(index.search("prezit")) == 1
+    index.close()
+
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 2
+
+
+def test_match_query_quotes_the_words():
+    assert build_match_query("válečný film*") == '"válečný" "film"*'
+    assert build_match_query('NOT "robot" OR') == '"NOT" """robot""" "OR"'
+    assert build_match_query(" * ") == ""
@@ -0,0 +1,41 @@
+import crawler
+from kinobox_crawler.helpers.helpers import get_movie_id, get_shard
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+MOVIE_URLS = [f"https://www.kinobox.cz/film/{movie_id}-film-{movie_id}" for movie_id in range(1, 401)]
+
+
+def test_shard_is_stable_and_spread():
+    shards = [get_shard(get_movie_id(url), 4) for url in MOVIE_URLS]
+
+    # CRC32 is the same in every process, unlike hash() with a random seed
+    assert get_shard(1, 4) == get_shard("1", 4) == 3
+    assert all(60 < shards.count(shard_id) < 140 for shard_id in range(4))
+
+
+def test_sitemap_entries_are_partitioned_between_shards(make_spider):
+    entries = [{"loc": url} for url in MOVIE_URLS] + [{"loc": "https://www.kinobox.cz/sitemap/films-2.xml"}]
+    crawled = []
+
+    for shard_id in range(3):
+        spider = make_spider(KinoboxSitemapSpider, KINOBOX_SHARDS=3, KINOBOX_SHARD_ID=shard_id)
+        locs = [entry["loc"] for entry in spider.sitemap_filter(entries)]
+
+        # every shard follows the sitemap indexes
+        assert "https://www.kinobox.cz/sitemap/films-2.xml" in locs
+        assert spider.crawler.stats.get_value("kinobox/sitemap/other_shard") == len(MOVIE_URLS) + 1 - len(locs)
+        crawled += [loc for loc in locs if "/film/" in loc]
+
+    assert sorted(crawled) == sorted(MOVIE_URLS)
+
+
+def test_shard_workers_do_not_share_files_or_ports():
+    workers = [crawler.get_shard_settings("kinobox_sitemap", 3, shard_id) for shard_id in range(3)]
+
+    for key in ("JOBDIR", "KINOBOX_JSONL_DIR", "KINOBOX_METRICS_PORT", "KINOBOX_CONTROL_PORT"):
+        assert len({worker[key] for worker in workers}) == 3
+    assert [worker["KINOBOX_SHARD_ID"] for worker in workers] == [0, 1, 2]
+
+    # workers of a shared frontier are not partitioned
+    frontier = crawler.get_shard_settings("kinobox_sitemap", 3, 2, frontier=True)
+    assert (frontier["KINOBOX_SHARDS"], frontier["KINOBOX_SHARD_ID"]) == (1, 0)
@@ -0,0 +1,42 @@
+from datetime import date
+
+from kinobox_crawler.helpers.sitemap import lastmod_priority, StreamingSitemap
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+    <url><loc>https://www.kinobox.cz/film/1-rozzum-v-divocine</loc><lastmod>2024-11-30T10:00:00+00:00</lastmod></url>
+    <url><loc>https://www.kinobox.cz/film/2-sedm</loc><lastmod>2019-05-01</lastmod></url>
+    <url><loc>https://www.kinobox.cz/film/3-tenkrat-na-zapade</loc></url>
+</urlset>
+"""
+
+
+def test_streaming_sitemap_entries():
+    sitemap = StreamingSitemap(SITEMAP)
+
+    assert sitemap.type == "urlset"
+    assert list(sitemap) == [
+        {"loc": "https://www.kinobox.cz/film/1-rozzum-v-divocine", "lastmod": "2024-11-30T10:00:00+00:00"},
+        {"loc": "https://www.kinobox.cz/film/2-sedm", "lastmod": "2019-05-01"},
+        {"loc": "https://www.kinobox.cz/film/3-tenkrat-na-zapade"},
+    ]
+
+
+def test_recently_changed_movies_get_higher_priority():
+    today = date(2024, 12, 1)
+
+    assert lastmod_priority("2024-11-30T10:00:00+00:00", today) == 4
+    assert lastmod_priority("2024-11-20", today) == 2
+    assert lastmod_priority("2019-05-01", today) == 0
+    assert lastmod_priority(None, today) == lastmod_priority("not a date", today) == 0
+
+
+def test_old_lastmod_entries_are_filtered(make_spider):
+    spider = make_spider(KinoboxSitemapSpider, KINOBOX_SITEMAP_MIN_LASTMOD="2020-01-01")
+
+    locs = [entry["loc"] for entry in spider.sitemap_filter(StreamingSitemap(SITEMAP))]
+
+    # entries without lastmod are kept
+    assert locs == ["https://www.kinobox.cz/film/1-rozzum-v-divocine", "https://www.kinobox.cz/film/3-tenkrat-na-zapade"]
+    assert spider.crawler.stats.get_value("kinobox/sitemap/old_lastmod") == 1
@@ -0,0 +1,33 @@
+from conftest import corpus_response
+from kinobox_crawler.items import Movie
+from kinobox_crawler.spiders.kinobox import KinoboxSpider
+from kinobox_crawler.spiders.kinobox_sitemap import KinoboxSitemapSpider
+
+OVERVIEW_URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+# the movie has no comments yet, so there is no comments link
+NO_COMMENTS = (('<i title="Komentáře"', '<i title="Galerie"'),)
+
+
+def parse_overview(spider):
+    response = corpus_response("overview-www-kinobox-cz-film-1-rozzum-v-divocine.html", OVERVIEW_URL, NO_COMMENTS)
+
+    return list(spider.parse_overview(response))
+
+
+def test_incremental_movie_without_comments(make_spider, tmp_path):
+    for spider_class in (KinoboxSpider, KinoboxSitemapSpider):
+        state_db = str(tmp_path / f"{spider_class.name}.db")
+        spider = make_spider(spider_class, KINOBOX_INCREMENTAL=True, KINOBOX_STATE_DB=state_db)
+
+        items = parse_overview(spider)
+
+        assert len(items) == 1 and isinstance(items[0], Movie)
+        assert spider.get_state_store().get(1)["comments_count"] == 0
+        spider.closed("finished")
+
+        # the unchanged movie is not emitted again by the next run
+        spider = make_spider(spider_class, KINOBOX_INCREMENTAL=True, KINOBOX_STATE_DB=state_db)
+        assert parse_overview(spider) == []
+        assert spider.crawler.stats.get_value("kinobox/incremental/unchanged_movie") == 1
+        spider.closed("finished")
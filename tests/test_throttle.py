@@ -0,0 +1,92 @@
+import asyncio
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from kinobox_crawler.middlewares import AdaptiveThrottleMiddleware, ThrottleBudget
+
+URL = "https://www.kinobox.cz/film/1-rozzum-v-divocine"
+
+
+def create_middleware(**settings):
+    stats = MemoryStatsCollector(get_crawler())
+
+    return AdaptiveThrottleMiddleware(Settings(settings), stats), stats
+
+
+def download(middleware, request, status=200, headers=None):
+    # a paused budget schedules its wake up on the running loop, as in the crawl
+    async def fetch():
+        await middleware.process_request(request, None)
+        return middleware.process_response(request, HtmlResponse(URL, status=status, headers=headers, request=request), None)
+
+    return asyncio.run(fetch())
+
+
+def test_throttled_response_shrinks_and_pauses_only_its_budget(monkeypatch):
+    middleware, stats = create_middleware(KINOBOX_THROTTLE_BROWSER_START=4)
+    browser, http = middleware.budgets["browser"], middleware.budgets["http"]
+
+    download(middleware, Request(URL, meta={"playwright": True}), status=429, headers={"Retry-After": "30"})
+
+    assert browser.limit == 2
+    assert browser.in_flight == 0
+    assert not browser.has_slot()
+    assert http.has_slot() and http.limit == 4
+    assert stats.get_value("kinobox/throttle/browser/throttled") == 1
+
+    # the pause ends after the Retry-After time
+    resumed_at = browser.blocked_until
+    monkeypatch.setattr("kinobox_crawler.middlewares.time.monotonic", lambda: resumed_at)
+    assert browser.has_slot()
+
+
+def test_budget_grows_after_a_window_of_fast_responses():
+    middleware, stats = create_middleware(KINOBOX_THROTTLE_WINDOW=3, KINOBOX_THROTTLE_HTTP_MAX=5)
+    http = middleware.budgets["http"]
+
+    for _ in range(6):
+        download(middleware, Request(URL, meta={"download_latency": 0.2}))
+
+    assert http.limit == 5
+    assert stats.get_value("kinobox/throttle/http/limit") == 5
+
+
+def test_slow_responses_shrink_the_budget():
+    middleware, stats = create_middleware(KINOBOX_THROTTLE_WINDOW=3, KINOBOX_THROTTLE_TARGET_LATENCY=1.0)
+
+    for _ in range(3):
+        download(middleware, Request(URL, meta={"download_latency": 2.5}))
+
+    assert middleware.budgets["http"].limit == 2
+    assert stats.get_value("kinobox/throttle/http/slow") == 1
+
+
+def test_retry_after_date_and_default():
+    middleware, _ = create_middleware(KINOBOX_THROTTLE_RETRY_AFTER=7)
+
+    assert middleware.get_retry_after(HtmlResponse(URL, status=429)) == 7
+    assert middleware.get_retry_after(HtmlResponse(URL, status=429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert middleware.get_retry_after(HtmlResponse(URL, status=429, headers={"Retry-After": "soon"})) == 7
+
+
+def test_acquire_waits_for_a_released_slot():
+    budget = ThrottleBudget("http", 1, 1, 1)
+    order = []
+
+    async def request(name):
+        await budget.acquire()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        budget.release()
+
+    async def crawl():
+        await asyncio.gather(request("first"), request("second"))
+
+    asyncio.run(crawl())
+
+    assert order == ["first", "second"]
+    assert budget.in_flight == 0